@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import weakref
+from collections import deque
+from dataclasses import dataclass, asdict
+from typing import Callable, Deque, Dict, Optional
+
+from fastapi import HTTPException
+
+logger = logging.getLogger("rdify.admission")
+
+
+@dataclass
+class AdmissionLimits:
+    # 0 表示不限制
+    max_concurrency: int = 0
+    max_queue: int = 0
+    max_queue_time: float = 30.0
+    retry_after: int = 1
+
+
+def load_limits() -> Dict[str, AdmissionLimits]:
+    """
+    从 RDIFY_MODEL_LIMITS 读取按模型 ID 配置的限制，"*" 为默认值，例如：
+        {"*": {"max_concurrency": 64, "max_queue": 128},
+         "redirect-model": {"max_concurrency": 200, "max_queue": 400, "max_queue_time": 10}}
+    """
+    raw = os.getenv("RDIFY_MODEL_LIMITS")
+    if not raw:
+        return {}
+    return {model_id: AdmissionLimits(**limits) for model_id, limits in json.loads(raw).items()}
+
+
+class ModelAdmission:
+    """
+    单个模型的并发控制：超过 max_concurrency 的请求进入 FIFO 等待队列，
+    队列满返回 429，排队超过 max_queue_time 返回 503，均带 Retry-After。
+    """
+
+    def __init__(self, model_id: str, limits: AdmissionLimits):
+        self.model_id = model_id
+        self.limits = limits
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _reject(self, status_code: int, detail: str):
+        raise HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(self.limits.retry_after)},
+        )
+
+    async def acquire(self) -> float:
+        """
+        获取一个并发槽位，返回排队等待的秒数
+        """
+        limits = self.limits
+        if limits.max_concurrency <= 0 or (self.active < limits.max_concurrency and not self._waiters):
+            self.active += 1
+            self.admitted += 1
+            return 0.0
+        if 0 < limits.max_queue <= len(self._waiters):
+            self.rejected_queue_full += 1
+            self._reject(429, f"Model {self.model_id} is overloaded, queue is full")
+
+        start = time.perf_counter()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout=limits.max_queue_time)
+        except asyncio.TimeoutError:
+            self.rejected_timeout += 1
+            self._reject(503, f"Model {self.model_id} is overloaded, queue time exceeded")
+        except asyncio.CancelledError:
+            # 排队期间客户端离开：若槽位恰好已转交给本请求，需要归还
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        wait = time.perf_counter() - start
+        self.admitted += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        return wait
+
+    def release(self):
+        # 槽位直接转交给队首仍在等待的请求，active 不变
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            "model": self.model_id,
+            "limits": asdict(self.limits),
+            "active": self.active,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "avg_wait": self.total_wait / self.admitted if self.admitted else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+class AdmissionController:
+    def __init__(self, limits: Optional[Dict[str, AdmissionLimits]] = None):
+        self.limits = load_limits() if limits is None else limits
+        self.models: Dict[str, ModelAdmission] = {}
+
+    def get(self, model_id: str) -> ModelAdmission:
+        admission = self.models.get(model_id)
+        if admission is None:
+            limits = self.limits.get(model_id) or self.limits.get("*") or AdmissionLimits()
+            admission = self.models[model_id] = ModelAdmission(model_id, limits)
+        return admission
+
+    async def acquire(self, model_id: str) -> Callable[[], None]:
+        """
+        获取槽位，返回只会生效一次的 release 函数
+        """
+        admission = self.get(model_id)
+        await admission.acquire()
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                admission.release()
+        return release
+
+    def stats(self) -> list:
+        return [admission.stats() for admission in self.models.values()]
+
+
+def release_after(event_generator, release: Callable[[], None]):
+    """
+    包装 SSE 事件生成器，流结束（含断开 / 异常）时归还槽位；
+    若响应从未开始迭代，则在生成器被回收时归还。
+    """
+    released = False
+
+    def release_once():
+        nonlocal released
+        if not released:
+            released = True
+            release()
+
+    async def generator():
+        try:
+            async for data in event_generator():
+                yield data
+        finally:
+            release_once()
+
+    def factory():
+        gen = generator()
+        weakref.finalize(gen, release_once)
+        return gen
+    return factory
+
+
+ADMISSION = AdmissionController()
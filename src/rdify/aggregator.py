@@ -0,0 +1,100 @@
+from typing import Dict, List, Optional, Union
+
+from .openai_schemas import ChatCompletionChoice, ChatMessage, CompletionChoice
+from .sse import StreamDelta
+
+
+class _ChoiceBuffer:
+    __slots__ = ("role", "parts", "finish_reason")
+
+    def __init__(self):
+        self.role: Optional[str] = None
+        # 先收集片段，结束时一次性 join，避免 += 带来的平方复杂度
+        self.parts: List[str] = []
+        self.finish_reason: Optional[str] = None
+
+    def add(self, content: Optional[str], role: Optional[str] = None, finish_reason: Optional[str] = None):
+        if role and self.role is None:
+            self.role = role
+        if content:
+            self.parts.append(content)
+        if finish_reason is not None:
+            self.finish_reason = finish_reason
+
+    def text(self) -> str:
+        return "".join(self.parts)
+
+
+class ChatAggregator:
+    """
+    将流式 chunk 按 choice index 合并为完整消息（非 stream 模式使用）。
+
+    chunk 可以是 StreamDelta、ChatCompletionChoice，也可以是带 choices 的上游 ChatCompletionChunk。
+    只保留每个 choice 的文本片段，chunk 对象本身不会被持有。
+    """
+
+    def __init__(self):
+        self._choices: Dict[int, _ChoiceBuffer] = {}
+
+    def _buffer(self, index: int) -> _ChoiceBuffer:
+        buffer = self._choices.get(index)
+        if buffer is None:
+            buffer = self._choices[index] = _ChoiceBuffer()
+        return buffer
+
+    def add(self, chunk):
+        if isinstance(chunk, StreamDelta):
+            self._buffer(chunk.index).add(chunk.content, chunk.role, chunk.finish_reason)
+            return
+        if hasattr(chunk, "choices"):
+            for choice in chunk.choices:
+                delta = choice.delta
+                self._buffer(choice.index).add(delta.content, delta.role, choice.finish_reason)
+            return
+        delta = chunk.delta
+        if delta is not None and delta.content is not None:
+            content, role = delta.content, delta.role or chunk.message.role
+        else:
+            content, role = chunk.message.content, chunk.message.role
+        self._buffer(chunk.index).add(content, role, chunk.finish_reason)
+
+    def result(self) -> List[ChatCompletionChoice]:
+        if not self._choices:
+            self._buffer(0)
+        return [
+            ChatCompletionChoice(
+                index=index,
+                message=ChatMessage(role=buffer.role or "assistant", content=buffer.text()),
+                finish_reason=buffer.finish_reason or "stop",
+                delta=None,
+            )
+            for index, buffer in sorted(self._choices.items())
+        ]
+
+
+class CompletionAggregator:
+    """
+    将流式 StreamDelta / CompletionChoice 按 index 合并为完整文本。
+    """
+
+    def __init__(self):
+        self._choices: Dict[int, _ChoiceBuffer] = {}
+
+    def add(self, chunk: Union[StreamDelta, CompletionChoice]):
+        buffer = self._choices.get(chunk.index)
+        if buffer is None:
+            buffer = self._choices[chunk.index] = _ChoiceBuffer()
+        text = chunk.content if isinstance(chunk, StreamDelta) else chunk.text
+        buffer.add(text, finish_reason=chunk.finish_reason)
+
+    def result(self) -> List[CompletionChoice]:
+        if not self._choices:
+            self._choices[0] = _ChoiceBuffer()
+        return [
+            CompletionChoice(
+                index=index,
+                text=buffer.text(),
+                finish_reason=buffer.finish_reason or "stop",
+            )
+            for index, buffer in sorted(self._choices.items())
+        ]
@@ -1,14 +1,15 @@
 from contextlib import asynccontextmanager
 import asyncio
-from typing import AsyncIterator, List, Union
+import functools
+from typing import AsyncIterator, Dict, List, Optional, Union
 import time
 import uuid
 import json
 import logging
 
 from fastapi import FastAPI, HTTPException
-from fastapi import Request
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from .openai_schemas import *
 from .llm_models import MODEL_REGISTRY
 from .llm_models import invoke_chat, invoke_completion
@@ -16,19 +17,86 @@ from .config import config
 from .apps.fake_llvm import register_fake_llvm
 from .apps import dify, redirect_llm, run_task_llm
 from .llm_models import chat_event, completion_event
+from .llm_models import chat_aggregate, completion_aggregate
+from .llm_models import chat_passthrough_event
+from .admission import ADMISSION, release_after
+from .metrics import REGISTRY as METRICS_REGISTRY
+from .response_cache import RESPONSE_CACHE
+from .single_flight import SINGLE_FLIGHT
+from .fan_out import split_request
+from .registry_snapshot import RegistrySnapshot
+from .model_reload import ModelReloader
+from .models import ModelInterface
+from .apps.dify.schemas import DifyAppModel
 
-def register_all_models():
-    logger.info("Registering all models")
+REGISTRY_SNAPSHOT = RegistrySnapshot()
+
+
+def register_local_models():
+    """
+    注册不需要远程发现的模型，每个 worker 各自注册
+    """
+    logger.info("Registering local models")
     register_fake_llvm(MODEL_REGISTRY)
-    dify.register_all_models(MODEL_REGISTRY)
     redirect_llm.register_redirect_llm(MODEL_REGISTRY)
     run_task_llm.register_run_task_llm(MODEL_REGISTRY)
 
+
+def discover_models(strict: bool = False) -> Optional[dict]:
+    """
+    远程发现（Dify 应用），结果写入注册表快照供所有 worker 使用。
+    strict 时发现失败直接抛出（手动重载需要报告失败），否则返回 None 沿用已有快照。
+    """
+    try:
+        apps = dify.discover_apps()
+    except Exception as e:
+        logger.error(f"Error discovering dify apps: {e}")
+        if strict:
+            raise
+        return None
+    payload = {"dify_apps": [app_model.model_dump() for app_model in apps]}
+    # 只在执行发现的 worker 中预热，Key 通过磁盘缓存共享给其他 worker
+    dify.prewarm_api_keys(apps)
+    return payload
+
+
+def apply_snapshot(snapshot: dict) -> Dict[str, List[str]]:
+    apps = [DifyAppModel(**app_model) for app_model in snapshot["payload"].get("dify_apps", [])]
+    return dify.load_apps(MODEL_REGISTRY, apps)
+
+
+async def sync_models(force: bool = False):
+    """
+    读取注册表快照（过期或强制时由持锁的 worker 重新发现）并应用到本进程，
+    返回 (快照版本, 差异)。发现和文件读写都在线程中执行，不阻塞事件循环。
+    """
+    discover = functools.partial(discover_models, strict=force)
+    snapshot = await asyncio.to_thread(REGISTRY_SNAPSHOT.load_or_discover, discover, force)
+    if snapshot is None:
+        raise RuntimeError("Model discovery failed and no registry snapshot is available")
+    diff = apply_snapshot(snapshot)
+    REGISTRY_SNAPSHOT.mark_applied(snapshot)
+    return snapshot["version"], diff
+
+
+RELOADER = ModelReloader(lambda: sync_models(force=True))
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    register_all_models()
+    register_local_models()
+    try:
+        await sync_models()
+    except RuntimeError as e:
+        logger.error(f"{e}, starting with local models only")
+    watcher = asyncio.create_task(REGISTRY_SNAPSHOT.watch(apply_snapshot))
     app.include_router(dify.router)
+    await redirect_llm.startup()
     yield
+    watcher.cancel()
+    await redirect_llm.shutdown()
+    await run_task_llm.shutdown()
+    await dify.shutdown()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -44,8 +112,46 @@ logger = logging.getLogger("rdify")
 @app.get("/v1/models/reload")
 async def reload_models():
     logger.info("Reloading models")
-    register_all_models()
-    return JSONResponse(content={"message": "Models reloaded"})
+    # 后台强制重新发现并写入新版本快照，其他 worker 通过轮询切换
+    RELOADER.start()
+    return JSONResponse(status_code=202, content={"message": "Models reloading", "job": RELOADER.status()})
+
+
+@app.get("/v1/models/reload/status")
+async def reload_status():
+    """
+    最近一次重载任务的状态（running / succeeded / failed）及应用差异
+    """
+    return JSONResponse(content={"job": RELOADER.status()})
+
+
+@app.get("/v1/admission")
+async def admission_stats():
+    """
+    各模型的并发 / 排队情况，用于评估 worker 数量
+    """
+    return JSONResponse(content={"data": ADMISSION.stats()})
+
+
+ADMISSION_ACTIVE = METRICS_REGISTRY.gauge("rdify_admission_active", "Requests holding a concurrency slot", ("model",))
+ADMISSION_QUEUED = METRICS_REGISTRY.gauge("rdify_admission_queued", "Requests waiting for a concurrency slot", ("model",))
+
+
+def collect_admission():
+    for model_id, admission in list(ADMISSION.models.items()):
+        ADMISSION_ACTIVE.labels(model_id).set(admission.active)
+        ADMISSION_QUEUED.labels(model_id).set(admission.queued)
+
+
+METRICS_REGISTRY.add_collector(collect_admission)
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus 文本格式的指标
+    """
+    return PlainTextResponse(METRICS_REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/v1/models", response_model=ListModelsResponse)
@@ -62,76 +168,113 @@ async def get_model(model_id: str):
         raise HTTPException(status_code=404, detail="Model not found")
     return GetModelResponse(**info.model_dump())
 
+def validate_request(req: Union[ChatCompletionRequest, CompletionRequest], model: ModelInterface):
+    """
+    模型自身的参数校验在响应头发出之前执行，错误以 400 返回，而不是中断已开始的流
+    """
+    if model.validate_request is None:
+        return
+    try:
+        model.validate_request(req)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def lookup_cache(req: Union[ChatCompletionRequest, CompletionRequest], kind: str, request: Request, model: ModelInterface):
+    """
+    确定性请求先查响应缓存。返回 context 和响应头：
+    命中时 context 带 cached（重放），未命中时带 cache_key（录制）。
+    context["model"] 固定本次请求使用的模型，重载注册表不影响进行中的请求。
+    """
+    context = {
+        "request": request,
+        "model": model,
+    }
+    headers = {}
+    key = RESPONSE_CACHE.key_for(req, kind)
+    if key is not None:
+        cached = await RESPONSE_CACHE.get(key, req.model, kind)
+        if cached is not None:
+            context["cached"] = cached
+            headers["X-Rdify-Cache"] = "HIT"
+        else:
+            context["cache_key"] = key
+            headers["X-Rdify-Cache"] = "MISS"
+    return context, headers
+
+
+async def acquire_slot(model_id: str, context: dict):
+    if "cached" in context:
+        return lambda: None
+    return await ADMISSION.acquire(model_id)
+
+
 @app.post("/v1/chat/completions")
-async def chat_completions(req: ChatCompletionRequest, request: Request):
-    logger.debug(f"body: {await request.body()}")
-    logger.debug(f"ChatCompletionRequest: {req}")
+async def chat_completions(req: ChatCompletionRequest, request: Request, response: Response):
+    logger.debug("ChatCompletionRequest: %s", req)
     # 校验 model 是否支持 chat
-    info = MODEL_REGISTRY.get_model_info(req.model)
-    if not info or not info.capabilities.chat:
+    model = MODEL_REGISTRY.get_model(req.model)
+    if not model or not model.info.capabilities.chat:
         raise HTTPException(status_code=400, detail="Model not supported for chat")
+    validate_request(req, model)
 
     resp = ChatCompletionResponse(
         model=req.model,
         choices=[]
     )
 
-    context = {
-        "request": request,
-    }
+    context, headers = await lookup_cache(req, "chat", request, model)
 
-    # 如果不是 stream 模式：一次性返回最终响应
+    # 按模型限流：超出并发的请求排队，队列满或排队超时直接拒绝；缓存命中不占用槽位
+    release = await acquire_slot(req.model, context)
+
+    # 如果不是 stream 模式：合并所有 chunk 后一次性返回最终响应
     if not req.stream:
-        # 收集所有 chunk
-        chunks = []
-        chunk_gen = await invoke_chat(req, context=context)
-        async for chunk in chunk_gen:
-            chunks.append(chunk)
-        # 假设 chunks 最终只有一个完整 choice（你内部适配器可以决定如何组织）
-        choices = []
-        for idx, ch in enumerate(chunks):
-            # ch 是 ChatCompletionChoice 实例（包含 message, finish_reason）
-            choices.append(ch)
-        usage = Usage(
-            prompt_tokens=None,
-            completion_tokens=None,
-            total_tokens=None
-        )
-        resp.choices = choices
-        resp.usage = usage
-        return resp
+        response.headers.update(headers)
+        try:
+            return await chat_aggregate(req, resp, context=context)
+        finally:
+            release()
 
     else:
         # stream=True 模式 — 返回 StreamingResponse，逐 chunk 推送
-        logger.debug(f"StreamingResponse: {req.model}")
-        event_generator = chat_event(req, resp, context=context)
-        return StreamingResponse(event_generator(), media_type="text/event-stream")
+        logger.debug("StreamingResponse: %s", req.model)
+        # 可缓存 / 可合并 / 需要 fan-out 的请求需要经过 invoke_chat 处理，不走透传
+        if (
+            "cache_key" not in context
+            and SINGLE_FLIGHT.key_for(req, "chat") is None
+            and split_request(req, "chat") is None
+            and model.invoke_chat_raw is not None
+        ):
+            event_generator = chat_passthrough_event(req, context=context)
+        else:
+            event_generator = chat_event(req, resp, context=context)
+        return StreamingResponse(release_after(event_generator, release)(), media_type="text/event-stream", headers=headers)
 
 @app.post("/v1/completions")
-async def completions(req: CompletionRequest, request: Request):
-    logger.debug(f"CompletionRequest: {req}")
+async def completions(req: CompletionRequest, request: Request, response: Response):
+    logger.debug("CompletionRequest: %s", req)
     # 校验模型是否支持补全
-    info = MODEL_REGISTRY.get_model_info(req.model)
-    if not info or not info.capabilities.completion:
+    model = MODEL_REGISTRY.get_model(req.model)
+    if not model or not model.info.capabilities.completion:
         raise HTTPException(status_code=400, detail="Model not supported for completion")
+    validate_request(req, model)
 
     resp = CompletionResponse(
         model=req.model,
         choices=[]
     )
 
-    context = {
-        "request": request,
-    }
+    context, headers = await lookup_cache(req, "completion", request, model)
+
+    release = await acquire_slot(req.model, context)
 
     if not req.stream:
-        chunks = []
-        completion_gen = await invoke_completion(req, context=context)
-        async for chunk in completion_gen:
-            chunks.append(chunk)
-        resp.choices = chunks
-        resp.usage = Usage()
-        return resp
+        response.headers.update(headers)
+        try:
+            return await completion_aggregate(req, resp, context=context)
+        finally:
+            release()
     else:
         event_generator = completion_event(req, resp, context=context)
-        return StreamingResponse(event_generator(), media_type="text/event-stream")
+        return StreamingResponse(release_after(event_generator, release)(), media_type="text/event-stream", headers=headers)
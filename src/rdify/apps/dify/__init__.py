@@ -1,4 +1,4 @@
-from .core import register_all_models
+from .core import register_all_models, discover_apps, load_apps, prewarm_api_keys, shutdown
 from .router import dify_router as router
 
-__all__ = ["register_all_models", "router"]
+__all__ = ["register_all_models", "discover_apps", "load_apps", "prewarm_api_keys", "shutdown", "router"]
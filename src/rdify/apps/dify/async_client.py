@@ -0,0 +1,101 @@
+import os
+import json
+import logging
+from typing import AsyncIterator, Optional
+
+import httpx
+from pydify.common import DifyAPIError
+
+from rdify.utils.http_pool import create_async_client
+
+logger = logging.getLogger("rdify.apps.dify.async_client")
+
+# 进程级共享的异步客户端，所有 Dify 应用复用同一个 keep-alive 连接池
+_client: Optional[httpx.AsyncClient] = None
+
+# 不携带内容、直接跳过的事件（workflow_started / node_started / ping 等）由调用方忽略，
+# 这里只识别需要处理的几种
+ANSWER_EVENTS = frozenset(("message", "agent_message"))
+END_EVENTS = frozenset(("message_end",))
+ERROR_EVENTS = frozenset(("error",))
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = create_async_client("DIFY")
+    return _client
+
+
+async def shutdown():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _url(endpoint: str) -> str:
+    return os.getenv("DIFY_BASE_URL", "").rstrip("/") + "/" + endpoint
+
+
+def _headers(api_key: str) -> dict:
+    return {"Authorization": f"Bearer {api_key}"}
+
+
+def _api_error(response: httpx.Response, body: bytes) -> DifyAPIError:
+    try:
+        error_data = json.loads(body)
+    except ValueError:
+        error_data = {}
+    return DifyAPIError(
+        f"DIFY: POST {response.request.url} failed: {response.status_code} {body[:500].decode(errors='replace')}",
+        status_code=response.status_code,
+        error_data=error_data,
+    )
+
+
+def _event_error(event: dict) -> DifyAPIError:
+    return DifyAPIError(
+        f"DIFY: stream error: {event.get('code')} {event.get('message')}",
+        status_code=event.get("status"),
+        error_data=event,
+    )
+
+
+async def stream_events(endpoint: str, api_key: str, payload: dict, cancel_scope=None) -> AsyncIterator[dict]:
+    """
+    以 streaming 模式调用 Dify，逐行解析 SSE，产出每个 data 帧的 JSON。
+    error 事件转为 DifyAPIError 抛出；退出时关闭响应，连接归还连接池。
+    """
+    client = get_http_client()
+    request = client.build_request("POST", _url(endpoint), json={**payload, "response_mode": "streaming"}, headers=_headers(api_key))
+    response = await client.send(request, stream=True)
+    if cancel_scope is not None:
+        # 客户端断开时立即关闭上游响应，不再等待下一个事件
+        cancel_scope.add_callback(response.aclose)
+    try:
+        if response.is_error:
+            raise _api_error(response, await response.aread())
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            try:
+                event = json.loads(line[5:])
+            except ValueError as e:
+                raise DifyAPIError(f"DIFY: invalid SSE data from {endpoint}: {e}: {line[:500]}")
+            if event.get("event") in ERROR_EVENTS:
+                raise _event_error(event)
+            yield event
+    finally:
+        await response.aclose()
+
+
+async def request_blocking(endpoint: str, api_key: str, payload: dict) -> dict:
+    """
+    以 blocking 模式调用 Dify，返回完整响应
+    """
+    client = get_http_client()
+    response = await client.post(_url(endpoint), json={**payload, "response_mode": "blocking"}, headers=_headers(api_key))
+    if response.is_error:
+        raise _api_error(response, response.content)
+    return response.json()
@@ -0,0 +1,116 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import aclosing, asynccontextmanager
+from typing import AsyncIterator, Iterable, List, Optional
+
+from . import async_client
+
+logger = logging.getLogger("rdify.apps.dify.client_pool")
+
+
+class DifyAppClient:
+    """
+    单个 Dify 应用的客户端：绑定应用的 API Key，请求都通过共享的 httpx 连接池发送，
+    keep-alive 连接在所有应用之间复用。
+    max_connections > 0 时限制该应用同时占用的上游连接数，避免单个应用占满共享连接池。
+    """
+
+    def __init__(self, app_id: str, api_key: str, max_connections: int = 0):
+        self.app_id = app_id
+        self.api_key = api_key
+        self.in_flight = 0
+        self.last_used = time.monotonic()
+        self._slots = asyncio.Semaphore(max_connections) if max_connections > 0 else None
+
+    @asynccontextmanager
+    async def _slot(self):
+        if self._slots is not None:
+            await self._slots.acquire()
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.last_used = time.monotonic()
+            if self._slots is not None:
+                self._slots.release()
+
+    async def stream_events(self, endpoint: str, payload: dict, cancel_scope=None) -> AsyncIterator[dict]:
+        async with self._slot():
+            events = async_client.stream_events(endpoint, self.api_key, payload, cancel_scope=cancel_scope)
+            async with aclosing(events):
+                async for event in events:
+                    yield event
+
+    async def request_blocking(self, endpoint: str, payload: dict) -> dict:
+        async with self._slot():
+            return await async_client.request_blocking(endpoint, self.api_key, payload)
+
+
+class DifyClientPool:
+    """
+    按应用 ID 复用 Dify 客户端。
+
+    - 最多保留 max_size 个客户端，超出时淘汰最久未使用的空闲客户端；
+    - 空闲超过 idle_timeout 秒的客户端在下次取用时重建；
+    - API Key 变化（轮换）时重建；应用在重载中被删除或变更时通过 invalidate 移除。
+    被移除的客户端不再分配给新请求，正在进行的请求继续使用原客户端直到结束。
+    """
+
+    def __init__(self, max_size: Optional[int] = None, idle_timeout: Optional[float] = None,
+                 max_connections: Optional[int] = None):
+        self.max_size = max_size if max_size is not None else int(os.getenv("RDIFY_DIFY_CLIENT_POOL_SIZE", "64"))
+        self.idle_timeout = idle_timeout if idle_timeout is not None else float(os.getenv("RDIFY_DIFY_CLIENT_IDLE_TIMEOUT", "300"))
+        # 0 表示不限制
+        self.max_connections = max_connections if max_connections is not None else int(os.getenv("RDIFY_DIFY_APP_MAX_CONNECTIONS", "0"))
+        self._clients: "OrderedDict[str, DifyAppClient]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, app_id: str, api_key: str) -> DifyAppClient:
+        with self._lock:
+            client = self._clients.get(app_id)
+            now = time.monotonic()
+            if client is not None and (client.api_key != api_key or self._idle(client, now)):
+                del self._clients[app_id]
+                client = None
+            if client is None:
+                client = self._clients[app_id] = DifyAppClient(app_id, api_key, self.max_connections)
+            client.last_used = now
+            self._clients.move_to_end(app_id)
+            self._evict(now)
+            return client
+
+    def _idle(self, client: DifyAppClient, now: float) -> bool:
+        return client.in_flight == 0 and now - client.last_used > self.idle_timeout
+
+    def _evict(self, now: float):
+        """
+        持有锁时调用：先移除空闲过期的，再从最久未使用的一端淘汰超出容量的空闲客户端
+        """
+        for app_id in [app_id for app_id, client in self._clients.items() if self._idle(client, now)]:
+            del self._clients[app_id]
+        excess = len(self._clients) - self.max_size
+        for app_id in list(self._clients):
+            if excess <= 0:
+                break
+            if self._clients[app_id].in_flight == 0:
+                del self._clients[app_id]
+                excess -= 1
+
+    def invalidate(self, app_ids: Iterable[str]) -> List[str]:
+        with self._lock:
+            removed = [app_id for app_id in app_ids if self._clients.pop(app_id, None) is not None]
+        if removed:
+            logger.info("Invalidated pooled dify clients for %s", removed)
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+    def __len__(self) -> int:
+        return len(self._clients)
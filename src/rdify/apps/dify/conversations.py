@@ -0,0 +1,88 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+from rdify.metrics import REGISTRY
+
+logger = logging.getLogger("rdify.apps.dify.conversations")
+
+CONVERSATION_LOOKUPS = REGISTRY.counter(
+    "rdify_dify_conversation_lookups_total", "Dify conversation reuse lookups for multi-turn chats", ("model", "result"),
+)
+
+# (role, content)
+Message = Tuple[str, Optional[str]]
+
+
+def history_key(model: str, user: str, messages: Sequence[Message]) -> str:
+    """
+    对 (应用, 用户, 消息历史) 做摘要，作为 Dify 会话的查找键
+    """
+    canonical = json.dumps([model, user, [list(message) for message in messages]], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def render_transcript(messages: Sequence[Message]) -> str:
+    """
+    找不到对应会话时，把之前的历史拼进本轮 query，保证上下文不丢失
+    """
+    return "\n".join(f"{role}: {content or ''}" for role, content in messages)
+
+
+class ConversationMap:
+    """
+    OpenAI 风格的多轮请求每次都携带完整历史，Dify 则通过 conversation_id 在服务端保存上下文。
+
+    一轮结束后记录「本轮请求的历史 + 助手回答」-> conversation_id；
+    下一轮请求的历史前缀（除最后一条消息）命中时，只发送新消息并续用该会话。
+    命中即取出条目：重新生成或改写最后一轮会重放同一历史，此时 Dify 会话里已有被丢弃的回答，
+    不能再续用，只能退化为新会话。
+    有界 LRU + TTL，进程内有效；未命中时退化为新会话。
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, ttl: Optional[float] = None):
+        self.max_entries = max_entries or int(os.getenv("RDIFY_DIFY_CONVERSATION_ENTRIES", "10000"))
+        self.ttl = ttl if ttl is not None else float(os.getenv("RDIFY_DIFY_CONVERSATION_TTL", "3600"))
+        # key -> (conversation_id, 过期时间)
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, model: str, user: str, history: Sequence[Message]) -> Optional[str]:
+        """
+        取出并移除历史对应的会话；本轮成功结束后由 put 以新的历史重新登记
+        """
+        if not history:
+            return None
+        key = history_key(model, user, history)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[1] < time.monotonic():
+                entry = None
+        CONVERSATION_LOOKUPS.labels(model, "hit" if entry else "miss").inc()
+        return entry[0] if entry else None
+
+    def put(self, model: str, user: str, history: Sequence[Message], conversation_id: str):
+        key = history_key(model, user, history)
+        with self._lock:
+            self._entries[key] = (conversation_id, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def forget(self, conversation_id: str):
+        """
+        Dify 端会话已失效（被删除或过期）时移除所有指向它的条目
+        """
+        with self._lock:
+            stale: List[str] = [key for key, entry in self._entries.items() if entry[0] == conversation_id]
+            for key in stale:
+                del self._entries[key]
+        logger.info("Forgot dify conversation %s (%s entries)", conversation_id, len(stale))
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -2,17 +2,24 @@ import os
 import re
 import asyncio
 import logging
+import threading
+import functools
+from contextlib import aclosing
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 
 from rdify.openai_schemas import *
 from rdify.models import ModelInterface, ModelInfo, ModelCapabilities, ModelRegistry
-from pydify import ChatbotClient
-from pydify.site import DifySite, DifyAppMode
-from pydify import TextGenerationClient
-from pydify.text_generation import TextGenerationEvent
+from pydify.site import DifySite
+from pydify.common import DifyAPIError
 
 from .schemas import DifySiteModel, DifyAppModel
-from .schemas import DifyEvent
-from rdify.utils.thread_bridge import run_blocking_iter_in_thread
+from .key_cache import ApiKeyCache
+from .async_client import ANSWER_EVENTS, END_EVENTS
+from .client_pool import DifyClientPool
+from . import async_client
+from .conversations import ConversationMap, render_transcript
+from rdify.sse import StreamDelta
 
 logger = logging.getLogger("rdify.apps.dify")
 
@@ -27,6 +34,12 @@ def get_config():
 
 
 DIFY_SITE_MODEL = DifySiteModel()
+API_KEY_CACHE = ApiKeyCache()
+CLIENT_POOL = DifyClientPool()
+CONVERSATIONS = ConversationMap()
+# 每个应用一把锁，避免并发请求同时为同一应用创建 API Key
+_api_key_locks: Dict[str, threading.Lock] = {}
+_api_key_locks_guard = threading.Lock()
 
 def get_site():
     config = get_config()
@@ -38,40 +51,93 @@ def get_site():
     return site
 
 
-def get_or_create_new_api_key(model_name: str):
-    logger.debug(f"Getting or creating new API key for model: {model_name}")
-    app_model = DIFY_SITE_MODEL.get_app(model_name)
-    if len(app_model.api_keys) > 0:
-        return app_model.api_keys[0]
-    site = get_site()
+def _api_key_lock(app_id: str) -> threading.Lock:
+    with _api_key_locks_guard:
+        return _api_key_locks.setdefault(app_id, threading.Lock())
+
+
+def _resolve_app(model_name: str, app_model: Optional[DifyAppModel] = None) -> DifyAppModel:
+    """
+    优先使用请求固定的应用（重载后仍可用），否则按名称在当前目录中查找
+    """
+    app_model = app_model or DIFY_SITE_MODEL.get_app(model_name)
+    if app_model is None:
+        raise ValueError(f"Dify app not found: {model_name}")
+    return app_model
+
+
+def has_api_key(model_name: str, app_model: Optional[DifyAppModel] = None) -> bool:
+    app_model = app_model or DIFY_SITE_MODEL.get_app(model_name)
+    return app_model is not None and len(app_model.api_keys) > 0
+
+
+def _fetch_api_key(site: DifySite, app_model: DifyAppModel) -> str:
+    """
+    登录控制台获取应用的 API Key，没有则创建一个，并写入磁盘缓存
+    """
     app_api_keys = site.fetch_app_api_keys(app_model.id)
     if len(app_api_keys) == 0:
-        logger.debug(f"Creating new API key for model: {model_name}")
+        logger.debug(f"Creating new API key for model: {app_model.name}")
         new_api_key = site.create_app_api_key(app_model.id)
         api_key = new_api_key['token']
     else:
         api_key = app_api_keys[0]['token']
-    app_model.api_keys.append(api_key)
+    API_KEY_CACHE.put(app_model.id, api_key)
     return api_key
 
-def get_client(model_name: str):
-    config = get_config()
-    api_key = get_or_create_new_api_key(model_name)
-    client = ChatbotClient(
-        api_key=api_key,
-        base_url=config["DIFY_BASE_URL"],
-    )
-    return client
 
+def get_or_create_new_api_key(model_name: str, app_model: Optional[DifyAppModel] = None):
+    """
+    依次查找：内存中的应用 -> 磁盘 Key 缓存 -> 登录控制台获取或创建（阻塞，耗时）
+    """
+    logger.debug(f"Getting or creating new API key for model: {model_name}")
+    app_model = _resolve_app(model_name, app_model)
+    if len(app_model.api_keys) > 0:
+        return app_model.api_keys[0]
+    with _api_key_lock(app_model.id):
+        if len(app_model.api_keys) > 0:
+            return app_model.api_keys[0]
+        api_key = API_KEY_CACHE.get(app_model.id) or _fetch_api_key(get_site(), app_model)
+        app_model.api_keys.append(api_key)
+        return api_key
 
-def get_text_gen_client(model_name: str):
-    config = get_config()
-    api_key = get_or_create_new_api_key(model_name)
-    client = TextGenerationClient(
-        api_key=api_key,
-        base_url=config["DIFY_BASE_URL"],
-    )
-    return client
+
+def prewarm_api_keys(apps: List[DifyAppModel]) -> threading.Thread:
+    """
+    发现应用后在后台线程中并发获取磁盘缓存中还没有的 API Key（共享一次控制台登录），
+    避免用户对每个应用的第一次请求卡在登录上
+    """
+    def _prewarm():
+        missing = [app_model for app_model in apps if API_KEY_CACHE.get(app_model.id) is None]
+        if not missing:
+            return
+        try:
+            site = get_site()
+        except Exception as e:
+            logger.error(f"Error logging in for API key pre-warm: {e}")
+            return
+
+        def _fetch(app_model: DifyAppModel):
+            try:
+                with _api_key_lock(app_model.id):
+                    if API_KEY_CACHE.get(app_model.id) is None:
+                        _fetch_api_key(site, app_model)
+            except Exception as e:
+                logger.warning(f"Error pre-warming API key for {app_model.name}: {e}")
+
+        workers = int(os.getenv("RDIFY_DIFY_PREWARM_CONCURRENCY", "8"))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rdify-dify-keys") as executor:
+            list(executor.map(_fetch, missing))
+        logger.info(f"Pre-warmed API keys for {len(missing)} dify apps")
+
+    thread = threading.Thread(target=_prewarm, name="rdify-dify-prewarm", daemon=True)
+    thread.start()
+    return thread
+
+
+async def shutdown():
+    CLIENT_POOL.clear()
+    await async_client.shutdown()
 
 
 def parser_app_to_model_interface(app: DifyAppModel) -> ModelInterface:
@@ -81,10 +147,12 @@ def parser_app_to_model_interface(app: DifyAppModel) -> ModelInterface:
         owned_by="dify",
         capabilities=ModelCapabilities(chat=True, completion=True, stream=True),
     )
+    # 绑定应用本身：请求固定了 ModelInterface，重载删除该应用后仍能取到 API Key
     model_interface = ModelInterface(
         info=model_info,
-        invoke_chat=invoke_chat,
-        invoke_completion=invoke_completion,
+        invoke_chat=functools.partial(invoke_chat, app_model=app),
+        invoke_completion=functools.partial(invoke_completion, app_model=app),
+        adapter="dify",
     )
     return model_interface
 
@@ -106,61 +174,149 @@ def fetch_all_apps():
         if not validate_app(app_model):
             logger.info(f"Filtered app: {app_model.name}")
             continue
-        DIFY_SITE_MODEL.apps.append(app_model)
         logger.debug(f"Fetched app: {app_model.name}")
         yield app_model
 
+
+def discover_apps() -> List[DifyAppModel]:
+    """
+    登录控制台并拉取全部应用（阻塞，耗时），结果可写入注册表快照
+    """
+    return list(fetch_all_apps())
+
+
+def diff_apps(old: List[DifyAppModel], new: List[DifyAppModel]) -> Dict[str, List[str]]:
+    old_ids = {app_model.name: app_model.id for app_model in old}
+    new_ids = {app_model.name: app_model.id for app_model in new}
+    return {
+        "added": sorted(new_ids.keys() - old_ids.keys()),
+        "removed": sorted(old_ids.keys() - new_ids.keys()),
+        "changed": sorted(name for name in new_ids.keys() & old_ids.keys() if new_ids[name] != old_ids[name]),
+    }
+
+
+def load_apps(model_registry: ModelRegistry, apps: List[DifyAppModel]) -> Dict[str, List[str]]:
+    """
+    用给定的应用列表替换注册表中全部 dify 模型，其他适配器的模型保持不变，返回应用的差异。
+    构建新的 dict 后整体替换引用，读取方不会看到中间状态。
+    """
+    diff = diff_apps(DIFY_SITE_MODEL.apps, apps)
+    # 保留本进程已获取的 API Key
+    for app_model in apps:
+        known = DIFY_SITE_MODEL.get_app_by_id(app_model.id)
+        if not app_model.api_keys and known is not None and known.api_keys:
+            app_model.api_keys = list(known.api_keys)
+    # 被删除的应用（包括同名但 ID 变化的）不再复用其客户端
+    CLIENT_POOL.invalidate({app_model.id for app_model in DIFY_SITE_MODEL.apps} - {app_model.id for app_model in apps})
+    DIFY_SITE_MODEL.replace_apps(apps)
+    models = {model_id: model for model_id, model in model_registry.models.items() if model.adapter != "dify"}
+    for app_model in apps:
+        models[app_model.name] = parser_app_to_model_interface(app_model)
+    model_registry.replace_models(models)
+    logger.info(f"Loaded {len(apps)} dify apps: {diff}")
+    return diff
+
+
 def register_all_models(model_registry: ModelRegistry):
     logger.info("Registering all models")
-    site = get_site()
     try:
-        for app_model in fetch_all_apps():
-            logger.info(f"Registering model: {app_model.name}")
-            model_interface = parser_app_to_model_interface(app_model)
-            model_registry.register_model(app_model.name, model_interface)
+        load_apps(model_registry, discover_apps())
     except Exception as e:
         logger.error(f"Error registering all models: {e}")
 
 
-async def invoke_chat(req: ChatCompletionRequest):
-    client = get_client(req.model)
-    last_message = req.messages[-1]
-    content = last_message.content
-
-    def _blocking_iter():
-        # 这个生成器可能是阻塞的、同步的
-        for chunk in client.send_message(
-            query=content,
-            user=req.user or "unknown",
-            response_mode="streaming"
-        ):
-            yield DifyEvent.from_api_data(chunk)
-
-    async for chunk in run_blocking_iter_in_thread(_blocking_iter):
-        yield ChatCompletionChoice(
-            index=0,
-            message=ChatMessage(role="assistant", content=chunk.answer),
-            finish_reason=None,
-            delta=ChoiceDeltaContent(content=chunk.answer, role="assistant")
-        )
+async def _get_api_key(model_name: str, app_model: Optional[DifyAppModel] = None) -> str:
+    # 没有缓存的 Key 时需要登录控制台，放到线程中执行，不阻塞事件循环
+    if has_api_key(model_name, app_model):
+        return get_or_create_new_api_key(model_name, app_model)
+    return await asyncio.to_thread(get_or_create_new_api_key, model_name, app_model)
 
-async def invoke_completion(req: CompletionRequest):
-    client = get_text_gen_client(req.model)
-    content = req.prompt if isinstance(req.prompt, str) else "\n".join(req.prompt)
 
-    def _blocking_iter():
-        for chunk in client.completion(
-            query=content,
-            user=req.user or "unknown",
-            response_mode="streaming",
-        ):
-            yield chunk
-
-    async for chunk in run_blocking_iter_in_thread(_blocking_iter):
-        logger.debug(f"Chunk: {chunk}")
-        yield CompletionChoice(
-            index=0,
-            text=chunk.get('answer', ''),
-            finish_reason=None
-        )
+async def _invoke(endpoint: str, payload: dict, req, role: Optional[str], observe=None,
+                  app_model: Optional[DifyAppModel] = None, **kwargs):
+    """
+    调用 Dify 并把事件直接映射为 StreamDelta：
+    message / agent_message -> 内容增量，message_end -> 结束；其余事件忽略。
+    stream=False 时使用 blocking 模式，一次返回完整回答。
+    observe 会收到每个事件（blocking 模式下为完整响应），用于读取 conversation_id 等字段。
+    """
+    app_model = _resolve_app(req.model, app_model)
+    client = CLIENT_POOL.get(app_model.id, await _get_api_key(req.model, app_model))
+    if not req.stream:
+        data = await client.request_blocking(endpoint, payload)
+        if observe is not None:
+            observe(data)
+        yield StreamDelta(data.get("answer", ""), role=role, finish_reason="stop")
+        return
+    # 收到 message_end 后提前返回时也要立即关闭事件流，释放上游响应和连接
+    async with aclosing(client.stream_events(endpoint, payload, cancel_scope=kwargs.get("cancel_scope"))) as events:
+        async for event in events:
+            if observe is not None:
+                observe(event)
+            kind = event.get("event")
+            if kind in ANSWER_EVENTS:
+                yield StreamDelta(event.get("answer", ""), role=role)
+            elif kind in END_EVENTS:
+                yield StreamDelta("", role=role, finish_reason="stop")
+                return
+
+
+class _ChatTurn:
+    """
+    记录一轮对话中 Dify 返回的 conversation_id
+    """
+    __slots__ = ("conversation_id",)
+
+    def __init__(self, conversation_id: Optional[str] = None):
+        self.conversation_id = conversation_id
+
+    def observe(self, event: dict):
+        if self.conversation_id is None:
+            self.conversation_id = event.get("conversation_id") or None
+
 
+async def invoke_chat(req: ChatCompletionRequest, app_model: Optional[DifyAppModel] = None, **kwargs):
+    user = req.user or "unknown"
+    messages = [(message.role, message.content) for message in req.messages]
+    history, query = messages[:-1], messages[-1][1]
+    # 没有真实用户标识时不复用会话，避免不同客户端因历史相同而共享上下文
+    reuse = bool(req.user)
+    conversation_id = CONVERSATIONS.take(req.model, user, history) if reuse else None
+    for attempt in range(2):
+        payload = {"inputs": {}, "user": user}
+        if conversation_id is not None:
+            # 续用 Dify 会话，上下文已在服务端，只发送新消息
+            payload["query"] = query
+            payload["conversation_id"] = conversation_id
+        else:
+            payload["query"] = render_transcript(messages) if history else query
+        turn = _ChatTurn()
+        answer: List[str] = []
+        finished = False
+        try:
+            async for delta in _invoke("chat-messages", payload, req, "assistant", observe=turn.observe,
+                                       app_model=app_model, **kwargs):
+                answer.append(delta.content or "")
+                finished = finished or delta.finish_reason is not None
+                yield delta
+        except DifyAPIError as e:
+            # 会话在 Dify 端已不存在：尚未输出任何内容时以新会话重试一次
+            if conversation_id is None or answer or e.status_code != 404:
+                raise
+            logger.info(f"Dify conversation {conversation_id} is gone, starting a new one for {req.model}")
+            CONVERSATIONS.forget(conversation_id)
+            conversation_id = None
+            continue
+        if reuse and finished and turn.conversation_id is not None:
+            CONVERSATIONS.put(req.model, user, messages + [("assistant", "".join(answer))], turn.conversation_id)
+        return
+
+
+async def invoke_completion(req: CompletionRequest, app_model: Optional[DifyAppModel] = None, **kwargs):
+    content = req.prompt if isinstance(req.prompt, str) else "\n".join(req.prompt)
+    payload = {
+        "inputs": {"query": content},
+        "user": req.user or "unknown",
+    }
+    async for delta in _invoke("completion-messages", payload, req, None, app_model=app_model, **kwargs):
+        yield delta
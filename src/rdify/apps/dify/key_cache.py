@@ -0,0 +1,62 @@
+import os
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger("rdify.apps.dify.key_cache")
+
+
+class ApiKeyCache:
+    """
+    Dify 应用 API Key 的磁盘缓存（app_id -> key），重启和其他 worker 无需再登录控制台获取。
+
+    文件在 mtime 变化时重新读取；写入时先合并磁盘上的最新内容再原子替换，
+    多进程同时写入极少数情况下可能丢失一条，后果只是之后重新获取一次。
+
+    文件中是明文 Key，默认放在状态目录（RDIFY_STATE_DIR，默认 state/）而不是日志目录，
+    目录权限 0700、文件权限 0600。
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        default = Path(os.getenv("RDIFY_STATE_DIR", "state")) / "dify" / "api_keys.json"
+        self.path = Path(path or os.getenv("RDIFY_DIFY_KEY_CACHE", default))
+        self._keys: Dict[str, str] = {}
+        self._mtime_ns: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _stat_mtime(self) -> Optional[int]:
+        try:
+            return self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _refresh(self):
+        mtime_ns = self._stat_mtime()
+        if mtime_ns is None or mtime_ns == self._mtime_ns:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._keys = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Broken api key cache %s: %s", self.path, e)
+            return
+        self._mtime_ns = mtime_ns
+
+    def get(self, app_id: str) -> Optional[str]:
+        with self._lock:
+            self._refresh()
+            return self._keys.get(app_id)
+
+    def put(self, app_id: str, api_key: str):
+        with self._lock:
+            self._refresh()
+            self._keys = {**self._keys, app_id: api_key}
+            self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._keys, f)
+            os.chmod(tmp, 0o600)
+            os.replace(tmp, self.path)
+            self._mtime_ns = self._stat_mtime()
@@ -1,7 +1,7 @@
 import os
 
-from pydantic import BaseModel, Field
-from typing import List, Optional, Literal
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import Dict, List, Optional, Literal
 
 class DifyAppModel(BaseModel):
     id: str = Field(..., description="The ID of the app")
@@ -11,9 +11,26 @@ class DifyAppModel(BaseModel):
 
 class DifySiteModel(BaseModel):
     apps: List[DifyAppModel] = Field(..., description="The apps of the site", default_factory=list)
+    # 按名称 / ID 建立的索引，随 replace_apps 整体替换
+    _by_name: Dict[str, DifyAppModel] = PrivateAttr(default_factory=dict)
+    _by_id: Dict[str, DifyAppModel] = PrivateAttr(default_factory=dict)
+
+    def model_post_init(self, __context):
+        self.replace_apps(self.apps)
+
+    def replace_apps(self, apps: List[DifyAppModel]):
+        """
+        用新的应用列表替换目录（重载时不追加），同名应用保留最后一个
+        """
+        self._by_name = {app.name: app for app in apps}
+        self._by_id = {app.id: app for app in apps}
+        self.apps = list(self._by_name.values())
 
     def get_app(self, model_name: str) -> Optional[DifyAppModel]:
-        return next((app for app in self.apps if app.name == model_name), None)
+        return self._by_name.get(model_name)
+
+    def get_app_by_id(self, app_id: str) -> Optional[DifyAppModel]:
+        return self._by_id.get(app_id)
 
 class ApiBaseModel(BaseModel):
     api_data: dict = Field(default_factory=dict, exclude=True)
@@ -22,26 +39,6 @@ class ApiBaseModel(BaseModel):
     def from_api_data(cls, data: dict):
         return cls(**data,  api_data=data)
 
-class DifyEvent(ApiBaseModel):
-    id: str = Field(description="事件ID")
-    conversation_id: str = Field(description="会话ID")
-    message_id: str = Field(description="消息ID")
-    created_at: int = Field(description="创建时间")
-    task_id: str = Field(description="任务ID")
-    event: str = Field(description="事件")
-    answer: str | None = Field(description="答案", default=None)
-    thought: str | None = Field(description="思考", default=None)
-    metadata: dict | None = Field(description="元数据", default=None)
-
-class DifyResponse(ApiBaseModel):
-    events: list[DifyEvent] = Field(description="数据")
-
-    @classmethod
-    def from_api_data(cls, data: list):
-        events = [DifyEvent.from_api_data(item) for item in data]
-        return cls(events=events,  api_data={"events": data})
-
-
 class DifyLLMModel(ApiBaseModel):
     model: str = Field(description="模型名称")
     model_type: str = Field(description="模型类型")
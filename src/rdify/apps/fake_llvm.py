@@ -1,84 +1,219 @@
+import os
 import json
+import random
 import asyncio
 import logging
+from dataclasses import dataclass, fields, replace
+from typing import Dict, Optional, Tuple
 from ..openai_schemas import ChatCompletionRequest, CompletionRequest, ChatCompletionChoice, CompletionChoice, ChoiceDeltaContent
 from ..openai_schemas import ChatMessage
 from ..models import ModelInterface, ModelInfo, ModelCapabilities, ModelRegistry
+from ..sse import StreamDelta
 
 
 logger = logging.getLogger("rdify.apps.fake_llvm")
 
-async def fake_llm_stream(prompt: str):
+
+class FakeUpstreamError(RuntimeError):
+    """
+    负载模型注入的上游错误
+    """
+
+
+@dataclass(frozen=True)
+class LoadProfile:
+    """
+    fake 模型的合成负载（时间单位：秒）。token 按空格切分 prompt 得到。
+
+    - ttft：首 token 延迟（ttft_sigma > 0 时为对数正态分布的中位数）
+    - tokens_per_second：生成速度，chunk 间隔 = chunk 的 token 数 / 速度
+    - chunk_tokens：每个 chunk 的 token 数，在 [min, max] 内均匀分布；上限大于 1 时保留 token 之间的空格，
+      默认每个 chunk 一个 token，与原实现一致不带空格
+    - output_tokens：输出长度，None 时回显 prompt（prompt 重复 repeat 次）
+    - jitter：chunk 间隔的随机抖动比例
+    - error_rate / abort_rate：首 token 前报错 / 输出中途断开的概率
+    - zero_delay：不做任何等待，用于测量网关自身开销
+    """
+    ttft: float = 0.0
+    ttft_sigma: float = 0.0
+    tokens_per_second: float = 20.0
+    chunk_tokens: Tuple[int, int] = (1, 1)
+    output_tokens: Optional[int] = None
+    repeat: int = 1
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    abort_rate: float = 0.0
+    zero_delay: bool = False
+    seed: Optional[int] = None
+
+    def merged(self, overrides: dict) -> "LoadProfile":
+        names = {field.name for field in fields(self)}
+        unknown = set(overrides) - names
+        if unknown:
+            raise ValueError(f"Unknown load profile fields: {sorted(unknown)}")
+        overrides = dict(overrides)
+        if isinstance(overrides.get("chunk_tokens"), int):
+            overrides["chunk_tokens"] = (overrides["chunk_tokens"], overrides["chunk_tokens"])
+        elif "chunk_tokens" in overrides:
+            overrides["chunk_tokens"] = tuple(overrides["chunk_tokens"])
+        return replace(self, **overrides)
+
+    def overrides(self) -> dict:
+        """
+        与默认值不同的字段，用于把预设叠加到其他负载模型上
+        """
+        return {field.name: getattr(self, field.name) for field in fields(self) if getattr(self, field.name) != field.default}
+
+    def sample_ttft(self, rng: random.Random) -> float:
+        if self.zero_delay:
+            return 0.0
+        if self.ttft_sigma > 0 and self.ttft > 0:
+            return rng.lognormvariate(0, self.ttft_sigma) * self.ttft
+        return self.ttft
+
+    def chunk_delay(self, rng: random.Random, tokens: int) -> float:
+        if self.zero_delay or self.tokens_per_second <= 0:
+            return 0.0
+        delay = tokens / self.tokens_per_second
+        if self.jitter > 0:
+            delay *= max(0.0, 1 + rng.uniform(-self.jitter, self.jitter))
+        return delay
+
+
+# 可通过请求 metadata {"fake_profile": "名称"} 选用的预设
+PRESET_PROFILES: Dict[str, LoadProfile] = {
+    "default": LoadProfile(),
+    "zero-delay": LoadProfile(zero_delay=True),
+    "realistic": LoadProfile(
+        ttft=0.4, ttft_sigma=0.5, tokens_per_second=40, chunk_tokens=(1, 4), output_tokens=300, jitter=0.3,
+    ),
+    "flaky": LoadProfile(
+        ttft=0.2, ttft_sigma=0.5, tokens_per_second=40, chunk_tokens=(1, 4), output_tokens=200, jitter=0.3,
+        error_rate=0.05, abort_rate=0.05,
+    ),
+}
+
+
+def resolve_profile(base: LoadProfile, metadata: Optional[dict]) -> LoadProfile:
+    """
+    请求 metadata 中的 fake_profile 可以是预设名，也可以是覆盖字段的 dict；
+    两者都叠加在模型自身的负载模型上（如 test-model-long-repeat 的 repeat）
+    """
+    selected = (metadata or {}).get("fake_profile")
+    if selected is None:
+        return base
+    if isinstance(selected, str):
+        if selected not in PRESET_PROFILES:
+            raise ValueError(f"Unknown fake profile: {selected}")
+        return base.merged(PRESET_PROFILES[selected].overrides())
+    return base.merged(selected)
+
+
+async def synthetic_stream(prompt: str, profile: LoadProfile):
+    """
+    按负载模型逐个 chunk 输出。
+    """
+    rng = random.Random(profile.seed)
+    prompt = prompt * profile.repeat
+    text = f"<think> {prompt[::-1]} \n</think> {prompt[:]}"
+    tokens = text.split(" ")
+    if profile.output_tokens is not None:
+        tokens = [tokens[i % len(tokens)] for i in range(profile.output_tokens)]
+    ttft = profile.sample_ttft(rng)
+    if ttft > 0:
+        await asyncio.sleep(ttft)
+    if rng.random() < profile.error_rate:
+        raise FakeUpstreamError("Injected upstream error")
+    abort_at = rng.randrange(len(tokens)) if tokens and rng.random() < profile.abort_rate else None
+    separator = " " if profile.chunk_tokens[1] > 1 else ""
+    position = 0
+    while position < len(tokens):
+        if abort_at is not None and position >= abort_at:
+            raise ConnectionResetError("Injected mid-stream abort")
+        size = rng.randint(*profile.chunk_tokens)
+        chunk = separator.join(tokens[position:position + size])
+        yield separator + chunk if position else chunk
+        position += size
+        if position < len(tokens):
+            delay = profile.chunk_delay(rng, size)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+
+async def fake_llm_stream(prompt: str, profile: Optional[LoadProfile] = None):
     """
     模拟 LLM 的逐步输出。
     实际情况你可以接本地模型、或者自己切片大文本。
     """
-    text = f"<think> {prompt[::-1]} \n</think> {prompt[:]}"
-    for i, ch in enumerate(text.split(" ")):
-        yield ch
-        await asyncio.sleep(0.05)  # 模拟生成延迟
-
-
-async def fake_llm_stream_chat(req: ChatCompletionRequest, **kwargs):
-    prompt = "".join([f"{message.role}: {message.content}\n" for message in req.messages])
-    async for chunk in fake_llm_stream(prompt):
-        yield ChatCompletionChoice(
-            index=0,
-            message=ChatMessage(role="assistant", content=chunk),
-            finish_reason=None,
-            delta=ChoiceDeltaContent(content=chunk, role="assistant")
-        )
-
-
-async def fake_llm_stream_completion(req: CompletionRequest, **kwargs):
-    prompt = req.prompt if isinstance(req.prompt, str) else "\n".join(req.prompt)
-    async for chunk in fake_llm_stream(prompt):
-        yield CompletionChoice(
-            index=0,
-            text=chunk,
-            finish_reason=None
-        )
-
-
-async def fake_llm_stream_chat_long_repeat(req: ChatCompletionRequest, **kwargs):
-    prompt = "".join([f"{message.role}: {message.content}\n" for message in req.messages])
-    # 即使用户页面断开或发出中断，此处也会继续执行，直到生成完毕
-    # 但用户界面不会显示生成内容
-    async for chunk in fake_llm_stream(prompt * 100):
-        yield ChatCompletionChoice(
-            index=0,
-            message=ChatMessage(role="assistant", content=chunk),
-            finish_reason=None,
-            delta=ChoiceDeltaContent(content=chunk, role="assistant")
-        )
-
-async def fake_llm_stream_chat_long_repeat_completion(req: CompletionRequest, **kwargs):
-    prompt = req.prompt if isinstance(req.prompt, str) else "\n".join(req.prompt)
-    async for chunk in fake_llm_stream(prompt * 100):
-        yield CompletionChoice(
-            index=0,
-            text=chunk,
-            finish_reason=None
-        )
+    async for chunk in synthetic_stream(prompt, profile or PRESET_PROFILES["default"]):
+        yield chunk
 
-def register_fake_llvm(model_registry: ModelRegistry):
-    logger.info("Registering test-model")
-    model_registry.register_model("test-model", ModelInterface(
-        info=ModelInfo(
-            id="test-model",
-            owned_by="self",
-            capabilities=ModelCapabilities(chat=True, completion=True, stream=True),
-        ),
-        invoke_chat=fake_llm_stream_chat,
-        invoke_completion=fake_llm_stream_completion,
-    ))
 
-    model_registry.register_model("test-model-long-repeat", ModelInterface(
+def _chat_prompt(req: ChatCompletionRequest) -> str:
+    return "".join([f"{message.role}: {message.content}\n" for message in req.messages])
+
+
+def _completion_prompt(req: CompletionRequest) -> str:
+    return req.prompt if isinstance(req.prompt, str) else "\n".join(req.prompt)
+
+
+def make_fake_model(model_id: str, profile: LoadProfile) -> ModelInterface:
+    """
+    用给定负载模型创建一个 fake 模型，请求 metadata 可以再覆盖
+    """
+    async def invoke_chat(req: ChatCompletionRequest, **kwargs):
+        async for chunk in fake_llm_stream(_chat_prompt(req), resolve_profile(profile, req.metadata)):
+            yield StreamDelta(chunk, role="assistant")
+
+    async def invoke_completion(req: CompletionRequest, **kwargs):
+        async for chunk in fake_llm_stream(_completion_prompt(req), resolve_profile(profile, req.metadata)):
+            yield StreamDelta(chunk)
+
+    def validate_request(req):
+        # 未知预设 / 字段在响应开始前报错
+        resolve_profile(profile, req.metadata)
+
+    return ModelInterface(
         info=ModelInfo(
-            id="test-model-long-repeat",
+            id=model_id,
             owned_by="self",
             capabilities=ModelCapabilities(chat=True, completion=True, stream=True),
         ),
-        invoke_chat=fake_llm_stream_chat_long_repeat,
-        invoke_completion=fake_llm_stream_chat_long_repeat_completion,
-    ))
+        invoke_chat=invoke_chat,
+        invoke_completion=invoke_completion,
+        adapter="fake",
+        validate_request=validate_request,
+    )
+
+
+def configured_profiles() -> Dict[str, LoadProfile]:
+    """
+    RDIFY_FAKE_MODELS：JSON 对象（或 JSON 文件路径），{模型 ID: 预设名或负载字段}，
+    例如 {"fake-fast": "zero-delay", "fake-slow": {"ttft": 1.5, "tokens_per_second": 10}}
+    """
+    raw = os.getenv("RDIFY_FAKE_MODELS")
+    if not raw:
+        return {}
+    if not raw.lstrip().startswith("{"):
+        with open(raw, "r", encoding="utf-8") as f:
+            raw = f.read()
+    profiles = {}
+    for model_id, spec in json.loads(raw).items():
+        profiles[model_id] = PRESET_PROFILES[spec] if isinstance(spec, str) else PRESET_PROFILES["default"].merged(spec)
+    return profiles
+
+
+def register_fake_llvm(model_registry: ModelRegistry):
+    logger.info("Registering test-model")
+    model_registry.register_model("test-model", make_fake_model("test-model", PRESET_PROFILES["default"]))
+
+    # 即使用户页面断开或发出中断，此处也会继续执行，直到生成完毕
+    # 但用户界面不会显示生成内容
+    model_registry.register_model(
+        "test-model-long-repeat",
+        make_fake_model("test-model-long-repeat", PRESET_PROFILES["default"].merged({"repeat": 100})),
+    )
+
+    for model_id, profile in configured_profiles().items():
+        logger.info(f"Registering fake model {model_id}: {profile}")
+        model_registry.register_model(model_id, make_fake_model(model_id, profile))
@@ -2,33 +2,105 @@ import os
 import json
 import asyncio
 import logging
-from openai import OpenAI
+from typing import Optional
+from openai import AsyncOpenAI
 from ..openai_schemas import ChatCompletionRequest, CompletionRequest, ChatCompletionChoice, CompletionChoice, ChoiceDeltaContent
 from ..openai_schemas import ChatMessage
 from ..models import ModelInterface, ModelInfo, ModelCapabilities, ModelRegistry
+from ..utils.http_pool import create_async_client
+from ..sse import SSEFrameParser
 
 
 logger = logging.getLogger("rdify.apps.fake_llvm")
 req_input_logger = logging.getLogger("rdify.req.input")
 
-async def redirect_llm_stream(messages: list[ChatMessage]):
-    client = OpenAI(api_key=os.getenv("MOONSHOT_API_KEY"), base_url=os.getenv("MOONSHOT_URL"))
-    resp = client.chat.completions.create(
+# 进程级共享的异步客户端，复用 keep-alive 连接池
+_client: Optional[AsyncOpenAI] = None
+
+
+def get_client() -> AsyncOpenAI:
+    global _client
+    if _client is None:
+        _client = AsyncOpenAI(
+            api_key=os.getenv("MOONSHOT_API_KEY"),
+            base_url=os.getenv("MOONSHOT_URL"),
+            http_client=create_async_client("MOONSHOT"),
+        )
+    return _client
+
+
+async def startup():
+    """
+    在 lifespan 启动时创建客户端并预热连接（提前完成 TCP/TLS 握手）
+    """
+    if not os.getenv("MOONSHOT_API_KEY"):
+        logger.info("MOONSHOT_API_KEY not set, skip redirect client warm-up")
+        return
+    client = get_client()
+    try:
+        await client.with_options(max_retries=0, timeout=10).models.list()
+        logger.info("Redirect client warmed up")
+    except Exception as e:
+        logger.warning(f"Redirect client warm-up failed: {e}")
+
+
+async def shutdown():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+async def redirect_llm_stream(messages: list[ChatMessage], cancel_scope=None):
+    client = get_client()
+    stream = await client.chat.completions.create(
         model=os.getenv("MOONSHOT_MODEL"),
         messages=messages,
         stream=True
     )
-    for chunk in resp:
-        logger.debug(f"Redirecting chunk: {chunk}")
-        yield chunk
+    if cancel_scope is not None:
+        # 客户端断开时立即关闭上游流，不再等待下一个 chunk
+        cancel_scope.add_callback(stream.close)
+    # 退出时关闭上游响应，连接归还连接池
+    async with stream:
+        async for chunk in stream:
+            logger.debug("Redirecting chunk: %s", chunk)
+            yield chunk
 
 
 async def redirect_llm_stream_chat(req: ChatCompletionRequest, **kwargs):
     req_input_logger.info(f"Redirecting chat: {req.model_dump_json()}")
-    async for chunk in redirect_llm_stream(req.messages):
+    async for chunk in redirect_llm_stream(req.messages, cancel_scope=kwargs.get("cancel_scope")):
         yield chunk
 
 
+async def redirect_llm_passthrough_chat(req: ChatCompletionRequest, **kwargs):
+    """
+    直接转发上游 SSE 字节帧，只改写 model 字段为请求的模型 ID
+    """
+    req_input_logger.info(f"Passthrough chat: {req.model_dump_json()}")
+    client = get_client()
+    parser = SSEFrameParser(model=req.model)
+    async with client.chat.completions.with_streaming_response.create(
+        model=os.getenv("MOONSHOT_MODEL"),
+        messages=req.messages,
+        stream=True,
+    ) as response:
+        cancel_scope = kwargs.get("cancel_scope")
+        if cancel_scope is not None:
+            cancel_scope.add_callback(response.close)
+        async for data in response.iter_bytes():
+            frames = parser.feed(data)
+            if frames:
+                yield frames
+    yield parser.flush()
+    logger.debug(f"Passthrough finished: finish_reason={parser.finish_reason}")
+
+
+def passthrough_enabled() -> bool:
+    return os.getenv("REDIRECT_PASSTHROUGH", "1") != "0"
+
+
 def register_redirect_llm(model_registry: ModelRegistry):
     logger.info("Registering redirect-model")
     model_registry.register_model("redirect-model", ModelInterface(
@@ -39,4 +111,6 @@ def register_redirect_llm(model_registry: ModelRegistry):
         ),
         invoke_chat=redirect_llm_stream_chat,
         invoke_completion=None,
+        invoke_chat_raw=redirect_llm_passthrough_chat if passthrough_enabled() else None,
+        adapter="redirect",
     ))
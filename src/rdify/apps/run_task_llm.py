@@ -1,31 +1,30 @@
-import pickle
+import asyncio
 import logging
-import re
 import os
+from contextlib import aclosing
 from datetime import datetime
 from functools import wraps
-from rdify.config import conversation_dir
+from typing import List, Optional, Union
+from ..conversation_store import CONVERSATION_STORE, ConversationStore, SessionRecorder, conversation_store_enabled
 from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
 from rdify.openai_schemas import ChatCompletionRequest, ChatCompletionChoice, ChatMessage
 from .redirect_llm import redirect_llm_stream_chat
 from langchain_openai import ChatOpenAI
-from pydantic import BaseModel, Field
 from ..openai_schemas import ChatCompletionRequest
 from ..models import ModelInterface, ModelInfo, ModelCapabilities, ModelRegistry
+from ..metrics import REGISTRY
+from .task_judge import TASK_JUDGE, JudgeSession, TaskIsFinishedResponse, remove_thinking_content
+from . import task_judge
 
 logger = logging.getLogger('rdify.task')
 
-class TaskIsFinishedResponse(BaseModel):
-    is_finished: bool = Field(..., description="Whether the task is finished")
-    message: str = Field(..., description="The message from the assistant")
-
-def remove_thinking_content(task_log: str) -> str:
-    reg = re.compile(r"<think>.*?</think>", re.DOTALL)
-    return re.sub(reg, "", task_log)
+SPECULATIVE_ROUNDS = REGISTRY.counter(
+    "rdify_speculative_continuations_total", "Speculatively started continuation rounds, by outcome", ("model", "outcome"),
+)
 
 def check_run_task_is_finished(task_log: str) -> TaskIsFinishedResponse:
     """
-    使用ChatOpenAI检查日志
+    使用ChatOpenAI检查日志（同步版本，服务中使用 check_conversation_is_finished_async）
     """
     task_log = remove_thinking_content(task_log)
     logger.debug(f"Checking if the task is finished: {len(task_log)}")
@@ -36,31 +35,97 @@ def check_run_task_is_finished(task_log: str) -> TaskIsFinishedResponse:
     return resp
 
 
-def map_message_to_string(message) -> str:
-    output = ""
-    if isinstance(message, ChatCompletionRequest):
-        for message in message.messages:
-            output += f"\n{message.role}: {message.content}"
-    elif isinstance(message, ChatCompletionChoice):
-        choice = message.choice[0]
-        output += f"\n{choice.message.role}: {choice.message.content}"
-    elif isinstance(message, ChatCompletionChunk):
-        choice = message.choices[0]
-        if choice.delta.role is not None:
-            output += f"\n{choice.delta.role}: {choice.delta.content}"
+class ConversationAccumulator:
+    """
+    增量组装 run-task 会话：按到达顺序喂入请求 / choice / chunk，
+    维护组装后的消息列表和任务日志，每个 chunk 只追加一个片段（均摊 O(1)）。
+
+    与原先的整段转换一致：流式 chunk 全部并入第一个带 role 的 chunk 开启的消息，
+    续写轮次的输出接在同一条助手消息后面。
+    """
+
+    def __init__(self, req: ChatCompletionRequest):
+        self.request = req
+        # 流式消息之前 / 之后的完整消息，以及对应的日志片段
+        self._before: List[ChatMessage] = []
+        self._after: List[ChatMessage] = []
+        self._before_log: List[str] = []
+        self._after_log: List[str] = []
+        self._buffer_role: Optional[str] = None
+        self._buffer_parts: List[str] = []
+        self._log: Optional[str] = None
+        self.add(req)
+
+    def add(self, item):
+        if isinstance(item, ChatCompletionRequest):
+            self._extend(item.messages)
+        elif isinstance(item, ChatCompletionChoice):
+            self._extend([item.message])
+        elif isinstance(item, ChatCompletionChunk):
+            self._add_chunk(item)
         else:
-            output += f"{choice.delta.content}"
-    else:
-        raise ValueError(f"Unsupported message type: {type(message)}")
-    return output
+            raise ValueError(f"Unsupported message type: {type(item)}")
+        self._log = None
+
+    def _extend(self, messages: List[ChatMessage]):
+        if self._buffer_role is None:
+            messages_out, log_out = self._before, self._before_log
+        else:
+            messages_out, log_out = self._after, self._after_log
+        messages_out.extend(messages)
+        log_out.extend(f"\n{message.role}: {message.content}" for message in messages)
+
+    def _add_chunk(self, chunk: ChatCompletionChunk):
+        if not chunk.choices:
+            return
+        delta = chunk.choices[0].delta
+        self._add_delta(delta.content, delta.role)
+
+    def add_delta(self, content: Optional[str], role: Optional[str] = None):
+        self._add_delta(content, role)
+        self._log = None
+
+    def _add_delta(self, content: Optional[str], role: Optional[str]):
+        if self._buffer_role is None:
+            if role is None:
+                logger.warning("Role is required")
+                return
+            self._buffer_role = role
+        if content:
+            self._buffer_parts.append(content)
+
+    def messages(self) -> List[ChatMessage]:
+        if self._buffer_role is None:
+            return list(self._before)
+        buffer_message = ChatMessage(role=self._buffer_role, content="".join(self._buffer_parts))
+        return self._before + [buffer_message] + self._after
+
+    def to_request(self) -> ChatCompletionRequest:
+        return self.request.model_copy(update={"messages": self.messages()})
+
+    def task_log(self) -> str:
+        if self._log is None:
+            parts = self._before_log
+            if self._buffer_role is not None:
+                parts = parts + [f"\n{self._buffer_role}: ", *self._buffer_parts] + self._after_log
+            self._log = "".join(parts)
+        return self._log
+
+
+def _accumulate(conversation: list) -> ConversationAccumulator:
+    if not isinstance(conversation[0], ChatCompletionRequest):
+        raise ValueError("Conversation must start with a ChatCompletionRequest")
+    accumulator = ConversationAccumulator(conversation[0])
+    for message in conversation[1:]:
+        accumulator.add(message)
+    return accumulator
+
 
 def convert_conversation_to_task_log(conversation: list) -> str:
     """
     将会话转换为日志字符串
     """
-    req = convert_conversation_to_chat_completion_request(conversation)
-    output = "".join(map(map_message_to_string, [req]))
-    return output
+    return _accumulate(conversation).task_log()
 
 def check_conversation_is_finished(conversation: list) -> TaskIsFinishedResponse:
     """
@@ -72,77 +137,173 @@ def check_conversation_is_finished(conversation: list) -> TaskIsFinishedResponse
     return check_run_task_is_finished(task_log)
 
 
+async def check_conversation_is_finished_async(
+    conversation: Union[list, ConversationAccumulator], session: Optional[JudgeSession] = None,
+) -> TaskIsFinishedResponse:
+    """
+    异步检查会话是否结束，不阻塞事件循环；session 在同一请求的多轮之间保留上次结论
+    """
+    if isinstance(conversation, ConversationAccumulator):
+        task_log = conversation.task_log()
+    else:
+        task_log = convert_conversation_to_task_log(conversation)
+    if session is None:
+        return await TASK_JUDGE.judge(task_log)
+    return await session.check(task_log)
+
+
 def dump_conversation(func):
+    """
+    会话内容边产生边写入追加式会话存储（后台线程写文件），不在内存中保留全部 chunk
+    """
     @wraps(func)
     async def wrapper(req: ChatCompletionRequest, **kwargs):
+        if not conversation_store_enabled():
+            async for chunk in func(req, **kwargs):
+                yield chunk
+            return
         conversation_id = datetime.now().strftime("conversation_%Y%m%d%H%M%S.%f").replace(".", "_")
-        conversation = [req]
-        async for chunk in func(req, **kwargs):
-            conversation.append(chunk)
-            yield chunk
+        recorder = SessionRecorder(CONVERSATION_STORE, conversation_id, req.model_dump(mode="json"))
+        status = "aborted"
         try:
-            with open(conversation_dir / f"{conversation_id}.pkl", "wb") as f:
-                pickle.dump(conversation, f)
-        except Exception as e:
-            logger.error(f"Error dumping conversation: {e}")
+            async for chunk in func(req, **kwargs):
+                if isinstance(chunk, ChatCompletionChunk) and chunk.choices:
+                    choice = chunk.choices[0]
+                    recorder.add(choice.delta.content, choice.delta.role, choice.finish_reason)
+                yield chunk
+            status = "ok"
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            recorder.end(status)
     return wrapper
 
 
+def load_conversation(conversation_id: str, store: ConversationStore = CONVERSATION_STORE) -> Optional[ChatCompletionRequest]:
+    """
+    从会话存储重建请求：原始消息 + 助手输出合并成的消息
+    """
+    records = store.read_session(conversation_id)
+    if not records or records[0]["k"] != "start":
+        return None
+    accumulator = ConversationAccumulator(ChatCompletionRequest.model_validate(records[0]["d"]))
+    for record in records[1:]:
+        if record["k"] == "delta":
+            accumulator.add_delta(record["d"]["content"], record["d"]["role"])
+    return accumulator.to_request()
+
+
 def convert_conversation_to_chat_completion_request(conversation: list) -> ChatCompletionRequest:
     """
     将会话转换为ChatCompletionRequest
     """
-    messages = []
-    if not isinstance(conversation[0], ChatCompletionRequest):
-        raise ValueError("Conversation must start with a ChatCompletionRequest")
-    buffer_message = None
-    for message in conversation:
-        if isinstance(message, ChatCompletionRequest):
-            messages.extend(message.messages)
-        elif isinstance(message, ChatCompletionChoice):
-            messages.append(message.message)
-        elif isinstance(message, ChatCompletionChunk):
-            buffer_message = message_add_chunk(message, buffer_message)
-            if buffer_message is not None and buffer_message not in messages:
-                messages.append(buffer_message)
-        else:
-            raise ValueError(f"Unsupported message type: {type(message)}")
-    resp = conversation[0].model_copy(update={"messages": messages}, deep=True)
-    return resp
+    return _accumulate(conversation).to_request()
+
+def speculative_continuation_enabled(model_id: str) -> bool:
+    """
+    RDIFY_SPECULATIVE_CONTINUATION：开启推测续写的模型 ID（逗号分隔），* 表示全部
+    """
+    models = {model.strip() for model in os.getenv("RDIFY_SPECULATIVE_CONTINUATION", "").split(",") if model.strip()}
+    return "*" in models or model_id in models
+
+
+_ROUND_END = object()
+
+
+class SpeculativeRound:
+    """
+    与判断并行提前发起的下一轮上游调用：后台任务读取 chunk 放入有界缓冲，
+    判断为未完成时直接从缓冲继续输出，判断为已完成时取消。
+    """
+
+    def __init__(self, model_id: str, chunk_gen, max_buffered: Optional[int] = None):
+        self.model_id = model_id
+        self._chunk_gen = chunk_gen
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_buffered or int(os.getenv("RDIFY_SPECULATIVE_BUFFER", "256")))
+        self._task = asyncio.create_task(self._pump())
+
+    async def _pump(self):
+        try:
+            async for chunk in self._chunk_gen:
+                await self._queue.put(chunk)
+        except Exception as e:
+            await self._queue.put(e)
+            return
+        await self._queue.put(_ROUND_END)
+
+    async def cancel(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        await self._chunk_gen.aclose()
+
+    def discard(self):
+        SPECULATIVE_ROUNDS.labels(self.model_id, "wasted").inc()
+        return self.cancel()
+
+    async def adopt(self):
+        """
+        采用推测结果，按顺序产出已缓冲和后续的 chunk
+        """
+        SPECULATIVE_ROUNDS.labels(self.model_id, "used").inc()
+        try:
+            while True:
+                item = await self._queue.get()
+                if item is _ROUND_END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            await self.cancel()
 
-def message_add_chunk(chunk: ChatCompletionChunk, message: ChatMessage = None) -> ChatMessage:
-    if message is None:
-        if chunk.choices[0].delta.role is None:
-            logger.warning("Role is required")
-            return None
-        message = ChatMessage(role=chunk.choices[0].delta.role, content=chunk.choices[0].delta.content)
-    else:
-        message.content += chunk.choices[0].delta.content or ""
-    return message
 
 def continue_stream(loop_count = 3):
     def decorator(func):
         @wraps(func)
         async def wrapper(req: ChatCompletionRequest, **kwargs):
-            conversation = [req]
+            accumulator = ConversationAccumulator(req)
+            judge_session = TASK_JUDGE.session()
+            speculate = speculative_continuation_enabled(req.model)
             task_is_finished = False
-            for i in range(loop_count):
-                logger.info(f"Continue stream loop {i}")
-                async for chunk in func(req, **kwargs):
-                    if isinstance(chunk, ChatCompletionChunk) and chunk.choices[0].finish_reason is not None:
-                        resp = check_conversation_is_finished(conversation)
-                        if resp.is_finished:
-                            conversation.append(chunk)
-                            task_is_finished = True
-                            yield chunk
-                            break
-                        else:
-                            req = convert_conversation_to_chat_completion_request(conversation)
+            speculative: Optional[SpeculativeRound] = None
+            try:
+                for i in range(loop_count):
+                    logger.info(f"Continue stream loop {i}")
+                    if speculative is not None:
+                        chunk_gen, speculative = speculative.adopt(), None
                     else:
-                        conversation.append(chunk)
-                        yield chunk
-                if task_is_finished:
-                    break
+                        chunk_gen = func(req, **kwargs)
+                    # 提前 break（任务已完成）或异常退出时立即关闭本轮生成器，
+                    # 采用的推测轮次随之取消上游请求，不等待垃圾回收
+                    async with aclosing(chunk_gen) as chunks:
+                        async for chunk in chunks:
+                            if isinstance(chunk, ChatCompletionChunk) and chunk.choices[0].finish_reason is not None:
+                                if speculate and i + 1 < loop_count:
+                                    # 同一轮出现多个结束 chunk 时，先丢弃上一次的推测再重新发起
+                                    if speculative is not None:
+                                        await speculative.discard()
+                                    # 判断期间下一轮已经开始生成，未完成时省去一次上游首 token 等待
+                                    speculative = SpeculativeRound(req.model, func(accumulator.to_request(), **kwargs))
+                                resp = await check_conversation_is_finished_async(accumulator, judge_session)
+                                if resp.is_finished:
+                                    if speculative is not None:
+                                        await speculative.discard()
+                                        speculative = None
+                                    accumulator.add(chunk)
+                                    task_is_finished = True
+                                    yield chunk
+                                    break
+                                else:
+                                    req = accumulator.to_request()
+                            else:
+                                accumulator.add(chunk)
+                                yield chunk
+                    if task_is_finished:
+                        break
+            finally:
+                if speculative is not None:
+                    await speculative.discard()
         return wrapper
     return decorator
 
@@ -152,6 +313,11 @@ async def run_task_llm_stream_chat(req: ChatCompletionRequest, **kwargs):
     async for chunk in redirect_llm_stream_chat(req, **kwargs):
         yield chunk
 
+async def shutdown():
+    await task_judge.shutdown()
+    await asyncio.to_thread(CONVERSATION_STORE.close)
+
+
 def register_run_task_llm(model_registry: ModelRegistry):
     model_registry.register_model("run-task-model", ModelInterface(
         info=ModelInfo(
@@ -161,4 +327,5 @@ def register_run_task_llm(model_registry: ModelRegistry):
         ),
         invoke_chat=run_task_llm_stream_chat,
         invoke_completion=None,
+        adapter="run-task",
     ))
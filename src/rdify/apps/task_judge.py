@@ -0,0 +1,157 @@
+import os
+import re
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+import httpx
+from langchain_openai import ChatOpenAI
+from pydantic import BaseModel, Field
+
+from ..metrics import REGISTRY
+from ..utils.http_pool import create_async_client
+
+logger = logging.getLogger("rdify.task")
+
+JUDGE_VERDICTS = REGISTRY.counter(
+    "rdify_task_judge_verdicts_total", "Task-completion verdicts for run-task-model, by source", ("source",),
+)
+JUDGE_LATENCY = REGISTRY.histogram(
+    "rdify_task_judge_llm_seconds", "Latency of task-completion judge LLM calls",
+    (0.25, 0.5, 1, 2, 4, 8, 16, 32),
+)
+
+
+class TaskIsFinishedResponse(BaseModel):
+    is_finished: bool = Field(..., description="Whether the task is finished")
+    message: str = Field(..., description="The message from the assistant")
+
+
+_THINKING = re.compile(r"<think>.*?</think>", re.DOTALL)
+
+# 助手以工具调用结束本轮：需要客户端执行工具，本轮结束
+_TOOL_CALL_SUFFIXES = ("</tool_use>", "</tool_call>", "</function_calls>")
+# convert_conversation_to_task_log 输出中每条消息以 "\n角色: " 开头
+_ROLE_PREFIX = re.compile(r"\n(?:system|user|assistant|function): ")
+_ASSISTANT_PREFIX = "\nassistant: "
+
+
+def remove_thinking_content(task_log: str) -> str:
+    return _THINKING.sub("", task_log)
+
+
+def heuristic_verdict(task_log: str) -> Optional[TaskIsFinishedResponse]:
+    """
+    不调用 LLM 就能确定结论的情况（待执行的工具调用、助手空回复），返回 None 表示需要 LLM 判断。
+    以问号结尾不算：助手可能在任务中途自问自答
+    """
+    tail = task_log.rstrip()
+    if tail.endswith(_TOOL_CALL_SUFFIXES):
+        return TaskIsFinishedResponse(is_finished=True, message="Task is finished")
+    # 最后一条消息是助手的空回复：什么也没做，继续
+    offsets = [match.start() for match in _ROLE_PREFIX.finditer(task_log)]
+    if offsets and task_log.startswith(_ASSISTANT_PREFIX, offsets[-1]) and not tail[offsets[-1] + len(_ASSISTANT_PREFIX):].strip():
+        return TaskIsFinishedResponse(is_finished=False, message="Assistant produced no output")
+    return None
+
+
+# 进程级共享的判断模型与 HTTP 连接池
+_http_client: Optional[httpx.AsyncClient] = None
+_llm = None
+
+
+def get_judge_llm():
+    global _http_client, _llm
+    if _llm is None:
+        _http_client = create_async_client("MOONSHOT")
+        _llm = ChatOpenAI(
+            model=os.getenv("MOONSHOT_MODEL"),
+            temperature=0,
+            base_url=os.getenv("MOONSHOT_URL"),
+            api_key=os.getenv("MOONSHOT_API_KEY"),
+            http_async_client=_http_client,
+        ).with_structured_output(TaskIsFinishedResponse)
+    return _llm
+
+
+async def shutdown():
+    global _http_client, _llm
+    if _http_client is not None:
+        await _http_client.aclose()
+    _http_client = None
+    _llm = None
+
+
+def judge_prompt(task_log: str, previous: Optional[TaskIsFinishedResponse] = None) -> str:
+    if previous is None:
+        return f"Check if the task is finished: <task_log>{task_log}</task_log>"
+    return (
+        f"The task was previously judged as not finished: {previous.message}\n"
+        f"Check if the task is finished given the new log since then: <task_log>{task_log}</task_log>"
+    )
+
+
+class TaskJudge:
+    """
+    异步的任务完成判断：启发式预判 -> 结果缓存（按 prompt 摘要）-> 共享客户端调用 LLM。
+    """
+
+    def __init__(self, max_entries: Optional[int] = None):
+        self.max_entries = max_entries or int(os.getenv("RDIFY_TASK_JUDGE_CACHE_ENTRIES", "1024"))
+        self._cache: "OrderedDict[str, TaskIsFinishedResponse]" = OrderedDict()
+
+    async def _ask(self, prompt: str) -> TaskIsFinishedResponse:
+        return await get_judge_llm().ainvoke(prompt)
+
+    async def judge(self, task_log: str, previous: Optional[TaskIsFinishedResponse] = None) -> TaskIsFinishedResponse:
+        verdict = heuristic_verdict(task_log)
+        if verdict is not None:
+            JUDGE_VERDICTS.labels("heuristic").inc()
+            return verdict
+        prompt = judge_prompt(remove_thinking_content(task_log), previous)
+        key = hashlib.sha256(prompt.encode()).hexdigest()
+        verdict = self._cache.get(key)
+        if verdict is not None:
+            self._cache.move_to_end(key)
+            JUDGE_VERDICTS.labels("cache").inc()
+            return verdict
+        logger.debug("Judging task log: %s chars", len(prompt))
+        started = time.perf_counter()
+        verdict = await self._ask(prompt)
+        JUDGE_LATENCY.labels().observe(time.perf_counter() - started)
+        JUDGE_VERDICTS.labels("llm").inc()
+        logger.debug("Task judged: %s", verdict)
+        self._cache[key] = verdict
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return verdict
+
+    def session(self, tail_only: Optional[bool] = None) -> "JudgeSession":
+        return JudgeSession(self, tail_only)
+
+
+class JudgeSession:
+    """
+    一次 run-task 请求内的多次判断。开启 tail_only（RDIFY_TASK_JUDGE_TAIL=1）时，
+    上次结论之后只发送新增的日志和上次结论，不再重复发送完整日志。
+    """
+
+    def __init__(self, judge: TaskJudge, tail_only: Optional[bool] = None):
+        self.judge = judge
+        self.tail_only = os.getenv("RDIFY_TASK_JUDGE_TAIL", "0") == "1" if tail_only is None else tail_only
+        self.offset = 0
+        self.previous: Optional[TaskIsFinishedResponse] = None
+
+    async def check(self, task_log: str) -> TaskIsFinishedResponse:
+        if self.tail_only and self.previous is not None:
+            verdict = await self.judge.judge(task_log[self.offset:], previous=self.previous)
+        else:
+            verdict = await self.judge.judge(task_log)
+        self.offset = len(task_log)
+        self.previous = verdict
+        return verdict
+
+
+TASK_JUDGE = TaskJudge()
@@ -0,0 +1,444 @@
+"""
+端到端压测 / 回归基准。
+
+在进程内（直接驱动 ASGI 应用）或通过真实 socket（uvicorn）以指定并发请求 fake 模型，
+统计 TTFT、token 间隔、请求数/秒、token/秒、每 token CPU 时间和峰值 RSS，
+结果保存为 JSON，可与基线比较：
+
+    python -m rdify.bench --transport asgi,socket --concurrency 1,16 --output logs/bench.json
+    python -m rdify.bench --baseline logs/bench.json --threshold 0.2 --threshold ttft_ms.p99=0.5
+
+token 指流式响应中每个非空内容增量；非流式场景只统计延迟（TTFT 即完整响应耗时）。
+CPU 和 RSS 是整个进程的数据，包括压测客户端自身的开销。
+应用不经过 lifespan 启动（避免 Dify 远程发现），只注册本地 fake 模型，
+因此日志队列监听线程、注册表快照监视等后台任务不在测量范围内。
+"""
+import json
+import math
+import time
+import asyncio
+import logging
+import argparse
+import resource
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+logger = logging.getLogger("rdify.bench")
+
+RESULT_VERSION = 1
+
+PROMPT = " ".join(f"word{i}" for i in range(32))
+
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    path: str
+    stream: bool
+    # 收到多少个 token 后断开连接
+    disconnect_after: Optional[int] = None
+    # 覆盖命令行指定的 fake 负载
+    profile: Optional[dict] = None
+
+    def body(self, model: str, profile) -> dict:
+        if self.path == "/v1/chat/completions":
+            body = {"model": model, "messages": [{"role": "user", "content": PROMPT}]}
+        else:
+            body = {"model": model, "prompt": PROMPT}
+        body["stream"] = self.stream
+        body["metadata"] = {"fake_profile": self.profile if self.profile is not None else profile}
+        return body
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    scenario.name: scenario for scenario in (
+        Scenario("chat-stream", "/v1/chat/completions", stream=True),
+        Scenario("chat-blocking", "/v1/chat/completions", stream=False),
+        Scenario("completion-stream", "/v1/completions", stream=True),
+        Scenario("completion-blocking", "/v1/completions", stream=False),
+        # 上游仍在生成时客户端断开，检验取消路径的开销
+        Scenario(
+            "chat-disconnect", "/v1/chat/completions", stream=True, disconnect_after=3,
+            profile={"tokens_per_second": 500, "output_tokens": 200},
+        ),
+    )
+}
+
+
+@dataclass
+class Sample:
+    """
+    单个请求的测量结果（时间单位：秒，相对请求发出时刻）
+    """
+    status: int = 0
+    ttft: Optional[float] = None
+    token_times: List[float] = field(default_factory=list)
+    total: float = 0.0
+    disconnected: bool = False
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.status == 200
+
+    def gaps(self) -> List[float]:
+        return [b - a for a, b in zip(self.token_times, self.token_times[1:])]
+
+
+class SSECounter:
+    """
+    增量解析 SSE 字节流，记录每个内容增量的到达时间。
+    limit 为断开阈值：同一块数据中超出阈值的增量不计入，使断开场景的 token 数与分块方式无关
+    """
+
+    def __init__(self, sample: Sample, start: float, stream: bool, limit: Optional[int] = None):
+        self.sample = sample
+        self.start = start
+        self.stream = stream
+        self.limit = limit
+        self._buffer = b""
+
+    def feed(self, data: bytes):
+        now = time.perf_counter() - self.start
+        # 流式取第一个内容增量的时间，非流式取响应体到达的时间
+        if self.sample.ttft is None and data and not self.stream:
+            self.sample.ttft = now
+        self._buffer += data
+        *frames, self._buffer = self._buffer.split(b"\n\n")
+        for frame in frames:
+            if not frame.startswith(b"data: ") or frame == b"data: [DONE]":
+                continue
+            for choice in json.loads(frame[6:]).get("choices", []):
+                content = (choice.get("delta") or {}).get("content") or choice.get("text")
+                if content:
+                    if self.limit is not None and self.tokens >= self.limit:
+                        return
+                    if self.sample.ttft is None:
+                        self.sample.ttft = now
+                    self.sample.token_times.append(now)
+
+    @property
+    def tokens(self) -> int:
+        return len(self.sample.token_times)
+
+
+async def asgi_request(app, scenario: Scenario, body: dict) -> Sample:
+    """
+    直接调用 ASGI 应用。httpx.ASGITransport 会缓冲整个响应体，无法测量流式时延，
+    因此这里自己实现 receive / send。
+    """
+    sample = Sample()
+    start = time.perf_counter()
+    counter = SSECounter(sample, start, scenario.stream, scenario.disconnect_after)
+    payload = json.dumps(body).encode()
+    body_sent = False
+    disconnect = asyncio.Event()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": scenario.path,
+        "raw_path": scenario.path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())],
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if disconnect.is_set():
+            return
+        if message["type"] == "http.response.start":
+            sample.status = message["status"]
+        elif message["type"] == "http.response.body":
+            counter.feed(message.get("body", b""))
+            if scenario.disconnect_after is not None and counter.tokens >= scenario.disconnect_after:
+                sample.disconnected = True
+                disconnect.set()
+            elif not message.get("more_body", False):
+                disconnect.set()
+
+    try:
+        await app(scope, receive, send)
+    except Exception as e:
+        sample.error = repr(e)
+    sample.total = time.perf_counter() - start
+    return sample
+
+
+async def socket_request(client: httpx.AsyncClient, scenario: Scenario, body: dict) -> Sample:
+    sample = Sample()
+    start = time.perf_counter()
+    counter = SSECounter(sample, start, scenario.stream, scenario.disconnect_after)
+    try:
+        async with client.stream("POST", scenario.path, json=body) as response:
+            sample.status = response.status_code
+            async for data in response.aiter_raw():
+                counter.feed(data)
+                if scenario.disconnect_after is not None and counter.tokens >= scenario.disconnect_after:
+                    # 退出 async with 时关闭连接
+                    sample.disconnected = True
+                    break
+    except httpx.HTTPError as e:
+        sample.error = repr(e)
+    sample.total = time.perf_counter() - start
+    return sample
+
+
+def percentiles(values: List[float], scale: float = 1000.0) -> Dict[str, Optional[float]]:
+    """
+    最近秩百分位数，默认换算为毫秒
+    """
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    ordered = sorted(values)
+
+    def rank(q: float) -> float:
+        index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+        return round(ordered[index] * scale, 3)
+
+    return {"p50": rank(0.50), "p95": rank(0.95), "p99": rank(0.99)}
+
+
+def summarize(samples: List[Sample], elapsed: float, cpu: float, peak_rss_kb: int) -> dict:
+    tokens = sum(len(sample.token_times) for sample in samples)
+    return {
+        "requests": len(samples),
+        "errors": sum(not sample.ok for sample in samples),
+        "disconnects": sum(sample.disconnected for sample in samples),
+        "elapsed_s": round(elapsed, 4),
+        "rps": round(len(samples) / elapsed, 2) if elapsed else None,
+        "tokens": tokens,
+        "tokens_per_second": round(tokens / elapsed, 2) if elapsed and tokens else None,
+        "ttft_ms": percentiles([sample.ttft for sample in samples if sample.ttft is not None]),
+        "gap_ms": percentiles([gap for sample in samples for gap in sample.gaps()]),
+        "cpu_us_per_token": round(cpu / tokens * 1e6, 2) if tokens else None,
+        # Linux 上 ru_maxrss 单位为 KB
+        "peak_rss_mb": round(peak_rss_kb / 1024, 1),
+    }
+
+
+def _cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def run_scenario(request, scenario: Scenario, body: dict, concurrency: int, requests: int) -> dict:
+    """
+    concurrency 个 worker 循环发送 request(scenario, body)，共 requests 个请求
+    """
+    samples: List[Sample] = []
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            samples.append(await request(scenario, body))
+
+    cpu = _cpu_seconds()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    cpu = _cpu_seconds() - cpu
+    return summarize(samples, elapsed, cpu, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+async def start_server(app):
+    """
+    在当前事件循环中启动 uvicorn，监听随机端口，返回 (server, serve 任务, base_url)。
+    lifespan 关闭，与 asgi 传输一致，模型由 prepare_models 注册
+    """
+    import uvicorn
+
+    # 由 uvicorn 自己创建监听 socket：asyncio 只对 proto 为 IPPROTO_TCP 的连接设置 TCP_NODELAY，
+    # 自建的 socket.socket() proto 为 0，会引入 Nagle + 延迟 ACK 的约 40ms 额外延迟
+    config = uvicorn.Config(app, host="127.0.0.1", port=0, lifespan="off", log_config=None, access_log=False)
+    server = uvicorn.Server(config)
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    host, port = server.servers[0].sockets[0].getsockname()[:2]
+    return server, task, f"http://{host}:{port}"
+
+
+def prepare_models():
+    """
+    只注册本地 fake 模型，不执行 lifespan 中的远程发现
+    """
+    from .llm_models import MODEL_REGISTRY
+    from .apps.fake_llvm import register_fake_llvm
+
+    if MODEL_REGISTRY.get_model("test-model") is None:
+        register_fake_llvm(MODEL_REGISTRY)
+
+
+async def run_bench(transports: List[str], scenarios: List[str], concurrency: List[int], requests: int,
+                    model: str = "test-model", profile="zero-delay", warmup: int = 5) -> dict:
+    from .app import app
+
+    prepare_models()
+    results = {}
+    for transport in transports:
+        if transport == "asgi":
+            server = client = None
+            request = lambda scenario, body: asgi_request(app, scenario, body)
+        elif transport == "socket":
+            server, task, base_url = await start_server(app)
+            client = httpx.AsyncClient(
+                base_url=base_url, trust_env=False, timeout=60,
+                limits=httpx.Limits(max_connections=max(concurrency), max_keepalive_connections=max(concurrency)),
+            )
+            request = lambda scenario, body: socket_request(client, scenario, body)
+        else:
+            raise ValueError(f"Unknown transport: {transport}")
+        try:
+            for name in scenarios:
+                scenario = SCENARIOS[name]
+                body = scenario.body(model, profile)
+                for _ in range(warmup):
+                    await request(scenario, body)
+                for level in concurrency:
+                    key = f"{transport}/{name}/c{level}"
+                    results[key] = await run_scenario(request, scenario, body, level, requests)
+                    logger.info("%s: %s", key, results[key])
+        finally:
+            if client is not None:
+                await client.aclose()
+            if server is not None:
+                server.should_exit = True
+                await task
+    return {
+        "version": RESULT_VERSION,
+        "created": time.time(),
+        "config": {
+            "transports": transports, "scenarios": scenarios, "concurrency": concurrency,
+            "requests": requests, "model": model, "profile": profile,
+        },
+        "results": results,
+    }
+
+
+# 数值越小越好的指标；其余（rps、tokens_per_second）越大越好
+LOWER_IS_BETTER = (
+    "ttft_ms.p50", "ttft_ms.p95", "ttft_ms.p99", "gap_ms.p50", "gap_ms.p95", "gap_ms.p99",
+    "cpu_us_per_token", "peak_rss_mb",
+)
+HIGHER_IS_BETTER = ("rps", "tokens_per_second")
+
+
+def _metric(summary: dict, name: str) -> Optional[float]:
+    value = summary
+    for part in name.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def compare(current: dict, baseline: dict, threshold: float = 0.2,
+            thresholds: Optional[Dict[str, float]] = None) -> List[dict]:
+    """
+    与基线比较，返回超出阈值（相对变化）的回归项；只比较两边都有的结果和指标
+    """
+    thresholds = thresholds or {}
+    regressions = []
+    for key, summary in current["results"].items():
+        base = baseline["results"].get(key)
+        if base is None:
+            continue
+        for name in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            now, before = _metric(summary, name), _metric(base, name)
+            if not now or not before:
+                continue
+            change = (now - before) / before
+            if name in HIGHER_IS_BETTER:
+                change = -change
+            limit = thresholds.get(name, threshold)
+            if change > limit:
+                regressions.append({
+                    "result": key, "metric": name, "baseline": before, "current": now,
+                    "change": round(change, 4), "threshold": limit,
+                })
+        if summary["errors"] > base["errors"]:
+            regressions.append({
+                "result": key, "metric": "errors", "baseline": base["errors"], "current": summary["errors"],
+                "change": None, "threshold": 0,
+            })
+    return regressions
+
+
+def _csv(value: str) -> List[str]:
+    return [item for item in value.split(",") if item]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m rdify.bench", description="rdify 端到端压测")
+    parser.add_argument("--transport", type=_csv, default=["asgi"], help="asgi,socket")
+    parser.add_argument("--scenario", type=_csv, default=list(SCENARIOS), help=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=lambda v: [int(x) for x in _csv(v)], default=[1, 16])
+    parser.add_argument("--requests", type=int, default=200, help="每个并发档位的请求数")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--model", default="test-model")
+    parser.add_argument("--profile", default="zero-delay", help="fake 负载预设名或 JSON 字段覆盖")
+    parser.add_argument("--output", type=Path, help="结果 JSON 路径")
+    parser.add_argument("--baseline", type=Path, help="基线 JSON，存在回归时退出码为 1")
+    parser.add_argument("--threshold", action="append", default=[],
+                        help="允许的相对变化，如 0.2 或 ttft_ms.p99=0.5，可重复")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.scenario) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {sorted(unknown)}")
+    profile = json.loads(args.profile) if args.profile.lstrip().startswith("{") else args.profile
+    threshold, thresholds = 0.2, {}
+    for item in args.threshold:
+        if "=" in item:
+            name, value = item.split("=", 1)
+            thresholds[name] = float(value)
+        else:
+            threshold = float(item)
+
+    logging.basicConfig(level=logging.INFO)
+    # 应用自身的日志会干扰测量
+    logging.getLogger("rdify").setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+    for name in ("httpx", "uvicorn.error"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    report = asyncio.run(run_bench(
+        args.transport, args.scenario, args.concurrency, args.requests,
+        model=args.model, profile=profile, warmup=args.warmup,
+    ))
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(text, encoding="utf-8")
+    print(text)
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        regressions = compare(report, baseline, threshold, thresholds)
+        for regression in regressions:
+            print(f"REGRESSION {regression['result']} {regression['metric']}: "
+                  f"{regression['baseline']} -> {regression['current']}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
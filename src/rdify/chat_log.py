@@ -0,0 +1,74 @@
+import os
+import json
+import time
+import random
+import logging
+from typing import List, Optional, Union
+
+from .aggregator import ChatAggregator, CompletionAggregator
+from .metrics import StreamRecorder
+
+output_logger = logging.getLogger("rdify.chat")
+
+# 记录对话内容的响应比例：1 为全部记录，0 为不记录
+SAMPLE_RATE = float(os.getenv("RDIFY_CHAT_LOG_SAMPLE_RATE", "1"))
+
+
+def chat_log_sampled() -> bool:
+    """
+    请求开始时决定本次响应是否记录
+    """
+    if not output_logger.isEnabledFor(logging.INFO):
+        return False
+    return SAMPLE_RATE >= 1 or random.random() < SAMPLE_RATE
+
+
+class ChatLogEntry:
+    """
+    一次响应的汇总记录。作为日志参数传入，JSON 序列化在日志后台线程中完成。
+    source 为聚合器（chat / completion）或透传模式下的原始 SSE 帧列表。
+    """
+    __slots__ = ("kind", "id", "model", "status", "chunks", "bytes", "duration", "source")
+
+    def __init__(self, kind: str, id: Optional[str], recorder: StreamRecorder, status: str,
+                 source: Union[ChatAggregator, CompletionAggregator, List[bytes]]):
+        self.kind = kind
+        self.id = id
+        self.model = recorder.labels[0]
+        self.status = status
+        self.chunks = recorder.chunks
+        self.bytes = recorder.bytes
+        self.duration = time.perf_counter() - recorder.start
+        self.source = source
+
+    def _contents(self) -> List[str]:
+        source = self.source
+        if isinstance(source, ChatAggregator):
+            return [choice.message.content for choice in source.result()]
+        if isinstance(source, CompletionAggregator):
+            return [choice.text for choice in source.result()]
+        parts = {}
+        for line in b"".join(source).split(b"\n"):
+            if not line.startswith(b"data: {"):
+                continue
+            for choice in json.loads(line[6:]).get("choices") or ():
+                content = (choice.get("delta") or {}).get("content")
+                if content:
+                    parts.setdefault(choice.get("index", 0), []).append(content)
+        return ["".join(parts[index]) for index in sorted(parts)]
+
+    def __str__(self) -> str:
+        return json.dumps({
+            "kind": self.kind,
+            "id": self.id,
+            "model": self.model,
+            "status": self.status,
+            "chunks": self.chunks,
+            "bytes": self.bytes,
+            "duration": round(self.duration, 4),
+            "contents": self._contents(),
+        }, ensure_ascii=False)
+
+
+def log_response(kind: str, id: Optional[str], recorder: StreamRecorder, status: str, source):
+    output_logger.info("%s", ChatLogEntry(kind, id, recorder, status, source))
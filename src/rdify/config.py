@@ -3,6 +3,8 @@ from dotenv import load_dotenv
 from pathlib import Path
 from ruamel.yaml import YAML
 
+from .utils.log_queue import install_queue_logging
+
 PACKAGE_ROOT = Path(__file__).parent
 
 load_dotenv()
@@ -19,6 +21,8 @@ conversation_dir = Path('.') / "logs" / "conversations"
 conversation_dir.mkdir(parents=True, exist_ok=True)
 
 logging.config.dictConfig(config)
+# 文件写入放到后台线程，避免阻塞事件循环
+install_queue_logging()
 
 config = {}
 
@@ -0,0 +1,541 @@
+import os
+import re
+import gzip
+import json
+import time
+import hashlib
+import queue
+import atexit
+import logging
+import threading
+import contextlib
+from pathlib import Path
+from typing import Dict, IO, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows 下没有 flock，GC 与写线程之间只依赖宽限期
+    fcntl = None
+
+logger = logging.getLogger("rdify.conversation_store")
+
+# 版本 2：start 记录中的消息历史改为引用内容寻址的 blob 链（"history"）
+RECORD_VERSION = 2
+_STOP = object()
+# 段文件名：{启动时间}-{pid}-{序号}
+_SEGMENT_NAME = re.compile(r"^\d+-\d+-\d+$")
+
+
+class ConversationStore:
+    """
+    追加写入的会话存储。每条记录是一行 JSON：
+        {"v": 版本, "s": 会话 ID, "k": 类型(start/delta/end), "ts": 时间, "d": 数据}
+
+    - 记录由调用方入队，后台线程负责序列化和写文件，不阻塞事件循环；
+    - 按段文件写入（{writer}-{seq}.jsonl，writer 区分进程），超过 segment_max_bytes 轮转，
+      可选在轮转后压缩为 .jsonl.gz；
+    - index.jsonl 记录「会话 ID -> 段文件, 首条记录偏移」，读取时从该位置向后扫描；
+    - 每批记录写入后 flush，进程崩溃只丢失尚未写出的最后几条，而不是整个会话；
+    - 开启去重（默认）时，start 记录中的消息历史存为内容寻址的 blob 链：
+      blobs/ab/<hash>.json = {"p": 前缀的 hash, "m": 消息}，hash = sha256(前缀 hash + 消息)，
+      记录只保存最后一条消息的 hash。客户端每轮重发的相同前缀只存一份，
+      由 collect_garbage 删除不再被任何会话引用的 blob；
+    - 保留期（retention 秒，0 表示永久保留）：collect_garbage 删除最后写入时间超过保留期的段文件
+      （仍在写入的段除外），并压缩 index.jsonl，去掉指向已删除段的条目；
+    - 写线程复用/写入 blob、追加索引时持有 store.lock 共享锁，GC 删除段 / 压缩索引 / 删除 blob 时
+      持有排他锁（GC 可能在其他进程中运行）。索引被压缩替换后，写线程在下次追加前重新打开。
+    """
+
+    def __init__(
+        self,
+        directory: Optional[Path] = None,
+        segment_max_bytes: Optional[int] = None,
+        compress: Optional[bool] = None,
+        dedup: Optional[bool] = None,
+        retention: Optional[float] = None,
+    ):
+        self.directory = Path(directory or os.getenv("RDIFY_CONVERSATION_STORE_DIR", "logs/conversations/store"))
+        self.segment_max_bytes = segment_max_bytes or int(os.getenv("RDIFY_CONVERSATION_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+        self.compress = os.getenv("RDIFY_CONVERSATION_COMPRESS", "0") == "1" if compress is None else compress
+        self.dedup = os.getenv("RDIFY_CONVERSATION_DEDUP", "1") != "0" if dedup is None else dedup
+        self.retention = retention if retention is not None else float(os.getenv("RDIFY_CONVERSATION_RETENTION", str(30 * 24 * 3600)))
+        self.index_path = self.directory / "index.jsonl"
+        self.blob_dir = self.directory / "blobs"
+        self.lock_path = self.directory / "store.lock"
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._atexit_registered = False
+        # 以下只在写线程中使用
+        self._writer_id: Optional[str] = None
+        self._seq = 0
+        self._segment: Optional[IO[bytes]] = None
+        self._segment_size = 0
+        # 当前正在写入的段文件名，GC 不删除
+        self._current_segment: Optional[str] = None
+        self._index: Optional[IO[bytes]] = None
+        self._pending_index: List[bytes] = []
+        # 读取端的索引缓存：(inode, 大小, mtime) 不变时直接复用，文件增长时只读取新增的行
+        self._index_lock = threading.Lock()
+        self._index_entries: Dict[str, Tuple[str, int]] = {}
+        self._index_state: Optional[Tuple[int, int, int]] = None
+        self._index_offset = 0
+
+    # ---- 写入 ----
+
+    def append(self, session_id: str, kind: str, data):
+        """
+        入队一条记录（线程安全，立即返回）。data 须可 JSON 序列化，入队后不应再修改。
+        """
+        if self._thread is None:
+            self._start()
+        self._queue.put((session_id, kind, data, time.time()))
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="rdify-conversation-store", daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.close)
+                self._atexit_registered = True
+
+    def close(self):
+        """
+        写完队列中剩余的记录并停止后台线程，之后再写入会重新启动
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+
+    def _run(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._writer_id = f"{int(time.time())}-{os.getpid()}"
+        self._seq = 0
+        self._index = open(self.index_path, "ab")
+        self._open_segment()
+        stopping = False
+        try:
+            while not stopping:
+                batch = [self._queue.get()]
+                # 一次取出积压的全部记录，合并成一次 flush
+                while True:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                for item in batch:
+                    if item is _STOP:
+                        stopping = True
+                        continue
+                    try:
+                        self._write(*item)
+                    except Exception as e:
+                        logger.error("Failed to store conversation record %s/%s: %s", item[0], item[1], e)
+                self._segment.flush()
+                self._flush_index()
+        finally:
+            self._close_segment(compress=False)
+            self._flush_index()
+            self._index.close()
+
+    def _flush_index(self):
+        """
+        追加本批次的索引条目（段文件已先 flush）
+        """
+        if not self._pending_index:
+            return
+        with self._store_lock(exclusive=False):
+            # GC 压缩索引时会替换文件，继续写旧文件的条目会丢失
+            try:
+                replaced = os.stat(self.index_path).st_ino != os.fstat(self._index.fileno()).st_ino
+            except FileNotFoundError:
+                replaced = True
+            if replaced:
+                self._index.close()
+                self._index = open(self.index_path, "ab")
+            self._index.write(b"".join(self._pending_index))
+            self._index.flush()
+        self._pending_index = []
+
+    def _segment_name(self, seq: int) -> str:
+        return f"{self._writer_id}-{seq:06d}"
+
+    def _open_segment(self):
+        self._current_segment = self._segment_name(self._seq)
+        self._segment = open(self.directory / f"{self._current_segment}.jsonl", "ab")
+        self._segment_size = self._segment.tell()
+
+    def _close_segment(self, compress: bool):
+        if self._segment is None:
+            return
+        self._segment.close()
+        self._segment = None
+        self._current_segment = None
+        if compress:
+            path = self.directory / f"{self._segment_name(self._seq)}.jsonl"
+            with open(path, "rb") as src, gzip.open(path.with_suffix(".jsonl.gz"), "wb") as dst:
+                while True:
+                    block = src.read(1024 * 1024)
+                    if not block:
+                        break
+                    dst.write(block)
+            path.unlink()
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.blob_dir / digest[:2] / f"{digest}.json"
+
+    @contextlib.contextmanager
+    def _store_lock(self, exclusive: bool):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _reuse_prefix(self, digests: List[str]) -> int:
+        """
+        返回已存在的最长前缀长度，并刷新其最后一个 blob 的 mtime，使 GC 的宽限期保护这条正在被复用的链。
+        blob 总是先于其后继写入，存在的最长前缀之前的 blob 也都存在。
+        用 utime 本身判断存在性：blob 在检查与刷新之间被删除时继续向前查找，而不是抛出异常。
+        """
+        start = len(digests)
+        while start > 0:
+            try:
+                os.utime(self._blob_path(digests[start - 1]))
+                return start
+            except FileNotFoundError:
+                start -= 1
+        return 0
+
+    def _write_history(self, messages: List[dict]) -> Optional[str]:
+        """
+        把消息历史写成 blob 链，返回最后一条消息的 hash（在写线程中执行）
+        """
+        digests: List[str] = []
+        bodies: List[str] = []
+        parent = ""
+        for message in messages:
+            body = json.dumps(message, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+            parent = hashlib.sha256((parent + body).encode()).hexdigest()
+            digests.append(parent)
+            bodies.append(body)
+        # 持有共享锁：GC 不会在前缀检查之后、新 blob 写入之前删除被复用的前缀
+        with self._store_lock(exclusive=False):
+            for i in range(self._reuse_prefix(digests), len(digests)):
+                path = self._blob_path(digests[i])
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_suffix(f".{os.getpid()}.tmp")
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(f'{{"p":{json.dumps(digests[i - 1] if i else None)},"m":{bodies[i]}}}')
+                os.replace(tmp, path)
+        return digests[-1] if digests else None
+
+    def _read_blob(self, digest: str) -> Optional[dict]:
+        try:
+            with open(self._blob_path(digest), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def resolve_history(self, head: Optional[str]) -> List[dict]:
+        messages = []
+        while head is not None:
+            blob = self._read_blob(head)
+            if blob is None:
+                logger.warning("Missing conversation blob %s", head)
+                break
+            messages.append(blob["m"])
+            head = blob["p"]
+        messages.reverse()
+        return messages
+
+    def _write(self, session_id: str, kind: str, data, ts: float):
+        if kind == "start" and self.dedup and "messages" in data:
+            history = self._write_history(data["messages"])
+            data = {key: value for key, value in data.items() if key != "messages"}
+            data["history"] = history
+        line = json.dumps(
+            {"v": RECORD_VERSION, "s": session_id, "k": kind, "ts": ts, "d": data},
+            ensure_ascii=False, separators=(",", ":"),
+        ).encode() + b"\n"
+        if self._segment_size and self._segment_size + len(line) > self.segment_max_bytes:
+            self._close_segment(self.compress)
+            self._seq += 1
+            self._open_segment()
+        if kind == "start":
+            entry = {"s": session_id, "seg": self._segment_name(self._seq), "off": self._segment_size}
+            self._pending_index.append(json.dumps(entry).encode() + b"\n")
+        self._segment.write(line)
+        self._segment_size += len(line)
+
+    # ---- 读取 ----
+
+    def index(self) -> Dict[str, Tuple[str, int]]:
+        """
+        会话 ID -> (段文件名, 偏移)。结果被缓存，调用方不应修改返回的 dict
+        """
+        with self._index_lock:
+            try:
+                stat = os.stat(self.index_path)
+            except FileNotFoundError:
+                self._index_entries, self._index_state, self._index_offset = {}, None, 0
+                return self._index_entries
+            state = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            if state == self._index_state:
+                return self._index_entries
+            if self._index_state is None or stat.st_ino != self._index_state[0] or stat.st_size < self._index_offset:
+                # 索引被压缩替换：重新读取
+                entries, self._index_offset = {}, 0
+            else:
+                entries = dict(self._index_entries)
+            with open(self.index_path, "rb") as f:
+                f.seek(self._index_offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # 正在写入的最后一行，下次再读
+                        break
+                    self._index_offset += len(line)
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 崩溃时写了一半的行
+                        continue
+                    entries[entry["s"]] = (entry["seg"], entry["off"])
+            self._index_entries, self._index_state = entries, state
+            return entries
+
+    def _open_for_read(self, segment: str) -> Optional[IO[bytes]]:
+        path = self.directory / f"{segment}.jsonl"
+        if path.exists():
+            return open(path, "rb")
+        if path.with_suffix(".jsonl.gz").exists():
+            return gzip.open(path.with_suffix(".jsonl.gz"), "rb")
+        return None
+
+    def _iter_from(self, segment: str, offset: int) -> Iterator[dict]:
+        """
+        从指定位置开始按顺序读取该写入者的后续记录（会话可能跨越轮转的段文件）
+        """
+        writer_id, seq = segment.rsplit("-", 1)
+        seq = int(seq)
+        while True:
+            f = self._open_for_read(f"{writer_id}-{seq:06d}")
+            if f is None:
+                return
+            with f:
+                f.seek(offset)
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        return
+            seq += 1
+            offset = 0
+
+    def _expand(self, record: dict) -> dict:
+        """
+        start 记录中的 history 引用还原为完整的 messages
+        """
+        if record.get("k") == "start" and "history" in record["d"]:
+            data = {key: value for key, value in record["d"].items() if key != "history"}
+            data["messages"] = self.resolve_history(record["d"]["history"])
+            record = {**record, "d": data}
+        return record
+
+    def read_session(self, session_id: str) -> List[dict]:
+        """
+        返回会话的全部记录（按写入顺序）；会话未结束（如进程崩溃）时返回已写出的部分
+        """
+        location = self.index().get(session_id)
+        if location is None:
+            return []
+        records = []
+        for record in self._iter_from(*location):
+            if record.get("s") != session_id:
+                continue
+            records.append(self._expand(record))
+            if record.get("k") == "end":
+                break
+        return records
+
+    def _history_heads(self) -> Iterator[str]:
+        """
+        所有仍存在的会话的 history 引用（每个会话只读取索引指向的 start 记录）
+        """
+        for session_id, location in self.index().items():
+            for record in self._iter_from(*location):
+                if record.get("s") == session_id and record.get("k") == "start":
+                    head = record["d"].get("history")
+                    if head is not None:
+                        yield head
+                    break
+
+    def _segments(self) -> Dict[str, List[Path]]:
+        """
+        段文件名 -> 路径（压缩过程中 .jsonl 和 .jsonl.gz 可能同时存在）
+        """
+        segments: Dict[str, List[Path]] = {}
+        for path in self.directory.glob("*.jsonl*"):
+            name, _, suffix = path.name.partition(".")
+            if suffix in ("jsonl", "jsonl.gz") and _SEGMENT_NAME.match(name):
+                segments.setdefault(name, []).append(path)
+        return segments
+
+    def _segment_in_use(self, name: str, newest: Dict[str, int]) -> bool:
+        """
+        本写入者的当前段，或其他仍在运行的进程的最新段（可能还在写入）
+        """
+        writer_id, seq = name.rsplit("-", 1)
+        if writer_id == self._writer_id:
+            return name == self._current_segment
+        pid = int(writer_id.rsplit("-", 1)[1])
+        if int(seq) != newest[writer_id] or pid == os.getpid():
+            return False
+        if os.name == "nt":
+            # Windows 上 os.kill 会结束进程，无法探测，保守地视为仍在写入
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _expire_segments(self, retention: float) -> int:
+        """
+        删除最后写入时间超过保留期的段文件，并压缩索引（持有排他锁时调用）
+        """
+        segments = self._segments()
+        removed = 0
+        if retention > 0:
+            newest: Dict[str, int] = {}
+            for name in segments:
+                writer_id, seq = name.rsplit("-", 1)
+                newest[writer_id] = max(newest.get(writer_id, -1), int(seq))
+            deadline = time.time() - retention
+            for name, paths in list(segments.items()):
+                mtimes = []
+                for path in paths:
+                    try:
+                        mtimes.append(path.stat().st_mtime)
+                    except FileNotFoundError:
+                        pass
+                if max(mtimes, default=0) < deadline and not self._segment_in_use(name, newest):
+                    for path in paths:
+                        path.unlink(missing_ok=True)
+                    del segments[name]
+                    removed += 1
+        # 去掉指向已删除（包括手动清理的）段的条目，索引不随历史无限增长
+        index = self.index()
+        kept = {session_id: location for session_id, location in index.items() if location[0] in segments}
+        if len(kept) != len(index):
+            tmp = self.index_path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp, "wb") as f:
+                for session_id, (segment, offset) in kept.items():
+                    f.write(json.dumps({"s": session_id, "seg": segment, "off": offset}).encode() + b"\n")
+            os.replace(tmp, self.index_path)
+        return removed
+
+    def collect_garbage(self, grace: Optional[float] = None, retention: Optional[float] = None) -> Dict[str, int]:
+        """
+        先按保留期删除过期的段文件，再删除不再被任何会话引用的 blob（例如其段文件已被清理）。
+        宽限期内新写入或刚被复用的 blob 也视为存活，避免与写线程竞争。
+        """
+        grace = grace if grace is not None else float(os.getenv("RDIFY_CONVERSATION_BLOB_GRACE", "3600"))
+        retention = retention if retention is not None else self.retention
+        with self._store_lock(exclusive=True):
+            segments_removed = self._expire_segments(retention)
+        roots = list(self._history_heads())
+        # 扫描段文件之后写入的会话引用的 blob 由宽限期保护；
+        # 标记与删除期间持有排他锁，写线程不会同时复用即将被删除的前缀
+        with self._store_lock(exclusive=True):
+            blobs = {path.stem: path for path in self.blob_dir.glob("*/*.json")}
+            now = time.time()
+            for digest, path in blobs.items():
+                try:
+                    if now - path.stat().st_mtime < grace:
+                        roots.append(digest)
+                except FileNotFoundError:
+                    pass
+            live = set()
+            for head in roots:
+                while head is not None and head not in live:
+                    live.add(head)
+                    blob = self._read_blob(head)
+                    head = blob["p"] if blob is not None else None
+            removed = 0
+            for digest, path in blobs.items():
+                if digest not in live:
+                    path.unlink(missing_ok=True)
+                    removed += 1
+        logger.info(
+            "Conversation store GC: %s segments expired, %s blobs, %s live, %s removed",
+            segments_removed, len(blobs), len(live & blobs.keys()), removed,
+        )
+        return {"segments": segments_removed, "blobs": len(blobs), "live": len(live & blobs.keys()), "removed": removed}
+
+
+class SessionRecorder:
+    """
+    单个会话的写入端：内容增量先在内存中合并，攒够 flush_bytes 再写一条 delta 记录，
+    内存占用与缓冲区大小相关，与会话长度无关。
+    """
+
+    def __init__(self, store: ConversationStore, session_id: str, request: dict, flush_bytes: Optional[int] = None):
+        self.store = store
+        self.session_id = session_id
+        self.flush_bytes = flush_bytes or int(os.getenv("RDIFY_CONVERSATION_FLUSH_BYTES", "4096"))
+        self._role: Optional[str] = None
+        self._parts: List[str] = []
+        self._size = 0
+        self.finish_reason: Optional[str] = None
+        store.append(session_id, "start", request)
+
+    def add(self, content: Optional[str], role: Optional[str] = None, finish_reason: Optional[str] = None):
+        if role is not None and role != self._role:
+            self.flush()
+            self._role = role
+        if content:
+            self._parts.append(content)
+            self._size += len(content)
+            if self._size >= self.flush_bytes:
+                self.flush()
+        if finish_reason is not None:
+            self.finish_reason = finish_reason
+
+    def flush(self):
+        if not self._parts:
+            return
+        self.store.append(self.session_id, "delta", {"role": self._role, "content": "".join(self._parts)})
+        self._parts = []
+        self._size = 0
+
+    def end(self, status: str):
+        self.flush()
+        self.store.append(self.session_id, "end", {"status": status, "finish_reason": self.finish_reason})
+
+
+def conversation_store_enabled() -> bool:
+    return os.getenv("RDIFY_CONVERSATION_STORE", "1") != "0"
+
+
+CONVERSATION_STORE = ConversationStore()
+
+
+if __name__ == "__main__":
+    import sys
+
+    if sys.argv[1:] == ["gc"]:
+        logging.basicConfig(level=logging.INFO)
+        print(CONVERSATION_STORE.collect_garbage())
+    else:
+        print("usage: python -m rdify.conversation_store gc")
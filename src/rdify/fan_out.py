@@ -0,0 +1,115 @@
+import os
+import asyncio
+import logging
+from typing import AsyncIterator, Callable, List, Optional, Tuple, Union
+
+from .openai_schemas import ChatCompletionRequest, CompletionRequest
+from .sse import StreamDelta, chunk_finish_reason
+from .metrics import REGISTRY
+
+logger = logging.getLogger("rdify.fan_out")
+
+FAN_OUT_CALLS = REGISTRY.counter(
+    "rdify_fan_out_upstream_calls_total", "Upstream calls issued by fan-out for n>1 / list prompts", ("model", "kind"),
+)
+
+
+def fan_out_concurrency() -> int:
+    return int(os.getenv("RDIFY_FAN_OUT_CONCURRENCY", "8"))
+
+
+def split_request(req: Union[ChatCompletionRequest, CompletionRequest], kind: str) -> Optional[List[Tuple[int, object]]]:
+    """
+    把 n>1 或 prompt 列表拆成单 choice 子请求，返回 [(choice index, 子请求)]；不需要拆分时返回 None。
+    与 OpenAI 一致，第 i 个 prompt 的第 j 个候选 index 为 i * n + j。
+    """
+    n = req.n or 1
+    prompts = req.prompt if kind == "completion" and isinstance(req.prompt, list) else None
+    if n <= 1 and prompts is None:
+        return None
+    if prompts is None:
+        return [(j, req.model_copy(update={"n": None})) for j in range(n)]
+    return [
+        (i * n + j, req.model_copy(update={"prompt": prompt, "n": None}))
+        for i, prompt in enumerate(prompts)
+        for j in range(n)
+    ]
+
+
+def with_index(chunk, index: int):
+    """
+    返回改写了 choice index 的 chunk 副本（chunk 可能来自缓存或 single-flight，不能原地修改）
+    """
+    if isinstance(chunk, StreamDelta):
+        return StreamDelta(chunk.content, index, chunk.role, chunk.finish_reason)
+    if hasattr(chunk, "choices"):
+        return chunk.model_copy(update={"choices": [choice.model_copy(update={"index": index}) for choice in chunk.choices]})
+    return chunk.model_copy(update={"index": index})
+
+
+# 每个分支在合并队列中最多缓冲的 chunk 数
+_QUEUE_SLOTS_PER_BRANCH = 4
+# 分支正常结束的标记
+_BRANCH_DONE = object()
+
+
+async def merge_fan_out(
+    branches: List[Tuple[int, Callable[[], AsyncIterator]]],
+    concurrency: Optional[int] = None,
+) -> AsyncIterator:
+    """
+    并发执行各分支（最多 concurrency 个同时进行），按到达顺序合并输出并改写 index。
+    没有以 finish_reason 结束的分支补一个 stop chunk，保证每个 choice 都有结束标记。
+    任一分支失败时取消其余分支并抛出异常。
+    """
+    semaphore = asyncio.Semaphore(concurrency or fan_out_concurrency())
+    # 有界队列：消费方慢时分支在 put 处等待，内存占用与分支数成正比而不是与输出长度成正比
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(len(branches), 1) * _QUEUE_SLOTS_PER_BRANCH)
+
+    async def _run(index: int, make_gen: Callable[[], AsyncIterator]):
+        try:
+            async with semaphore:
+                chunk_gen = make_gen()
+                finished = False
+                try:
+                    async for chunk in chunk_gen:
+                        finished = finished or chunk_finish_reason(chunk) is not None
+                        await queue.put(with_index(chunk, index))
+                finally:
+                    await chunk_gen.aclose()
+                if not finished:
+                    await queue.put(StreamDelta("", index, finish_reason="stop"))
+        except Exception as e:
+            # 异常交给消费方抛出；被取消时消费方已退出，不再投递
+            await queue.put(e)
+            return
+        await queue.put(_BRANCH_DONE)
+
+    tasks = [asyncio.create_task(_run(index, make_gen)) for index, make_gen in branches]
+    pending = len(tasks)
+    try:
+        while pending:
+            item = await queue.get()
+            if item is _BRANCH_DONE:
+                pending -= 1
+                continue
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def fan_out(kind: str, req, invoke: Callable[..., AsyncIterator], **kwargs) -> AsyncIterator:
+    """
+    需要拆分时为每个子请求调用一次适配器并合并输出，否则直接调用适配器
+    """
+    parts = split_request(req, kind)
+    if parts is None:
+        return invoke(req, **kwargs)
+    FAN_OUT_CALLS.labels(req.model, kind).inc(len(parts))
+    logger.debug("Fan-out %s %s into %s upstream calls", kind, req.model, len(parts))
+    branches = [(index, lambda sub_req=sub_req: invoke(sub_req, **kwargs)) for index, sub_req in parts]
+    return merge_fan_out(branches)
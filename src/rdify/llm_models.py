@@ -1,13 +1,18 @@
 from typing import AsyncIterator
 import logging
-import anyio
 
 from .openai_schemas import *
 from .models import ModelRegistry, ModelInterface
 from .utils.cancel_scope import CancelScope
+from .aggregator import ChatAggregator, CompletionAggregator
+from .sse import StreamDelta, ChatSSEEncoder, CompletionSSEEncoder, DONE_FRAME, chunk_finish_reason
+from .metrics import StreamRecorder
+from .chat_log import chat_log_sampled, log_response
+from .response_cache import RESPONSE_CACHE, replay
+from .single_flight import SINGLE_FLIGHT
+from .fan_out import fan_out
 
 logger = logging.getLogger("rdify.llm_models")
-output_logger = logging.getLogger("rdify.chat")
 
 MODEL_REGISTRY = ModelRegistry()
 
@@ -32,75 +37,227 @@ def register_model(model_id: str, model_info: ModelInterface):
     MODEL_REGISTRY.register_model(model_id, model_info)
 
 
+def _invoke(kind: str, req, invoke, **kwargs):
+    """
+    在适配器调用外依次套上 fan-out（n>1 / prompt 列表）、响应缓存和 single-flight：
+    context 中带有缓存命中数据时重放缓存；带有缓存键时录制上游输出；
+    开启 single-flight 时相同请求共享同一个上游生成（录制也只发生一次）。
+    """
+    context = kwargs.get("context") or {}
+    cached = context.get("cached")
+    if cached is not None:
+        return replay(cached)
+
+    def chunk_gen_factory(**overrides):
+        chunk_gen = fan_out(kind, req, invoke, **{**kwargs, **overrides})
+        cache_key = context.get("cache_key")
+        if cache_key is not None:
+            return RESPONSE_CACHE.record(cache_key, kind, chunk_gen)
+        return chunk_gen
+
+    flight_key = SINGLE_FLIGHT.key_for(req, kind)
+    if flight_key is not None:
+        return SINGLE_FLIGHT.subscribe(flight_key, req.model, chunk_gen_factory)
+    return chunk_gen_factory()
+
+
+def resolve_model(model_id: str, **kwargs) -> ModelInterface:
+    """
+    优先使用请求开始时固定下来的 ModelInterface（context["model"]），
+    请求处理期间重载注册表不影响正在进行的请求
+    """
+    context = kwargs.get("context") or {}
+    return context.get("model") or MODEL_REGISTRY.get_model(model_id)
+
+
 async def invoke_chat(req: ChatCompletionRequest, **kwargs) -> AsyncIterator[ChatCompletionChoice]:
-    return MODEL_REGISTRY.get_model_invoke_chat(req.model)(req, **kwargs)
+    return _invoke("chat", req, resolve_model(req.model, **kwargs).invoke_chat, **kwargs)
 
 async def invoke_completion(req: CompletionRequest, **kwargs) -> AsyncIterator[CompletionChoice]:
-    return MODEL_REGISTRY.get_model_invoke_completion(req.model)(req, **kwargs)
+    return _invoke("completion", req, resolve_model(req.model, **kwargs).invoke_completion, **kwargs)
+
+
+def new_recorder(model_id: str, **kwargs) -> StreamRecorder:
+    model = resolve_model(model_id, **kwargs)
+    return StreamRecorder(model_id, model.adapter if model is not None else "unknown")
+
+
+async def chat_aggregate(req: ChatCompletionRequest, resp: ChatCompletionResponse, **kwargs) -> ChatCompletionResponse:
+    """
+    非 stream 模式：边消费边合并 chunk，内存只与输出长度相关
+    """
+    aggregator = ChatAggregator()
+    recorder = new_recorder(req.model, **kwargs)
+    status = "error"
+    try:
+        async with CancelScope(**kwargs) as cancel_scope:
+            chunk_gen = await invoke_chat(req, cancel_scope=cancel_scope, **kwargs)
+            try:
+                async for chunk in chunk_gen:
+                    if cancel_scope.cancelled:
+                        break
+                    recorder.chunk()
+                    aggregator.add(chunk)
+            finally:
+                await chunk_gen.aclose()
+        status = "cancelled" if cancel_scope.cancelled else "ok"
+        resp.choices = aggregator.result()
+        resp.usage = Usage()
+        # 非 stream 响应没有逐 chunk 的字节数，记录序列化后的响应体大小
+        recorder.bytes += len(resp.model_dump_json().encode())
+    finally:
+        recorder.finish(status)
+        if chat_log_sampled():
+            log_response("chat", resp.id, recorder, status, aggregator)
+    return resp
+
+
+async def completion_aggregate(req: CompletionRequest, resp: CompletionResponse, **kwargs) -> CompletionResponse:
+    aggregator = CompletionAggregator()
+    recorder = new_recorder(req.model, **kwargs)
+    status = "error"
+    try:
+        async with CancelScope(**kwargs) as cancel_scope:
+            completion_gen = await invoke_completion(req, cancel_scope=cancel_scope, **kwargs)
+            try:
+                async for chunk in completion_gen:
+                    if cancel_scope.cancelled:
+                        break
+                    recorder.chunk()
+                    aggregator.add(chunk)
+            finally:
+                await completion_gen.aclose()
+        status = "cancelled" if cancel_scope.cancelled else "ok"
+        resp.choices = aggregator.result()
+        resp.usage = Usage()
+        recorder.bytes += len(resp.model_dump_json().encode())
+    finally:
+        recorder.finish(status)
+        if chat_log_sampled():
+            log_response("completion", resp.id, recorder, status, aggregator)
+    return resp
 
 
 def chat_event(req: ChatCompletionRequest, resp: ChatCompletionResponse, **kwargs):
     async def event_generator():
-        # 你可以考虑先 yield 一个 “开头” 的 JSON（比如 id/model 信息），再逐 chunk 内容
-        # 为简单起见，这里每个 chunk 直接 yield 一个 JSON 行
-        scope_id = generate_id()
-        is_finished = [False]
-        with CancelScope(**kwargs) as cancel_scope:
-            logger.debug(f"Chat event scope_id: {scope_id}")
-            chunk_gen = await invoke_chat(req, cancel_scope=cancel_scope, **kwargs)
-            async for chunk in chunk_gen:
-                # chunk 是 ChatCompletionChoice 类型，其中 delta 不为 None
-                logger.debug(f"Chunk: {chunk}")
-                if hasattr(chunk, "choices"):
-                    choices = chunk.choices
-                else:
-                    choices = [chunk]
-                if hasattr(chunk, "finish_reason") and chunk.finish_reason is not None:
-                    is_finished[0] = True
-                resp.choices = choices
-                content = resp.model_dump_json()
-                await cancel_scope.wait()
-                yield "data: " + content + "\n\n"
-        # 最后一个终止 chunk 可以带 finish_reason
-        if not is_finished[0]:
-            msg = ChatCompletionChoice(
-                index=0,
-                message=ChatMessage(role="assistant", content=""),
-                finish_reason="stop",
-                delta=ChoiceDeltaContent(content="", role="assistant")
-            )
-            resp.choices = [msg]
-            content = resp.model_dump_json()
-            yield "data: " + content + "\n\n"
-            logger.debug(f"Finish chunk: {content}")
-            yield "data: [DONE]\n\n"
-        else:
-            yield "data: [DONE]\n\n"
-    
-    async def output_generator():
-        async for data in event_generator():
-            output_logger.info(data.strip())
-            yield data
-    return output_generator
+        # 信封（id/model/created）只序列化一次，每个 chunk 只渲染 choices 部分
+        encoder = ChatSSEEncoder(resp)
+        recorder = new_recorder(req.model, **kwargs)
+        # 只有被采样的响应才累积内容，用于结束时的汇总日志
+        aggregator = ChatAggregator() if chat_log_sampled() else None
+        # 生成器被提前关闭（客户端断开且未经 CancelScope 检测到）时保持 aborted
+        status = "aborted"
+        is_finished = False
+        try:
+            async with CancelScope(**kwargs) as cancel_scope:
+                logger.debug("Chat event scope_id: %s", cancel_scope.id)
+                chunk_gen = await invoke_chat(req, cancel_scope=cancel_scope, **kwargs)
+                try:
+                    async for chunk in chunk_gen:
+                        # 客户端已断开：停止迭代，finally 中关闭适配器生成器及上游连接
+                        if cancel_scope.cancelled:
+                            break
+                        logger.debug("Chunk: %s", chunk)
+                        if chunk_finish_reason(chunk) is not None:
+                            is_finished = True
+                        if aggregator is not None:
+                            aggregator.add(chunk)
+                        data = encoder.encode(chunk)
+                        recorder.chunk(len(data))
+                        yield data
+                finally:
+                    await chunk_gen.aclose()
+            if cancel_scope.cancelled:
+                status = "cancelled"
+                return
+            # 最后一个终止 chunk 可以带 finish_reason
+            if not is_finished:
+                content = encoder.encode(StreamDelta("", role="assistant", finish_reason="stop"))
+                yield content
+                logger.debug("Finish chunk: %s", content)
+            yield DONE_FRAME
+            status = "ok"
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            recorder.finish(status)
+            if aggregator is not None:
+                log_response("chat", resp.id, recorder, status, aggregator)
+    return event_generator
 
 
-def completion_event(req: CompletionRequest, resp: CompletionResponse, **kwargs):
+def chat_passthrough_event(req: ChatCompletionRequest, **kwargs):
+    """
+    透传模式：上游已经是 OpenAI 兼容的 SSE，直接输出字节帧
+    """
     async def event_generator():
-        completion_gen = await invoke_completion(req, **kwargs)
-        async for chunk in completion_gen:
-            resp.choices = [chunk]
-            content = resp.model_dump_json()
-            yield "data: " + content + "\n\n"
-            logger.debug(f"Chunk: {content}")
-        msg = CompletionChoice(
-            index=0,
-            text="",
-            finish_reason="stop"
-        )
-        resp.choices = [msg]
-        content = resp.model_dump_json()
-        yield "data: " + content + "\n\n"
-        logger.debug(f"Finish chunk: {content}")
-        yield "data: [DONE]\n\n"
+        recorder = new_recorder(req.model, **kwargs)
+        frames_log = [] if chat_log_sampled() else None
+        status = "aborted"
+        try:
+            async with CancelScope(**kwargs) as cancel_scope:
+                invoke_chat_raw = resolve_model(req.model, **kwargs).invoke_chat_raw
+                frames_gen = invoke_chat_raw(req, cancel_scope=cancel_scope, **kwargs)
+                try:
+                    async for frames in frames_gen:
+                        if cancel_scope.cancelled:
+                            break
+                        recorder.chunk(len(frames), frames.count(b"\n\n"))
+                        if frames_log is not None:
+                            frames_log.append(frames)
+                        yield frames
+                finally:
+                    await frames_gen.aclose()
+            status = "cancelled" if cancel_scope.cancelled else "ok"
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            recorder.finish(status)
+            if frames_log is not None:
+                log_response("chat", None, recorder, status, frames_log)
     return event_generator
 
+
+def completion_event(req: CompletionRequest, resp: CompletionResponse, **kwargs):
+    async def event_generator():
+        encoder = CompletionSSEEncoder(resp)
+        recorder = new_recorder(req.model, **kwargs)
+        aggregator = CompletionAggregator() if chat_log_sampled() else None
+        status = "aborted"
+        is_finished = False
+        try:
+            async with CancelScope(**kwargs) as cancel_scope:
+                completion_gen = await invoke_completion(req, cancel_scope=cancel_scope, **kwargs)
+                try:
+                    async for chunk in completion_gen:
+                        if cancel_scope.cancelled:
+                            break
+                        if chunk_finish_reason(chunk) is not None:
+                            is_finished = True
+                        if aggregator is not None:
+                            aggregator.add(chunk)
+                        content = encoder.encode(chunk)
+                        recorder.chunk(len(content))
+                        yield content
+                        logger.debug("Chunk: %s", content)
+                finally:
+                    await completion_gen.aclose()
+            if cancel_scope.cancelled:
+                status = "cancelled"
+                return
+            if not is_finished:
+                content = encoder.encode(StreamDelta("", finish_reason="stop"))
+                yield content
+                logger.debug("Finish chunk: %s", content)
+            yield DONE_FRAME
+            status = "ok"
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            recorder.finish(status)
+            if aggregator is not None:
+                log_response("completion", resp.id, recorder, status, aggregator)
+    return event_generator
@@ -0,0 +1,199 @@
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Gauge:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Histogram:
+    """
+    固定桶直方图。observe 只做一次二分查找和两次加法，不加锁：
+    事件循环单线程调用，线程侧调用依赖 GIL，极少数并发丢计数可以接受。
+    """
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricFamily:
+    def __init__(self, name: str, help: str, kind: str, labelnames: Sequence[str], factory: Callable):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self._factory = factory
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._factory()
+        return child
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            if isinstance(child, Histogram):
+                cumulative = 0
+                for bound, count in zip(child.buckets + (float("inf"),), child.counts):
+                    cumulative += count
+                    le = f'le="{_format_value(bound)}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+                labels = _format_labels(self.labelnames, values)
+                lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+                lines.append(f"{self.name}_count{labels} {child.count}")
+            else:
+                lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.families: Dict[str, MetricFamily] = {}
+        self._collectors: List[Callable[[], None]] = []
+
+    def _register(self, family: MetricFamily) -> MetricFamily:
+        self.families[family.name] = family
+        return family
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> MetricFamily:
+        return self._register(MetricFamily(name, help, "counter", labelnames, Counter))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> MetricFamily:
+        return self._register(MetricFamily(name, help, "gauge", labelnames, Gauge))
+
+    def histogram(self, name: str, help: str, buckets: Tuple[float, ...], labelnames: Sequence[str] = ()) -> MetricFamily:
+        return self._register(MetricFamily(name, help, "histogram", labelnames, lambda: Histogram(buckets)))
+
+    def add_collector(self, collector: Callable[[], None]):
+        """
+        注册在导出前执行的回调，用于把外部状态（如排队深度）同步到 gauge
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for family in self.families.values():
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+_LABELS = ("model", "adapter")
+
+TTFT = REGISTRY.histogram(
+    "rdify_time_to_first_token_seconds", "Time from request start to the first chunk",
+    (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60), _LABELS,
+)
+INTER_CHUNK = REGISTRY.histogram(
+    "rdify_inter_chunk_seconds", "Gap between consecutive chunks of a response",
+    (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10), _LABELS,
+)
+DURATION = REGISTRY.histogram(
+    "rdify_stream_duration_seconds", "Total response duration",
+    (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600), _LABELS,
+)
+CHUNKS = REGISTRY.histogram(
+    "rdify_response_chunks", "Chunks per response",
+    (1, 5, 10, 50, 100, 500, 1000, 5000, 10000), _LABELS,
+)
+BYTES = REGISTRY.histogram(
+    "rdify_response_bytes", "Bytes per response",
+    (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304), _LABELS,
+)
+IN_FLIGHT = REGISTRY.gauge("rdify_in_flight_responses", "Responses currently being generated", _LABELS)
+RESPONSES = REGISTRY.counter("rdify_responses_total", "Completed responses by status", _LABELS + ("status",))
+
+
+class StreamRecorder:
+    """
+    单个响应的指标记录。chunk() 位于每个 chunk 的热路径上，只做计时和累加。
+    """
+    __slots__ = ("labels", "start", "last", "chunks", "bytes", "_ttft", "_gap", "_finished")
+
+    def __init__(self, model: str, adapter: str):
+        self.labels = (model, adapter)
+        self.start = time.perf_counter()
+        self.last: Optional[float] = None
+        self.chunks = 0
+        self.bytes = 0
+        self._ttft = TTFT.labels(*self.labels)
+        self._gap = INTER_CHUNK.labels(*self.labels)
+        self._finished = False
+        IN_FLIGHT.labels(*self.labels).inc()
+
+    def chunk(self, nbytes: int = 0, count: int = 1):
+        now = time.perf_counter()
+        if self.last is None:
+            self._ttft.observe(now - self.start)
+        else:
+            self._gap.observe(now - self.last)
+        self.last = now
+        self.chunks += count
+        self.bytes += nbytes
+
+    def finish(self, status: str = "ok"):
+        if self._finished:
+            return
+        self._finished = True
+        labels = self.labels
+        DURATION.labels(*labels).observe(time.perf_counter() - self.start)
+        CHUNKS.labels(*labels).observe(self.chunks)
+        BYTES.labels(*labels).observe(self.bytes)
+        IN_FLIGHT.labels(*labels).dec()
+        RESPONSES.labels(*labels, status).inc()
@@ -0,0 +1,53 @@
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field, asdict
+from typing import Awaitable, Callable, Dict, List, Optional
+from uuid import uuid4
+
+logger = logging.getLogger("rdify.model_reload")
+
+
+@dataclass
+class ReloadJob:
+    id: str = field(default_factory=lambda: str(uuid4()))
+    state: str = "running"  # running / succeeded / failed
+    started: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+    version: Optional[int] = None
+    diff: Dict[str, List[str]] = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+class ModelReloader:
+    """
+    在后台任务中执行模型重载，同一时间最多一个任务；
+    重复触发时返回正在运行的任务。run 返回 (快照版本, diff)。
+    """
+
+    def __init__(self, run: Callable[[], Awaitable[tuple]]):
+        self._run = run
+        self.job: Optional[ReloadJob] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> ReloadJob:
+        if self.job is not None and self.job.state == "running":
+            return self.job
+        job = self.job = ReloadJob()
+        self._task = asyncio.create_task(self._execute(job))
+        return job
+
+    async def _execute(self, job: ReloadJob):
+        try:
+            job.version, job.diff = await self._run()
+            job.state = "succeeded"
+            logger.info("Reload %s succeeded: version=%s diff=%s", job.id, job.version, job.diff)
+        except Exception as e:
+            job.state = "failed"
+            job.error = str(e)
+            logger.error("Reload %s failed: %s", job.id, e)
+        finally:
+            job.finished = time.time()
+
+    def status(self) -> Optional[dict]:
+        return asdict(self.job) if self.job is not None else None
@@ -1,5 +1,5 @@
 from .openai_schemas import *
-from typing import AsyncIterator, Callable, Dict
+from typing import AsyncIterator, Callable, Dict, Optional, Union
 from dataclasses import dataclass
 
 
@@ -8,6 +8,12 @@ class ModelInterface:
     info: ModelInfo
     invoke_chat: Callable[[ChatCompletionRequest], AsyncIterator[ChatCompletionChoice]]
     invoke_completion: Callable[[CompletionRequest], AsyncIterator[CompletionChoice]]
+    # 可选：直接转发上游 SSE 字节帧（不做解析/重新序列化），仅用于 stream 模式
+    invoke_chat_raw: Optional[Callable[[ChatCompletionRequest], AsyncIterator[bytes]]] = None
+    # 适配器类型（fake / dify / redirect / run-task），用作指标标签
+    adapter: str = "unknown"
+    # 可选：在响应开始前校验请求参数，抛出 ValueError 时返回 400
+    validate_request: Optional[Callable[[Union[ChatCompletionRequest, CompletionRequest]], None]] = None
 
 
 @dataclass
@@ -18,7 +24,14 @@ class ModelRegistry:
         self.models = {}
 
     def register_model(self, model_id: str, model_info: ModelInterface):
-        self.models[model_id] = model_info
+        # 写时复制：已经持有旧 dict 的请求不受影响
+        self.replace_models({**self.models, model_id: model_info})
+
+    def replace_models(self, models: Dict[str, ModelInterface]):
+        """
+        整体替换模型表。调用方构建新的 dict 后一次性替换引用，不在原 dict 上修改
+        """
+        self.models = models
 
     def get_model(self, model_id: str) -> ModelInterface:
         return self.models.get(model_id, None)
@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import contextlib
+from pathlib import Path
+from typing import Callable, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows 下没有 flock，退化为各进程独立发现
+    fcntl = None
+
+logger = logging.getLogger("rdify.registry_snapshot")
+
+
+class RegistrySnapshot:
+    """
+    多 worker 共享的模型注册表快照（JSON 文件，原子替换写入）。
+
+    文件内容：{"version": int, "created": float, "payload": {...}}，
+    payload 只包含可序列化的发现结果（如 Dify 应用列表），各 worker 据此在本进程内构建 ModelInterface。
+
+    - load_or_discover：持有文件锁的 worker 负责发现并写入快照，
+      其余 worker 拿到锁时发现快照已足够新，直接使用，N 个 worker 启动只发现一次；
+    - watch：后台轮询文件 mtime，版本变化时回调 apply 热切换。
+    """
+
+    def __init__(self, path: Optional[Path] = None, max_age: Optional[float] = None):
+        self.path = Path(path or os.getenv("RDIFY_REGISTRY_SNAPSHOT", "logs/registry/snapshot.json"))
+        self.lock_path = self.path.with_suffix(".lock")
+        self.max_age = max_age if max_age is not None else float(os.getenv("RDIFY_REGISTRY_SNAPSHOT_MAX_AGE", "300"))
+        # 本进程当前使用的版本与对应文件 mtime
+        self.version = 0
+        self._mtime_ns: Optional[int] = None
+
+    @contextlib.contextmanager
+    def _locked(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _stat_mtime(self) -> Optional[int]:
+        try:
+            return self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def read(self) -> Optional[dict]:
+        mtime_ns = self._stat_mtime()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Broken registry snapshot %s: %s", self.path, e)
+            return None
+        snapshot["_mtime_ns"] = mtime_ns
+        return snapshot
+
+    def _write(self, payload: dict, previous: Optional[dict]) -> dict:
+        snapshot = {
+            "version": (previous or {}).get("version", 0) + 1,
+            "created": time.time(),
+            "payload": payload,
+        }
+        tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+        snapshot["_mtime_ns"] = self._stat_mtime()
+        return snapshot
+
+    def load_or_discover(self, discover: Callable[[], Optional[dict]], force: bool = False) -> Optional[dict]:
+        """
+        阻塞调用（应在线程中执行）。快照足够新且未强制刷新时直接返回，
+        否则在文件锁内再检查一次，仍需要时执行 discover() 并写入新版本。
+        discover 返回 None 表示发现失败，此时沿用已有快照。
+        """
+        started = time.time()
+        snapshot = self.read()
+        if not force and self._fresh(snapshot, started):
+            return snapshot
+        with self._locked():
+            latest = self.read()
+            # 等锁期间其他 worker 已写入新版本
+            if latest is not None and (latest["created"] >= started or (not force and self._fresh(latest, started))):
+                return latest
+            logger.info("Discovering models for registry snapshot (pid %s)", os.getpid())
+            payload = discover()
+            if payload is None:
+                return latest
+            snapshot = self._write(payload, latest)
+            logger.info("Registry snapshot version %s written", snapshot["version"])
+            return snapshot
+
+    def _fresh(self, snapshot: Optional[dict], now: float) -> bool:
+        return snapshot is not None and now - snapshot["created"] < self.max_age
+
+    def mark_applied(self, snapshot: dict):
+        self.version = snapshot["version"]
+        self._mtime_ns = snapshot.get("_mtime_ns")
+
+    async def watch(self, apply: Callable[[dict], None], interval: Optional[float] = None):
+        """
+        轮询快照文件，其他 worker 写入新版本后在本进程应用
+        """
+        interval = interval or float(os.getenv("RDIFY_REGISTRY_POLL_INTERVAL", "2"))
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if self._stat_mtime() == self._mtime_ns:
+                    continue
+                snapshot = await asyncio.to_thread(self.read)
+                if snapshot is None or snapshot["version"] == self.version:
+                    self._mtime_ns = snapshot and snapshot["_mtime_ns"]
+                    continue
+                logger.info("Registry snapshot changed: %s -> %s", self.version, snapshot["version"])
+                apply(snapshot)
+                self.mark_applied(snapshot)
+            except Exception as e:
+                logger.warning("Failed to apply registry snapshot: %s", e)
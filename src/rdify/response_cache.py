@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import AsyncIterator, Optional, Tuple, Union
+
+from .openai_schemas import ChatCompletionRequest, CompletionRequest
+from .aggregator import ChatAggregator, CompletionAggregator
+from .sse import StreamDelta
+from .metrics import REGISTRY
+
+logger = logging.getLogger("rdify.response_cache")
+
+CACHE_REQUESTS = REGISTRY.counter(
+    "rdify_cache_requests_total", "Response cache lookups by result", ("model", "kind", "result"),
+)
+CACHE_ENTRIES = REGISTRY.gauge("rdify_cache_memory_entries", "Entries in the in-memory response cache")
+CACHE_DISK_BYTES = REGISTRY.gauge("rdify_cache_disk_bytes", "Bytes used by the on-disk response cache")
+
+# 不影响生成结果的字段不参与缓存键
+_KEY_EXCLUDE = {"stream", "user"}
+
+
+def cache_key(req: Union[ChatCompletionRequest, CompletionRequest], kind: str) -> str:
+    """
+    请求的规范化哈希：字段按名称排序，忽略 None 和 stream/user
+    """
+    payload = req.model_dump(mode="json", exclude=_KEY_EXCLUDE, exclude_none=True)
+    canonical = json.dumps([kind, payload], sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    两级响应缓存：内存 LRU + 磁盘（TTL + 总大小淘汰）。
+
+    只缓存确定性请求（temperature == 0），需要通过 RDIFY_RESPONSE_CACHE=1 开启。
+    缓存内容是合并后的 choices，命中时按普通 chunk 重放，stream 与非 stream 共用。
+    磁盘读写都在线程中执行，不阻塞事件循环。
+    """
+
+    def __init__(self, enabled: Optional[bool] = None, directory: Optional[Path] = None,
+                 memory_entries: Optional[int] = None, ttl: Optional[float] = None,
+                 disk_max_bytes: Optional[int] = None):
+        self.enabled = os.getenv("RDIFY_RESPONSE_CACHE", "0") == "1" if enabled is None else enabled
+        self.directory = Path(directory or os.getenv("RDIFY_CACHE_DIR", "logs/cache"))
+        self.memory_entries = memory_entries if memory_entries is not None else int(os.getenv("RDIFY_CACHE_MEMORY_ENTRIES", "1024"))
+        self.ttl = ttl if ttl is not None else float(os.getenv("RDIFY_CACHE_TTL", "86400"))
+        self.disk_max_bytes = disk_max_bytes if disk_max_bytes is not None else int(os.getenv("RDIFY_CACHE_DISK_MAX_BYTES", str(512 * 1024 * 1024)))
+        self._memory: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self._disk_lock = threading.Lock()
+        self._disk_bytes: Optional[int] = None
+
+    def key_for(self, req: Union[ChatCompletionRequest, CompletionRequest], kind: str) -> Optional[str]:
+        """
+        可缓存时返回缓存键，否则返回 None
+        """
+        if not self.enabled or req.temperature != 0:
+            return None
+        return cache_key(req, kind)
+
+    # ---- 内存层 ----
+
+    def _memory_get(self, key: str) -> Optional[dict]:
+        item = self._memory.get(key)
+        if item is None:
+            return None
+        expires, data = item
+        if expires < time.time():
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return data
+
+    def _memory_put(self, key: str, data: dict, expires: float):
+        self._memory[key] = (expires, data)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    # ---- 磁盘层（在线程中执行） ----
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def _files(self):
+        return self.directory.glob("*/*.json")
+
+    def _ensure_disk_bytes(self):
+        if self._disk_bytes is None:
+            self._disk_bytes = sum(path.stat().st_size for path in self._files())
+
+    def _disk_get(self, key: str) -> Optional[Tuple[float, dict]]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                item = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Broken cache file %s: %s", path, e)
+            return None
+        if item["expires"] < time.time():
+            self._disk_remove(path)
+            return None
+        # 更新 mtime，淘汰时按最近使用排序
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return item["expires"], item["data"]
+
+    def _disk_remove(self, path: Path):
+        with self._disk_lock:
+            try:
+                size = path.stat().st_size
+                path.unlink()
+            except FileNotFoundError:
+                return
+            if self._disk_bytes is not None:
+                self._disk_bytes -= size
+
+    def _disk_put(self, key: str, data: dict, expires: float):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        body = json.dumps({"expires": expires, "data": data}, ensure_ascii=False).encode("utf-8")
+        tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(body)
+        with self._disk_lock:
+            self._ensure_disk_bytes()
+            try:
+                old_size = path.stat().st_size
+            except FileNotFoundError:
+                old_size = 0
+            os.replace(tmp, path)
+            self._disk_bytes += len(body) - old_size
+            if self._disk_bytes > self.disk_max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """
+        按 mtime（最近使用时间）从旧到新删除，直到总大小降到上限的 90%。
+        过期判断以文件内的 expires 为准，在读取时惰性删除，这里不做检查。
+        """
+        target = self.disk_max_bytes * 0.9
+        entries = []
+        for path in self._files():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        for mtime, size, path in entries:
+            if self._disk_bytes <= target:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            self._disk_bytes -= size
+        logger.info("Response cache evicted, disk bytes: %s", self._disk_bytes)
+
+    # ---- 对外接口 ----
+
+    async def get(self, key: str, model: str, kind: str) -> Optional[dict]:
+        data = self._memory_get(key)
+        if data is not None:
+            CACHE_REQUESTS.labels(model, kind, "memory").inc()
+            return data
+        item = await asyncio.to_thread(self._disk_get, key)
+        if item is not None:
+            expires, data = item
+            self._memory_put(key, data, expires)
+            CACHE_REQUESTS.labels(model, kind, "disk").inc()
+            return data
+        CACHE_REQUESTS.labels(model, kind, "miss").inc()
+        return None
+
+    async def put(self, key: str, data: dict):
+        expires = time.time() + self.ttl
+        self._memory_put(key, data, expires)
+        try:
+            await asyncio.to_thread(self._disk_put, key, data, expires)
+        except OSError as e:
+            logger.warning("Failed to write response cache %s: %s", key, e)
+
+    def collect(self):
+        CACHE_ENTRIES.labels().set(len(self._memory))
+        CACHE_DISK_BYTES.labels().set(self._disk_bytes or 0)
+
+    # ---- chunk 录制与重放 ----
+
+    async def record(self, key: str, kind: str, chunk_gen: AsyncIterator) -> AsyncIterator:
+        """
+        透明转发 chunk，同时合并内容；只有上游正常结束才写入缓存
+        """
+        aggregator = ChatAggregator() if kind == "chat" else CompletionAggregator()
+        try:
+            async for chunk in chunk_gen:
+                aggregator.add(chunk)
+                yield chunk
+        finally:
+            await chunk_gen.aclose()
+        await self.put(key, dump_choices(kind, aggregator))
+
+
+def dump_choices(kind: str, aggregator: Union[ChatAggregator, CompletionAggregator]) -> dict:
+    if kind == "chat":
+        return {"choices": [
+            {"index": choice.index, "role": choice.message.role, "content": choice.message.content,
+             "finish_reason": choice.finish_reason}
+            for choice in aggregator.result()
+        ]}
+    return {"choices": [
+        {"index": choice.index, "text": choice.text, "finish_reason": choice.finish_reason}
+        for choice in aggregator.result()
+    ]}
+
+
+async def replay(data: dict) -> AsyncIterator[StreamDelta]:
+    """
+    把缓存的 choices 重放为 StreamDelta，每个 choice 一个 chunk
+    """
+    for choice in data["choices"]:
+        if "text" in choice:
+            yield StreamDelta(choice["text"], index=choice["index"], finish_reason=choice["finish_reason"])
+        else:
+            yield StreamDelta(choice["content"], index=choice["index"], role=choice["role"],
+                              finish_reason=choice["finish_reason"])
+
+
+RESPONSE_CACHE = ResponseCache()
+REGISTRY.add_collector(RESPONSE_CACHE.collect)
@@ -0,0 +1,127 @@
+import os
+import asyncio
+import logging
+from typing import AsyncIterator, Callable, Dict, List, Optional, Union
+
+from .openai_schemas import ChatCompletionRequest, CompletionRequest
+from .response_cache import cache_key
+from .utils.cancel_scope import CancelScope
+from .metrics import REGISTRY
+
+logger = logging.getLogger("rdify.single_flight")
+
+FLIGHT_SUBSCRIBERS = REGISTRY.counter(
+    "rdify_single_flight_subscribers_total", "Requests served by single-flight, by role", ("model", "role"),
+)
+FLIGHTS_IN_PROGRESS = REGISTRY.gauge("rdify_single_flight_in_progress", "Upstream generations shared by single-flight")
+
+
+class _Flight:
+    """
+    一次共享的上游生成。chunk 全部保留，晚到的订阅者先重放已有部分再跟随实时输出。
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.chunks: List[object] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.scope = CancelScope()
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.get_running_loop().create_future()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.get_running_loop().create_future()
+        changed.set_result(None)
+
+    async def run(self, chunk_gen_factory: Callable[..., AsyncIterator]):
+        # 上游不绑定任何一个客户端的请求和 CancelScope，由 flight 自己的 scope 控制
+        chunk_gen = chunk_gen_factory(cancel_scope=self.scope, context={})
+        try:
+            async for chunk in chunk_gen:
+                self.chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            await self.scope.cancel()
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            try:
+                await chunk_gen.aclose()
+            except Exception as e:
+                logger.warning("Flight %s failed to close upstream: %s", self.key[:8], e)
+            self.done = True
+            self._notify()
+
+    async def wait(self):
+        await self._changed
+
+
+class SingleFlight:
+    """
+    相同的确定性请求（temperature == 0）共享同一个上游生成，
+    需要通过 RDIFY_SINGLE_FLIGHT=1 开启。
+
+    每个订阅者独立迭代（各自的 SSE 信封和断开处理）；
+    所有订阅者都离开后才取消上游。
+    """
+
+    def __init__(self, enabled: Optional[bool] = None):
+        self.enabled = os.getenv("RDIFY_SINGLE_FLIGHT", "0") == "1" if enabled is None else enabled
+        self.flights: Dict[str, _Flight] = {}
+
+    def key_for(self, req: Union[ChatCompletionRequest, CompletionRequest], kind: str) -> Optional[str]:
+        if not self.enabled or req.temperature != 0:
+            return None
+        return cache_key(req, kind)
+
+    def _finished(self, flight: _Flight, task: asyncio.Task):
+        if self.flights.get(flight.key) is flight:
+            del self.flights[flight.key]
+        FLIGHTS_IN_PROGRESS.labels().dec()
+
+    def _start(self, key: str, chunk_gen_factory: Callable[..., AsyncIterator]) -> _Flight:
+        flight = self.flights[key] = _Flight(key)
+        flight.task = asyncio.create_task(flight.run(chunk_gen_factory))
+        flight.task.add_done_callback(lambda task: self._finished(flight, task))
+        FLIGHTS_IN_PROGRESS.labels().inc()
+        return flight
+
+    async def subscribe(self, key: str, model: str, chunk_gen_factory: Callable[..., AsyncIterator]) -> AsyncIterator:
+        """
+        加入正在进行的同键生成，没有则发起一个。chunk_gen_factory(**overrides) 创建上游生成器。
+        """
+        flight = self.flights.get(key)
+        if flight is None or flight.done:
+            flight = self._start(key, chunk_gen_factory)
+            FLIGHT_SUBSCRIBERS.labels(model, "leader").inc()
+        else:
+            FLIGHT_SUBSCRIBERS.labels(model, "follower").inc()
+            logger.debug("Joined flight %s with %s chunks", key[:8], len(flight.chunks))
+        flight.subscribers += 1
+        position = 0
+        try:
+            while True:
+                if position < len(flight.chunks):
+                    chunk = flight.chunks[position]
+                    position += 1
+                    yield chunk
+                elif flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                else:
+                    await flight.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # 最后一个订阅者离开：停止上游，之后的同键请求重新发起
+                logger.debug("Flight %s abandoned, cancelling upstream", key[:8])
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+                flight.task.cancel()
+
+
+SINGLE_FLIGHT = SingleFlight()
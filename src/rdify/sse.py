@@ -0,0 +1,165 @@
+import abc
+import re
+from json.encoder import encode_basestring
+from typing import Optional, Union
+
+from pydantic import BaseModel
+
+from .openai_schemas import ChatCompletionResponse, CompletionResponse
+
+DONE_FRAME = b"data: [DONE]\n\n"
+
+
+class StreamDelta:
+    """
+    适配器内部使用的轻量增量类型，替代每个 token 分配的
+    ChatCompletionChoice + ChatMessage + ChoiceDeltaContent / CompletionChoice。
+    """
+
+    __slots__ = ("content", "index", "role", "finish_reason")
+
+    def __init__(self, content: Optional[str], index: int = 0, role: Optional[str] = None, finish_reason: Optional[str] = None):
+        self.content = content
+        self.index = index
+        self.role = role
+        self.finish_reason = finish_reason
+
+    def __repr__(self):
+        return f"StreamDelta(content={self.content!r}, index={self.index}, role={self.role!r}, finish_reason={self.finish_reason!r})"
+
+
+def _dumps(value: Optional[str]) -> str:
+    # 与 pydantic model_dump_json 一致：不转义非 ASCII 字符
+    return "null" if value is None else encode_basestring(value)
+
+
+def _envelope_prefix(resp: Union[ChatCompletionResponse, CompletionResponse]) -> bytes:
+    """
+    预先序列化 id/object/created/model 等字段，choices 必须是最后一个字段
+    """
+    envelope = resp.model_dump_json(exclude={"choices"})
+    return b"data: " + envelope[:-1].encode() + b',"choices":['
+
+
+_FRAME_SUFFIX = b"]}\n\n"
+
+
+class _SSEEncoder(abc.ABC):
+    def __init__(self, resp: Union[ChatCompletionResponse, CompletionResponse]):
+        self.prefix = _envelope_prefix(resp)
+
+    @abc.abstractmethod
+    def _render_delta(self, delta: StreamDelta) -> str:
+        ...
+
+    def _render_chunk(self, chunk) -> str:
+        if isinstance(chunk, StreamDelta):
+            return self._render_delta(chunk)
+        if hasattr(chunk, "choices"):
+            # 上游 ChatCompletionChunk 等，保留其原始 choice 结构（如 tool_calls）
+            return ",".join(choice.model_dump_json() for choice in chunk.choices)
+        if isinstance(chunk, BaseModel):
+            return chunk.model_dump_json()
+        raise TypeError(f"Unsupported chunk type: {type(chunk)}")
+
+    def encode(self, chunk) -> bytes:
+        """
+        渲染一个完整的 `data: ...\\n\\n` SSE 帧
+        """
+        return self.prefix + self._render_chunk(chunk).encode() + _FRAME_SUFFIX
+
+
+class ChatSSEEncoder(_SSEEncoder):
+    def _render_delta(self, delta: StreamDelta) -> str:
+        role = _dumps(delta.role)
+        content = _dumps(delta.content)
+        # ChatMessage.role 必填：增量未指明角色时 message 中按助手输出，delta 中保持 null
+        message_role = role if delta.role is not None else '"assistant"'
+        return (
+            f'{{"index":{delta.index},"message":{{"role":{message_role},"content":{content},"name":null}},'
+            f'"finish_reason":{_dumps(delta.finish_reason)},"delta":{{"content":{content},"role":{role}}}}}'
+        )
+
+
+class CompletionSSEEncoder(_SSEEncoder):
+    def _render_delta(self, delta: StreamDelta) -> str:
+        return (
+            f'{{"index":{delta.index},"text":{_dumps(delta.content or "")},"logprobs":null,'
+            f'"finish_reason":{_dumps(delta.finish_reason)}}}'
+        )
+
+
+def chunk_finish_reason(chunk) -> Optional[str]:
+    """
+    返回 chunk 中第一个非空的 finish_reason
+    """
+    if hasattr(chunk, "choices"):
+        for choice in chunk.choices:
+            if choice.finish_reason is not None:
+                return choice.finish_reason
+        return None
+    return getattr(chunk, "finish_reason", None)
+
+
+_MODEL_FIELD = re.compile(rb'"model"\s*:\s*"(?:[^"\\]|\\.)*"')
+_FINISH_REASON_FIELD = re.compile(rb'"finish_reason"\s*:\s*"([^"]*)"')
+
+
+class SSEFrameParser:
+    """
+    增量切分上游 SSE 字节流，仅用于观察 [DONE] / finish_reason，
+    并按需改写 model 字段；帧内容不做 JSON 解析。
+    """
+
+    def __init__(self, model: Optional[str] = None):
+        self._buffer = b""
+        self._model_field = b'"model":' + _dumps(model).encode() if model is not None else None
+        self.done = False
+        self.finish_reason: Optional[str] = None
+
+    def feed(self, data: bytes) -> bytes:
+        """
+        输入任意长度的字节，返回其中已完整的帧（可能为空）
+        """
+        buffer = self._buffer + data
+        # 在拼接后的缓冲区上归一化，跨块切开的 \r | \n 也能被识别；
+        # 末尾孤立的 \r 不会落在帧边界之前，会留在缓冲区等待下一块
+        if b"\r" in buffer:
+            buffer = buffer.replace(b"\r\n", b"\n")
+        end = buffer.rfind(b"\n\n")
+        if end < 0:
+            self._buffer = buffer
+            return b""
+        end += 2
+        self._buffer = buffer[end:]
+        return self._process(buffer[:end])
+
+    def flush(self) -> bytes:
+        """
+        上游结束时调用：输出残留内容，若上游未发送 [DONE] 则补上
+        """
+        frames = b""
+        if self._buffer.strip():
+            frames = self._process(self._buffer.rstrip(b"\n") + b"\n\n")
+        self._buffer = b""
+        if not self.done:
+            self.done = True
+            frames += DONE_FRAME
+        return frames
+
+    def _process(self, frames: bytes) -> bytes:
+        if frames.startswith(DONE_FRAME) or b"\n\n" + DONE_FRAME in frames:
+            self.done = True
+        if self.finish_reason is None:
+            match = _FINISH_REASON_FIELD.search(frames)
+            if match:
+                self.finish_reason = match.group(1).decode()
+        if self._model_field is None:
+            return frames
+        return b"\n\n".join(
+            _MODEL_FIELD.sub(self._replace_model, frame, count=1) if frame else frame
+            for frame in frames.split(b"\n\n")
+        )
+
+    def _replace_model(self, match: re.Match) -> bytes:
+        return self._model_field
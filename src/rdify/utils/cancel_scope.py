@@ -1,50 +1,79 @@
-import anyio
+import asyncio
+import inspect
 import logging
+from typing import Callable, List, Optional
 from uuid import uuid4
-from fastapi import Request
+
+logger = logging.getLogger("rdify.cancel_scope")
+
 
 class CancelScope:
+    """
+    请求级取消作用域。
+
+    进入作用域时启动一个后台任务等待客户端断开（只等待一次 http.disconnect，
+    不在每个 chunk 上轮询）。断开后：
+      - cancelled 置为 True，事件生成器在下一个 chunk 前退出并关闭适配器生成器；
+      - 依次执行适配器注册的清理回调（关闭上游 HTTP 流、停止线程桥等）。
+
+    用法：
+        async with CancelScope(**kwargs) as cancel_scope:
+            cancel_scope.add_callback(stream.close)
+            ...
+    """
 
     def __init__(self, **kwargs):
         self.request = kwargs.get("context", {}).get("request")
         self.id = str(uuid4())[:4]
-        self.logger = logging.getLogger(f"rdify.cancel_scope.id_{self.id}")
-        self.cancel_scope = None
-        self._ready = False
-
-    def __enter__(self):
-        self.logger.debug(f"CancelScope __enter__: {self.id}")
-        self.cancel_scope = anyio.CancelScope()
-        self._ready = True
-        if not isinstance(self.cancel_scope, anyio.CancelScope):
-            self.logger.debug(f"CancelScope wait: {self.id} cancel_scope is not a CancelScope")
-            self._ready = False
-        if not hasattr(self.request, "is_disconnected"):
-            self.logger.debug(f"CancelScope wait: {self.id} request is not a Request")
-            self._ready = False
-        if not callable(self.request.is_disconnected):
-            self.logger.debug(f"CancelScope wait: {self.id} request.is_disconnected is not callable")
-            self._ready = False
+        # 共享同一个 logger，按请求创建 logger 会使 logging 的 logger 表无限增长
+        self.logger = logger
+        self.cancelled = False
+        self._callbacks: List[Callable] = []
+        self._watcher: Optional[asyncio.Task] = None
+
+    async def __aenter__(self):
+        self.logger.debug("CancelScope __aenter__: %s", self.id)
+        receive = getattr(self.request, "receive", None)
+        if callable(receive):
+            self._watcher = asyncio.create_task(self._watch(receive))
+        else:
+            self.logger.debug("CancelScope: %s request is not a Request, disconnect is not watched", self.id)
         return self
 
-    def __exit__(self, exc_type, exc_value, traceback):
-        if isinstance(exc_type, anyio.get_cancelled_exc_class()):
-            self.logger.debug(f"CancelScope __exit__: {self.id} cancelled")
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if self._watcher is not None and not self._watcher.done():
+            self._watcher.cancel()
+        self._watcher = None
+        if self.cancelled and exc_type is not None and issubclass(exc_type, Exception):
+            # 断开后关闭上游流，正在读取的一方会抛出连接错误，此时无需再向上传播
+            self.logger.debug("CancelScope: %s suppressed %s after disconnect", self.id, exc_type.__name__)
             return True
         return False
 
-    def cancel(self):
-        self.logger.debug(f"CancelScope cancel: {self.id}")
-        if isinstance(self.cancel_scope, anyio.CancelScope):
-            self.cancel_scope.cancel()
+    async def _watch(self, receive):
+        while True:
+            message = await receive()
+            if message.get("type") == "http.disconnect":
+                break
+        self.logger.debug("CancelScope: %s client disconnected", self.id)
+        await self.cancel()
 
-    async def wait(self):
-        if not self._ready:
-            self.logger.debug(f"CancelScope wait: {self.id} not ready")
-            return True
-        is_disconnected = await self.request.is_disconnected()
-        self.logger.debug(f"CancelScope wait: {self.id} is_disconnected: {is_disconnected}")
-        if is_disconnected:
-            self.cancel_scope.cancel()
-            return True
-        return True
+    def add_callback(self, callback: Callable):
+        """
+        注册断开时执行的清理回调，可以是普通函数或协程函数
+        """
+        self._callbacks.append(callback)
+
+    async def cancel(self):
+        if self.cancelled:
+            return
+        self.logger.debug("CancelScope cancel: %s", self.id)
+        self.cancelled = True
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                result = callback()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                self.logger.warning(f"CancelScope: {self.id} callback {callback} failed: {e}")
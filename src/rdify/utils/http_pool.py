@@ -0,0 +1,50 @@
+import os
+import logging
+import importlib.util
+
+import httpx
+
+logger = logging.getLogger("rdify.http_pool")
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def http2_available() -> bool:
+    """HTTP/2 需要额外安装 h2（pip install httpx[http2]）"""
+    return importlib.util.find_spec("h2") is not None
+
+
+def pool_limits(prefix: str) -> httpx.Limits:
+    """
+    从环境变量读取连接池配置，例如 MOONSHOT_MAX_CONNECTIONS / MOONSHOT_MAX_KEEPALIVE_CONNECTIONS / MOONSHOT_KEEPALIVE_EXPIRY
+    """
+    return httpx.Limits(
+        max_connections=_env_int(f"{prefix}_MAX_CONNECTIONS", 500),
+        max_keepalive_connections=_env_int(f"{prefix}_MAX_KEEPALIVE_CONNECTIONS", 100),
+        keepalive_expiry=_env_float(f"{prefix}_KEEPALIVE_EXPIRY", 60.0),
+    )
+
+
+def create_async_client(prefix: str, **kwargs) -> httpx.AsyncClient:
+    """
+    创建进程级共享的 httpx.AsyncClient（keep-alive 连接池，可用时启用 HTTP/2）。
+    """
+    http2 = os.getenv(f"{prefix}_HTTP2", "1") != "0" and http2_available()
+    limits = pool_limits(prefix)
+    timeout = httpx.Timeout(
+        _env_float(f"{prefix}_READ_TIMEOUT", 600.0),
+        connect=_env_float(f"{prefix}_CONNECT_TIMEOUT", 10.0),
+    )
+    logger.info(
+        "Creating %s http client: http2=%s max_connections=%s max_keepalive=%s",
+        prefix, http2, limits.max_connections, limits.max_keepalive_connections,
+    )
+    return httpx.AsyncClient(http2=http2, limits=limits, timeout=timeout, **kwargs)
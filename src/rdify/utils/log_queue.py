@@ -0,0 +1,70 @@
+import os
+import queue
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional, Sequence
+
+_listener: Optional[QueueListener] = None
+
+
+class _RoutedQueueHandler(QueueHandler):
+    """
+    替换 logger 上原有的 handler：记录只入队，不在事件循环上格式化或写文件。
+    记录上附带原 handler 列表，由后台线程分发。
+    """
+
+    def __init__(self, log_queue, targets: Sequence[logging.Handler]):
+        super().__init__(log_queue)
+        self.targets = tuple(targets)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 进程内队列无需序列化，消息的 % 格式化推迟到后台线程
+        record.rdify_targets = self.targets
+        return record
+
+
+class _RoutedQueueListener(QueueListener):
+    def handle(self, record: logging.LogRecord):
+        for handler in getattr(record, "rdify_targets", ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+def install_queue_logging() -> Optional[QueueListener]:
+    """
+    在 dictConfig 之后调用：把所有已配置 logger 的 handler 换成队列 handler，
+    由单个后台线程完成格式化和文件写入。RDIFY_LOG_QUEUE=0 时保持同步写入。
+    RDIFY_LOG_LEVEL 可覆盖 rdify logger 的级别（如 INFO 以关闭逐 chunk 的 debug 日志）。
+    """
+    global _listener
+    level = os.getenv("RDIFY_LOG_LEVEL")
+    if level:
+        logging.getLogger("rdify").setLevel(level.upper())
+    if _listener is not None or os.getenv("RDIFY_LOG_QUEUE", "1") == "0":
+        return _listener
+
+    log_queue = queue.SimpleQueue()
+    loggers = [logging.getLogger()] + [
+        logger for logger in logging.root.manager.loggerDict.values()
+        if isinstance(logger, logging.Logger)
+    ]
+    for logger in loggers:
+        if not logger.handlers:
+            continue
+        logger.handlers = [_RoutedQueueHandler(log_queue, logger.handlers)]
+
+    _listener = _RoutedQueueListener(log_queue)
+    _listener.start()
+    atexit.register(stop_queue_logging)
+    return _listener
+
+
+def stop_queue_logging():
+    """
+    停止后台线程，写完队列中剩余的记录
+    """
+    global _listener
+    listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
@@ -0,0 +1,97 @@
+import gc
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from rdify.admission import AdmissionController, AdmissionLimits, release_after
+
+
+def test_admission_queues_and_rejects_when_full():
+    async def run():
+        controller = AdmissionController({"m": AdmissionLimits(max_concurrency=1, max_queue=1, retry_after=3)})
+        admission = controller.get("m")
+        release_first = await controller.acquire("m")
+
+        queued = asyncio.create_task(controller.acquire("m"))
+        await asyncio.sleep(0)
+        assert admission.queued == 1
+
+        with pytest.raises(HTTPException) as excinfo:
+            await controller.acquire("m")
+        assert excinfo.value.status_code == 429
+        assert excinfo.value.headers["Retry-After"] == "3"
+
+        release_first()
+        release_first()  # 重复释放无效
+        release_second = await queued
+        assert admission.active == 1 and admission.queued == 0
+        release_second()
+        return admission.stats()
+
+    stats = asyncio.run(run())
+    assert stats["active"] == 0
+    assert stats["admitted"] == 2
+    assert stats["rejected_queue_full"] == 1
+
+
+def test_admission_queue_timeout():
+    async def run():
+        controller = AdmissionController({"*": AdmissionLimits(max_concurrency=1, max_queue=5, max_queue_time=0.01)})
+        await controller.acquire("m")
+        with pytest.raises(HTTPException) as excinfo:
+            await controller.acquire("m")
+        return excinfo.value, controller.get("m")
+
+    error, admission = asyncio.run(run())
+    assert error.status_code == 503
+    assert admission.queued == 0
+    assert admission.rejected_timeout == 1
+
+
+def test_unlimited_by_default():
+    async def run():
+        controller = AdmissionController({})
+        for _ in range(100):
+            await controller.acquire("m")
+        return controller.get("m")
+
+    assert asyncio.run(run()).active == 100
+
+
+def test_zero_max_queue_is_unbounded():
+    async def run():
+        controller = AdmissionController({"m": AdmissionLimits(max_concurrency=1)})
+        admission = controller.get("m")
+        release = await controller.acquire("m")
+        waiting = [asyncio.create_task(controller.acquire("m")) for _ in range(3)]
+        await asyncio.sleep(0)
+        # 槽位已满时排队等待，而不是直接 429
+        assert admission.queued == 3 and admission.rejected_queue_full == 0
+        release()
+        for task in waiting:
+            (await task)()
+        return admission
+
+    admission = asyncio.run(run())
+    assert admission.admitted == 4 and admission.active == 0
+
+
+def test_release_after_stream_and_unstarted_generator():
+    released = []
+
+    def events():
+        async def generator():
+            yield b"data: [DONE]\n\n"
+        return generator()
+
+    async def run():
+        frames = [frame async for frame in release_after(events, lambda: released.append(1))()]
+        assert frames == [b"data: [DONE]\n\n"]
+
+    asyncio.run(run())
+    assert released == [1]
+
+    release_after(events, lambda: released.append(2))()
+    gc.collect()
+    assert released == [1, 2]
@@ -0,0 +1,81 @@
+import asyncio
+
+import httpx
+from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
+
+from rdify.aggregator import ChatAggregator, CompletionAggregator
+from rdify.openai_schemas import ChatCompletionChoice, ChatMessage, ChoiceDeltaContent, CompletionChoice
+
+
+def choice_chunk(content: str, index: int = 0, finish_reason=None) -> ChatCompletionChoice:
+    return ChatCompletionChoice(
+        index=index,
+        message=ChatMessage(role="assistant", content=content),
+        finish_reason=finish_reason,
+        delta=ChoiceDeltaContent(content=content, role="assistant"),
+    )
+
+
+def test_chat_aggregator_folds_deltas_per_index():
+    aggregator = ChatAggregator()
+    for word in ["a", "b", "c"]:
+        aggregator.add(choice_chunk(word))
+        aggregator.add(choice_chunk(word.upper(), index=1))
+    aggregator.add(choice_chunk("", index=1, finish_reason="length"))
+
+    choices = aggregator.result()
+    assert [c.index for c in choices] == [0, 1]
+    assert choices[0].message.content == "abc"
+    assert choices[0].finish_reason == "stop"
+    assert choices[1].message.content == "ABC"
+    assert choices[1].finish_reason == "length"
+
+
+def test_chat_aggregator_accepts_upstream_chunks():
+    aggregator = ChatAggregator()
+    for i, word in enumerate(["Hello", " world"]):
+        aggregator.add(ChatCompletionChunk(
+            id="1", object="chat.completion.chunk", created=1, model="m",
+            choices=[{
+                "index": 0,
+                "delta": {"role": "assistant", "content": word} if i == 0 else {"content": word},
+                "finish_reason": "stop" if i == 1 else None,
+            }],
+        ))
+    [choice] = aggregator.result()
+    assert choice.message.role == "assistant"
+    assert choice.message.content == "Hello world"
+    assert choice.finish_reason == "stop"
+
+
+def test_completion_aggregator():
+    aggregator = CompletionAggregator()
+    for word in ["x", "y"]:
+        aggregator.add(CompletionChoice(index=0, text=word))
+    [choice] = aggregator.result()
+    assert choice.text == "xy"
+    assert choice.finish_reason == "stop"
+
+
+def test_chat_completions_non_stream_returns_single_choice():
+    from rdify.app import app
+    from rdify.llm_models import MODEL_REGISTRY
+    from rdify.apps.fake_llvm import register_fake_llvm
+
+    register_fake_llvm(MODEL_REGISTRY)
+
+    async def call():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://rdify") as client:
+            return await client.post("/v1/chat/completions", json={
+                "model": "test-model",
+                "messages": [{"role": "user", "content": "hi there"}],
+            })
+
+    resp = asyncio.run(call())
+    assert resp.status_code == 200
+    choices = resp.json()["choices"]
+    assert len(choices) == 1
+    # fake_llvm 按空格切分输出，合并后应得到全部片段
+    assert choices[0]["message"]["content"].endswith("</think>user:hithere\n")
+    assert choices[0]["finish_reason"] == "stop"
@@ -0,0 +1,45 @@
+import asyncio
+
+from rdify.bench import SSECounter, Sample, compare, percentiles, run_bench
+
+
+def test_bench_reports_streaming_and_disconnect_metrics():
+    report = asyncio.run(run_bench(
+        ["asgi", "socket"], ["chat-stream", "completion-blocking", "chat-disconnect"], [2], 4, warmup=1,
+    ))
+    results = report["results"]
+    assert len(results) == 6
+    for transport in ("asgi", "socket"):
+        stream = results[f"{transport}/chat-stream/c2"]
+        assert stream["errors"] == 0 and stream["requests"] == 4
+        assert stream["tokens"] > 0 and stream["ttft_ms"]["p50"] is not None and stream["gap_ms"]["p99"] is not None
+        assert stream["cpu_us_per_token"] > 0 and stream["peak_rss_mb"] > 0
+
+        blocking = results[f"{transport}/completion-blocking/c2"]
+        assert blocking["errors"] == 0 and blocking["tokens"] == 0 and blocking["ttft_ms"]["p50"] is not None
+
+        disconnect = results[f"{transport}/chat-disconnect/c2"]
+        assert disconnect["disconnects"] == 4 and disconnect["tokens"] == 12
+
+
+def test_counter_stops_at_disconnect_threshold():
+    # 多个增量在同一块数据中到达时，超出阈值的部分不计入
+    counter = SSECounter(Sample(), 0.0, True, limit=3)
+    counter.feed(b"".join(b'data: {"choices":[{"delta":{"content":"t%d"}}]}\n\n' % i for i in range(5)))
+    assert counter.tokens == 3
+
+
+def test_percentiles_nearest_rank():
+    values = [i / 1000 for i in range(1, 101)]
+    assert percentiles(values) == {"p50": 50.0, "p95": 95.0, "p99": 99.0}
+    assert percentiles([]) == {"p50": None, "p95": None, "p99": None}
+
+
+def test_compare_flags_regressions_beyond_threshold():
+    def report(ttft, rps, errors=0):
+        return {"results": {"asgi/chat-stream/c1": {"ttft_ms": {"p50": ttft}, "rps": rps, "errors": errors}}}
+
+    baseline = report(10.0, 100.0)
+    assert compare(report(11.0, 90.0), baseline, threshold=0.2) == []
+    regressions = compare(report(13.0, 70.0, errors=1), baseline, threshold=0.2, thresholds={"ttft_ms.p50": 0.5})
+    assert [regression["metric"] for regression in regressions] == ["rps", "errors"]
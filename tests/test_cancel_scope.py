@@ -0,0 +1,51 @@
+import asyncio
+
+from rdify.llm_models import MODEL_REGISTRY, chat_event
+from rdify.models import ModelInterface
+from rdify.openai_schemas import ChatCompletionRequest, ChatCompletionResponse, ChatMessage, ModelInfo
+from rdify.sse import StreamDelta
+
+
+class FakeRequest:
+    def __init__(self):
+        self.disconnected = asyncio.Event()
+
+    async def receive(self):
+        await self.disconnected.wait()
+        return {"type": "http.disconnect"}
+
+
+def test_chat_event_stops_adapter_on_disconnect():
+    state = {"produced": 0, "closed": False, "callback": False}
+
+    async def endless_chat(req, cancel_scope=None, **kwargs):
+        cancel_scope.add_callback(lambda: state.update(callback=True))
+        try:
+            while True:
+                state["produced"] += 1
+                yield StreamDelta("x", role="assistant")
+                await asyncio.sleep(0.01)
+        finally:
+            state["closed"] = True
+
+    MODEL_REGISTRY.register_model("cancel-test-model", ModelInterface(
+        info=ModelInfo(id="cancel-test-model"),
+        invoke_chat=endless_chat,
+        invoke_completion=None,
+    ))
+    req = ChatCompletionRequest(model="cancel-test-model", messages=[ChatMessage(role="user", content="hi")])
+
+    async def run():
+        request = FakeRequest()
+        frames = []
+        events = chat_event(req, ChatCompletionResponse(model=req.model), context={"request": request})()
+        async for frame in events:
+            frames.append(frame)
+            if len(frames) == 3:
+                request.disconnected.set()
+        return frames
+
+    frames = asyncio.run(asyncio.wait_for(run(), timeout=5))
+    assert state["closed"] and state["callback"]
+    assert state["produced"] <= 5
+    assert b"data: [DONE]\n\n" not in frames
@@ -0,0 +1,164 @@
+import os
+import time
+import asyncio
+import threading
+
+from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
+
+from rdify.apps import run_task_llm
+from rdify.conversation_store import ConversationStore, SessionRecorder
+from rdify.openai_schemas import ChatCompletionRequest
+
+
+def _chunk(content, role=None, finish_reason=None):
+    return ChatCompletionChunk(
+        id="c", object="chat.completion.chunk", created=0, model="m",
+        choices=[{"index": 0, "delta": {"role": role, "content": content}, "finish_reason": finish_reason}],
+    )
+
+
+def test_sessions_span_rotated_compressed_segments(tmp_path):
+    store = ConversationStore(tmp_path, segment_max_bytes=300, compress=True)
+    recorders = [SessionRecorder(store, f"s{i}", {"messages": [i]}, flush_bytes=10) for i in range(3)]
+    for n in range(20):
+        for i, recorder in enumerate(recorders):
+            recorder.add(f"{i}-{n:02d}|", role="assistant" if n == 0 else None)
+    for recorder in recorders:
+        recorder.end("ok")
+    store.close()
+
+    assert list(tmp_path.glob("*.jsonl.gz")), "rotated segments are compressed"
+    assert len(store.index()) == 3
+    for i in range(3):
+        records = store.read_session(f"s{i}")
+        assert records[0]["k"] == "start" and records[0]["d"] == {"messages": [i]}
+        assert records[-1]["k"] == "end"
+        text = "".join(record["d"]["content"] for record in records if record["k"] == "delta")
+        assert text == "".join(f"{i}-{n:02d}|" for n in range(20))
+
+
+def test_unfinished_session_is_readable(tmp_path):
+    store = ConversationStore(tmp_path)
+    recorder = SessionRecorder(store, "crashed", {"messages": []}, flush_bytes=1)
+    recorder.add("partial", role="assistant")
+    store.close()
+    # 模拟写到一半崩溃：最后一行不完整
+    segment = next(tmp_path.glob("*.jsonl"))
+    with open(segment, "ab") as f:
+        f.write(b'{"v":1,"s":"crashed","k":"del')
+    records = ConversationStore(tmp_path).read_session("crashed")
+    assert [record["k"] for record in records] == ["start", "delta"]
+
+
+def test_dump_conversation_streams_into_store(tmp_path, monkeypatch):
+    store = ConversationStore(tmp_path)
+    monkeypatch.setattr(run_task_llm, "CONVERSATION_STORE", store)
+
+    @run_task_llm.dump_conversation
+    async def stream(req, **kwargs):
+        yield _chunk("", role="assistant")
+        yield _chunk("hello")
+        yield _chunk(" world", finish_reason="stop")
+
+    req = ChatCompletionRequest(model="run-task-model", messages=[{"role": "user", "content": "hi"}])
+
+    async def _run():
+        return [chunk async for chunk in stream(req)]
+
+    assert len(asyncio.run(_run())) == 3
+    store.close()
+    (session_id,) = store.index()
+    assert store.read_session(session_id)[-1]["d"] == {"status": "ok", "finish_reason": "stop"}
+    loaded = run_task_llm.load_conversation(session_id, store)
+    assert [(m.role, m.content) for m in loaded.messages] == [("user", "hi"), ("assistant", "hello world")]
+
+
+def test_history_is_deduplicated_and_collected(tmp_path):
+    store = ConversationStore(tmp_path)
+    system = {"role": "system", "content": "long system prompt " * 100}
+    history = [system, {"role": "user", "content": "q1"}]
+    SessionRecorder(store, "turn-1", {"model": "m", "messages": history}).end("ok")
+    history = history + [{"role": "assistant", "content": "a1"}, {"role": "user", "content": "q2"}]
+    SessionRecorder(store, "turn-2", {"model": "m", "messages": history}).end("ok")
+    store.close()
+
+    # 两个会话共享前缀，只有 4 个 blob，系统提示只存一份
+    assert len(list(tmp_path.glob("blobs/*/*.json"))) == 4
+    assert sum(path.read_text().count("long system prompt") for path in tmp_path.glob("*.jsonl")) == 0
+    assert store.read_session("turn-2")[0]["d"] == {"model": "m", "messages": history}
+    assert store.collect_garbage(grace=0)["removed"] == 0
+
+    # 会话的段文件被清理后，blob 不再被引用
+    for segment in tmp_path.glob("*.jsonl"):
+        if segment.name != "index.jsonl":
+            segment.unlink()
+    assert store.collect_garbage(grace=0) == {"segments": 0, "blobs": 4, "live": 0, "removed": 4}
+    # 指向已删除段的索引条目被压缩掉
+    assert store.index() == {}
+
+
+def test_history_rewrites_prefix_removed_by_gc(tmp_path):
+    store = ConversationStore(tmp_path)
+    history = [{"role": "user", "content": "q1"}, {"role": "assistant", "content": "a1"}]
+    head = store._write_history(history)
+    # GC 在两次写入之间删除了被复用的前缀
+    store._blob_path(head).unlink()
+    history = history + [{"role": "user", "content": "q2"}]
+    assert store.resolve_history(store._write_history(history)) == history
+
+    # GC 持有排他锁期间，写线程等待，锁释放后写出完整的链
+    heads = []
+    history = history + [{"role": "assistant", "content": "a2"}]
+    writer = threading.Thread(target=lambda: heads.append(store._write_history(history)))
+    with store._store_lock(exclusive=True):
+        for path in tmp_path.glob("blobs/*/*.json"):
+            path.unlink()
+        writer.start()
+        writer.join(timeout=0.2)
+        assert writer.is_alive()
+    writer.join(timeout=5)
+    assert store.resolve_history(heads[0]) == history
+
+
+def _wait_for_end(store, session_id):
+    deadline = time.monotonic() + 5
+    while not store.read_session(session_id) or store.read_session(session_id)[-1]["k"] != "end":
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_index_is_cached_until_the_file_changes(tmp_path):
+    store = ConversationStore(tmp_path)
+    SessionRecorder(store, "s1", {"messages": []}).end("ok")
+    store.close()
+    first = store.index()
+    assert store.index() is first
+
+    SessionRecorder(store, "s2", {"messages": []}).end("ok")
+    store.close()
+    assert set(store.index()) == {"s1", "s2"}
+    assert set(first) == {"s1"}
+
+
+def test_retention_expires_segments_and_compacts_index(tmp_path):
+    # 每条记录单独一个段
+    store = ConversationStore(tmp_path, segment_max_bytes=1, retention=3600)
+    SessionRecorder(store, "old", {"messages": [{"role": "user", "content": "q-old"}]}).end("ok")
+    _wait_for_end(store, "old")
+    expired = time.time() - 7200
+    for segment in tmp_path.glob("*-*.jsonl"):
+        os.utime(segment, (expired, expired))
+
+    # 写线程的当前段（old 的 end 记录）仍在写入，不删除
+    result = store.collect_garbage(grace=0)
+    assert result["segments"] == 1 and result["removed"] == 1
+    assert store.read_session("old") == [] and store.index() == {}
+
+    # 索引被替换后，写线程追加到新文件
+    SessionRecorder(store, "new", {"messages": [{"role": "user", "content": "q-new"}]}).end("ok")
+    store.close()
+    assert set(store.index()) == {"new"}
+    assert [record["k"] for record in store.read_session("new")] == ["start", "end"]
+    # 写线程关闭后，保存 old 的 end 记录的过期段也被删除
+    assert store.collect_garbage(grace=0)["segments"] == 1
+    assert [record["k"] for record in store.read_session("new")] == ["start", "end"]
@@ -0,0 +1,253 @@
+import json
+import asyncio
+import threading
+
+import httpx
+import pytest
+from pydify.common import DifyAPIError
+
+from rdify.apps.dify import core, async_client
+from rdify.apps.dify.client_pool import DifyClientPool
+from rdify.apps.dify.conversations import ConversationMap
+from rdify.apps.dify.schemas import DifySiteModel, DifyAppModel
+from rdify.models import ModelRegistry
+from rdify.openai_schemas import ChatCompletionRequest, CompletionRequest, ChatMessage
+from rdify.utils.cancel_scope import CancelScope
+
+
+def _sse(*events) -> bytes:
+    return b"".join(b"event: ping\n\n" + f"data: {json.dumps(event)}\n\n".encode() for event in events)
+
+
+@pytest.fixture
+def dify(monkeypatch):
+    """
+    用 MockTransport 替换共享 httpx 客户端，记录请求；responses 按 response_mode 给出响应工厂
+    """
+    requests = []
+    responses = {}
+
+    def handler(request: httpx.Request):
+        body = json.loads(request.content)
+        requests.append((request.url.path, request.headers["Authorization"], body))
+        return responses[body["response_mode"]](body)
+
+    site = DifySiteModel(apps=[DifyAppModel(id="app-1", name="bot", api_keys=["app-key"])])
+    monkeypatch.setattr(core, "DIFY_SITE_MODEL", site)
+    monkeypatch.setattr(core, "CONVERSATIONS", ConversationMap())
+    monkeypatch.setattr(core, "CLIENT_POOL", DifyClientPool())
+    monkeypatch.setenv("DIFY_BASE_URL", "http://dify.test/v1")
+    monkeypatch.setattr(async_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    return requests, responses
+
+
+def _collect(gen):
+    async def _run():
+        return [delta async for delta in gen]
+    return asyncio.run(_run())
+
+
+def test_chat_stream_maps_events_without_threads(dify):
+    requests, responses = dify
+    responses["streaming"] = lambda body: httpx.Response(200, content=_sse(
+        {"event": "workflow_started"},
+        {"event": "message", "answer": "he"},
+        {"event": "agent_message", "answer": "llo"},
+        {"event": "message_end", "metadata": {}},
+    ))
+    req = ChatCompletionRequest(model="bot", messages=[ChatMessage(role="user", content="hi")], stream=True)
+    threads = threading.active_count()
+    deltas = _collect(core.invoke_chat(req))
+    assert threading.active_count() == threads
+    assert [(d.content, d.finish_reason) for d in deltas] == [("he", None), ("llo", None), ("", "stop")]
+    assert all(d.role == "assistant" for d in deltas)
+    path, auth, body = requests[0]
+    assert path == "/v1/chat-messages"
+    assert auth == "Bearer app-key"
+    assert body["query"] == "hi" and body["response_mode"] == "streaming"
+
+
+def test_completion_blocking_when_not_streaming(dify):
+    requests, responses = dify
+    responses["blocking"] = lambda body: httpx.Response(200, json={"event": "message", "answer": "hello"})
+    req = CompletionRequest(model="bot", prompt=["a", "b"], stream=False)
+    deltas = _collect(core.invoke_completion(req))
+    assert [(d.content, d.finish_reason) for d in deltas] == [("hello", "stop")]
+    path, _, body = requests[0]
+    assert path == "/v1/completion-messages"
+    assert body["inputs"] == {"query": "a\nb"} and body["response_mode"] == "blocking"
+
+
+def test_pinned_model_survives_app_removal(dify):
+    requests, responses = dify
+    responses["blocking"] = lambda body: httpx.Response(200, json={"answer": "hello"})
+    registry = ModelRegistry()
+    core.load_apps(registry, [DifyAppModel(id="app-2", name="other", api_keys=["other-key"])])
+    pinned = registry.get_model("other")
+    # 重载删除了该应用，已固定模型的请求仍用原应用的 Key
+    core.load_apps(registry, [])
+    req = CompletionRequest(model="other", prompt="hi", stream=False)
+    deltas = _collect(pinned.invoke_completion(req))
+    assert [d.content for d in deltas] == ["hello"]
+    assert requests[-1][1] == "Bearer other-key"
+
+    with pytest.raises(ValueError, match="other"):
+        core.get_or_create_new_api_key("other")
+
+
+def test_reload_invalidates_clients_of_changed_apps(dify):
+    registry = ModelRegistry()
+    core.load_apps(registry, [DifyAppModel(id="app-2", name="other", api_keys=["k"])])
+    client = core.CLIENT_POOL.get("app-2", "k")
+    # 同名应用 ID 变化：旧 ID 的客户端被移除
+    core.load_apps(registry, [DifyAppModel(id="app-3", name="other", api_keys=["k"])])
+    assert len(core.CLIENT_POOL) == 0
+    assert core.CLIENT_POOL.get("app-2", "k") is not client
+
+
+def test_error_event_and_status_raise(dify):
+    _, responses = dify
+    responses["streaming"] = lambda body: httpx.Response(200, content=_sse(
+        {"event": "message", "answer": "x"},
+        {"event": "error", "status": 400, "code": "invalid_param", "message": "bad"},
+    ))
+    req = ChatCompletionRequest(model="bot", messages=[ChatMessage(role="user", content="hi")], stream=True)
+    with pytest.raises(DifyAPIError, match="bad"):
+        _collect(core.invoke_chat(req))
+
+    responses["streaming"] = lambda body: httpx.Response(401, json={"message": "unauthorized"})
+    with pytest.raises(DifyAPIError) as info:
+        _collect(core.invoke_chat(req))
+    assert info.value.status_code == 401
+
+
+def test_cancel_closes_upstream_response(dify):
+    _, responses = dify
+    closed = asyncio.Event()
+
+    class _Stream(httpx.AsyncByteStream):
+        async def __aiter__(self):
+            yield _sse({"event": "message", "answer": "a"})
+            await asyncio.sleep(10)
+
+        async def aclose(self):
+            closed.set()
+
+    req = ChatCompletionRequest(model="bot", messages=[ChatMessage(role="user", content="hi")], stream=True)
+
+    async def _run():
+        responses["streaming"] = lambda body: httpx.Response(200, stream=_Stream())
+        scope = CancelScope()
+        gen = core.invoke_chat(req, cancel_scope=scope)
+        first = await gen.__anext__()
+        await scope.cancel()
+        await asyncio.wait_for(closed.wait(), 1)
+        await gen.aclose()
+        return first
+
+    assert asyncio.run(_run()).content == "a"
+
+
+def test_message_end_closes_upstream_response(dify):
+    _, responses = dify
+    closed = []
+
+    class _Stream(httpx.AsyncByteStream):
+        async def __aiter__(self):
+            yield _sse({"event": "message", "answer": "a"}, {"event": "message_end"})
+            await asyncio.sleep(10)
+
+        async def aclose(self):
+            closed.append(True)
+
+    req = ChatCompletionRequest(model="bot", messages=[ChatMessage(role="user", content="hi")], stream=True)
+
+    async def _run():
+        responses["streaming"] = lambda body: httpx.Response(200, stream=_Stream())
+        deltas = [delta async for delta in core.invoke_chat(req)]
+        # 不依赖垃圾回收：生成器返回时上游响应已关闭
+        return deltas, bool(closed)
+
+    deltas, closed_on_return = asyncio.run(_run())
+    assert [d.finish_reason for d in deltas] == [None, "stop"]
+    assert closed_on_return
+
+
+def test_multi_turn_chat_continues_dify_conversation(dify):
+    requests, responses = dify
+    responses["streaming"] = lambda body: httpx.Response(200, content=_sse(
+        {"event": "message", "answer": "ans-" + body["query"][-2:], "conversation_id": "conv-1"},
+        {"event": "message_end", "conversation_id": "conv-1"},
+    ))
+
+    def chat(messages, user="u"):
+        _collect(core.invoke_chat(ChatCompletionRequest(model="bot", messages=messages, stream=True, user=user)))
+        return requests[-1][2]
+
+    first = [ChatMessage(role="user", content="q1")]
+    assert "conversation_id" not in chat(first)
+
+    # 客户端回传完整历史：只发送新消息并续用会话
+    second = first + [ChatMessage(role="assistant", content="ans-q1"), ChatMessage(role="user", content="q2")]
+    body = chat(second)
+    assert body["conversation_id"] == "conv-1" and body["query"] == "q2"
+
+    # 重新生成同一轮：会话里已有被丢弃的回答，不能再续用
+    body = chat(second)
+    assert "conversation_id" not in body
+    assert body["query"] == "user: q1\nassistant: ans-q1\nuser: q2"
+
+    # 历史被改写（未知前缀）：新会话，历史拼入 query
+    edited = first + [ChatMessage(role="assistant", content="edited"), ChatMessage(role="user", content="q2")]
+    body = chat(edited)
+    assert "conversation_id" not in body
+    assert body["query"] == "user: q1\nassistant: edited\nuser: q2"
+
+
+def test_anonymous_chat_does_not_reuse_conversations(dify):
+    requests, responses = dify
+    responses["streaming"] = lambda body: httpx.Response(200, content=_sse(
+        {"event": "message", "answer": "a1", "conversation_id": "conv-1"},
+        {"event": "message_end", "conversation_id": "conv-1"},
+    ))
+    first = [ChatMessage(role="user", content="q1")]
+    _collect(core.invoke_chat(ChatCompletionRequest(model="bot", messages=first, stream=True)))
+    assert len(core.CONVERSATIONS) == 0
+
+    second = first + [ChatMessage(role="assistant", content="a1"), ChatMessage(role="user", content="q2")]
+    _collect(core.invoke_chat(ChatCompletionRequest(model="bot", messages=second, stream=True)))
+    assert "conversation_id" not in requests[-1][2]
+
+
+def test_missing_dify_conversation_retries_fresh(dify):
+    requests, responses = dify
+
+    def respond(body):
+        if body.get("conversation_id") == "gone":
+            return httpx.Response(404, json={"code": "not_found", "message": "Conversation Not Exists."})
+        return httpx.Response(200, content=_sse({"event": "message", "answer": "ok", "conversation_id": "conv-2"}, {"event": "message_end"}))
+
+    responses["streaming"] = respond
+    history = [("user", "q1"), ("assistant", "a1")]
+    core.CONVERSATIONS.put("bot", "u", history, "gone")
+    messages = [ChatMessage(role=role, content=content) for role, content in history] + [ChatMessage(role="user", content="q2")]
+    deltas = _collect(core.invoke_chat(ChatCompletionRequest(model="bot", messages=messages, stream=True, user="u")))
+    assert [d.content for d in deltas] == ["ok", ""]
+    assert [body.get("conversation_id") for _, _, body in requests] == ["gone", None]
+    assert core.CONVERSATIONS.take("bot", "u", history) is None
+
+
+def test_conversation_map_is_bounded_with_ttl():
+    conversations = ConversationMap(max_entries=2, ttl=60)
+    for i in range(3):
+        conversations.put("bot", "u", [("user", str(i))], f"c{i}")
+    assert len(conversations) == 2
+    assert conversations.take("bot", "u", [("user", "0")]) is None
+    assert conversations.take("bot", "other", [("user", "2")]) is None
+    assert conversations.take("bot", "u", [("user", "2")]) == "c2"
+    # 取出即移除
+    assert conversations.take("bot", "u", [("user", "2")]) is None
+
+    expired = ConversationMap(ttl=0)
+    expired.put("bot", "u", [("user", "x")], "c")
+    assert expired.take("bot", "u", [("user", "x")]) is None
@@ -0,0 +1,71 @@
+import threading
+
+from rdify.apps.dify import core
+from rdify.apps.dify.key_cache import ApiKeyCache
+from rdify.apps.dify.schemas import DifyAppModel, DifySiteModel
+
+
+class FakeSite:
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def fetch_app_api_keys(self, app_id):
+        with self.lock:
+            self.calls.append(app_id)
+        return [] if app_id == "new" else [{"token": f"key-{app_id}"}]
+
+    def create_app_api_key(self, app_id):
+        return {"token": f"created-{app_id}"}
+
+
+def test_catalog_is_indexed_and_replaced():
+    site_model = DifySiteModel(apps=[DifyAppModel(id="1", name="a"), DifyAppModel(id="2", name="b")])
+    assert site_model.get_app("b").id == "2"
+    assert site_model.get_app_by_id("1").name == "a"
+    site_model.replace_apps([DifyAppModel(id="3", name="c")])
+    site_model.replace_apps([DifyAppModel(id="3", name="c")])
+    assert [app.name for app in site_model.apps] == ["c"]
+    assert site_model.get_app("a") is None
+
+
+def test_key_cache_persists(tmp_path):
+    path = tmp_path / "keys.json"
+    ApiKeyCache(path).put("app-1", "secret")
+    assert ApiKeyCache(path).get("app-1") == "secret"
+    assert ApiKeyCache(path).get("app-2") is None
+
+
+def test_key_cache_defaults_to_state_dir(tmp_path, monkeypatch):
+    monkeypatch.delenv("RDIFY_DIFY_KEY_CACHE", raising=False)
+    monkeypatch.setenv("RDIFY_STATE_DIR", str(tmp_path / "state"))
+    cache = ApiKeyCache()
+    cache.put("app-1", "secret")
+    assert cache.path == tmp_path / "state" / "dify" / "api_keys.json"
+    # 明文 Key 只有属主可读
+    assert cache.path.stat().st_mode & 0o077 == 0
+    assert cache.path.parent.stat().st_mode & 0o077 == 0
+
+
+def test_prewarm_fetches_keys_once(tmp_path, monkeypatch):
+    site = FakeSite()
+    logins = []
+    monkeypatch.setattr(core, "get_site", lambda: logins.append(1) or site)
+    monkeypatch.setattr(core, "API_KEY_CACHE", ApiKeyCache(tmp_path / "keys.json"))
+    monkeypatch.setattr(core, "DIFY_SITE_MODEL", DifySiteModel())
+    apps = [DifyAppModel(id=str(i), name=f"app-{i}") for i in range(20)] + [DifyAppModel(id="new", name="app-new")]
+    core.DIFY_SITE_MODEL.replace_apps(apps)
+
+    core.prewarm_api_keys(apps).join(timeout=5)
+    assert sorted(site.calls) == sorted(app.id for app in apps)
+    assert core.get_or_create_new_api_key("app-3") == "key-3"
+    assert core.get_or_create_new_api_key("app-new") == "created-new"
+
+    # 重启后从磁盘缓存读取，不再访问控制台
+    restarted = [DifyAppModel(id=app.id, name=app.name) for app in apps]
+    core.DIFY_SITE_MODEL.replace_apps(restarted)
+    site.calls.clear()
+    core.prewarm_api_keys(restarted).join(timeout=5)
+    assert site.calls == []
+    assert len(logins) == 1
+    assert core.get_or_create_new_api_key("app-7") == "key-7"
@@ -0,0 +1,106 @@
+import json
+import asyncio
+
+import httpx
+import pytest
+
+from rdify.apps.dify import async_client
+from rdify.apps.dify.client_pool import DifyClientPool
+
+
+@pytest.fixture
+def dify(monkeypatch):
+    """
+    记录每个请求使用的 API Key；streaming 请求在 release 被设置前不返回，用于观察并发
+    """
+    keys = []
+    release = asyncio.Event()
+
+    async def handler(request: httpx.Request):
+        keys.append(request.headers["Authorization"])
+        if json.loads(request.content)["response_mode"] == "streaming":
+            await release.wait()
+            return httpx.Response(200, content=b'data: {"event": "message_end"}\n\n')
+        return httpx.Response(200, json={"answer": "ok"})
+
+    monkeypatch.setenv("DIFY_BASE_URL", "http://dify.test/v1")
+    monkeypatch.setattr(async_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    return keys, release
+
+
+def test_pool_reuses_clients_and_rebuilds_on_key_rotation(dify):
+    keys, _ = dify
+    pool = DifyClientPool(max_size=4, idle_timeout=60)
+    client = pool.get("app-1", "k1")
+    assert pool.get("app-1", "k1") is client
+    rotated = pool.get("app-1", "k2")
+    assert rotated is not client
+    asyncio.run(rotated.request_blocking("chat-messages", {}))
+    assert keys == ["Bearer k2"]
+
+
+def test_pool_is_bounded_and_evicts_idle_clients(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("rdify.apps.dify.client_pool.time.monotonic", lambda: now[0])
+    pool = DifyClientPool(max_size=2, idle_timeout=10)
+    first = pool.get("a", "k")
+    pool.get("b", "k")
+    pool.get("a", "k")
+    pool.get("c", "k")
+    # b 最久未使用，被淘汰
+    assert len(pool) == 2 and pool.get("a", "k") is first
+
+    now[0] = 11
+    assert pool.get("a", "k") is not first
+    assert len(pool) == 1
+
+
+def test_busy_client_is_not_evicted(monkeypatch, dify):
+    _, release = dify
+    now = [0.0]
+    monkeypatch.setattr("rdify.apps.dify.client_pool.time.monotonic", lambda: now[0])
+    pool = DifyClientPool(max_size=1, idle_timeout=10)
+
+    async def run():
+        busy = pool.get("a", "k")
+        stream = asyncio.create_task(_drain(busy.stream_events("chat-messages", {})))
+        while busy.in_flight == 0:
+            await asyncio.sleep(0)
+        now[0] = 20
+        pool.get("b", "k")
+        # 正在使用的客户端既不算空闲也不因容量被淘汰
+        assert pool.get("a", "k") is busy
+        release.set()
+        await stream
+        return busy.in_flight
+
+    assert asyncio.run(run()) == 0
+
+
+def test_invalidate_removes_clients(dify):
+    pool = DifyClientPool()
+    client = pool.get("app-1", "k")
+    assert pool.invalidate(["app-1", "missing"]) == ["app-1"]
+    assert pool.get("app-1", "k") is not client
+
+
+def test_per_app_connection_limit(dify):
+    keys, release = dify
+    pool = DifyClientPool(max_connections=1)
+
+    async def run():
+        client = pool.get("app-1", "k")
+        streams = [asyncio.create_task(_drain(client.stream_events("chat-messages", {}))) for _ in range(2)]
+        for _ in range(10):
+            await asyncio.sleep(0)
+        # 第二个请求在第一个结束前不会发出
+        assert len(keys) == 1
+        release.set()
+        await asyncio.gather(*streams)
+
+    asyncio.run(run())
+    assert len(keys) == 2
+
+
+async def _drain(events):
+    return [event async for event in events]
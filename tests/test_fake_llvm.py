@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from rdify.app import app
+from rdify.apps import fake_llvm
+from rdify.apps.fake_llvm import (
+    FakeUpstreamError, LoadProfile, PRESET_PROFILES, configured_profiles, make_fake_model, resolve_profile,
+    synthetic_stream,
+)
+from rdify.llm_models import MODEL_REGISTRY
+from rdify.openai_schemas import ChatCompletionRequest
+
+
+def _collect(prompt, profile):
+    async def _run():
+        return [chunk async for chunk in synthetic_stream(prompt, profile)]
+
+    return asyncio.run(_run())
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """
+    记录负载模型请求的等待时长而不真正等待，不依赖机器负载下的墙钟时间
+    """
+    requested = []
+    real_sleep = asyncio.sleep
+
+    async def fake_sleep(delay, *args, **kwargs):
+        requested.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(fake_llvm.asyncio, "sleep", fake_sleep)
+    return requested
+
+
+def test_zero_delay_profile_keeps_default_output(sleeps):
+    chunks = _collect("a b c d", PRESET_PROFILES["zero-delay"])
+    assert sleeps == []
+    assert chunks == _collect("a b c d", LoadProfile(tokens_per_second=0))
+    assert "".join(chunks).endswith("</think>abcd")
+
+
+def test_multi_token_chunks_keep_spaces():
+    profile = LoadProfile(zero_delay=True, chunk_tokens=(1, 4), seed=3)
+    prompt = "one two three four five six"
+    assert "".join(_collect(prompt, profile)) == f"<think> {prompt[::-1]} \n</think> {prompt}"
+
+
+def test_chunking_and_output_length_are_seeded():
+    profile = LoadProfile(zero_delay=True, chunk_tokens=(2, 3), output_tokens=50, seed=7)
+    chunks = _collect("x y", profile)
+    assert chunks == _collect("x y", profile)
+    assert 50 / 3 <= len(chunks) <= 25
+
+
+def test_ttft_and_rate_are_applied(sleeps):
+    chunks = _collect("p", LoadProfile(ttft=0.1, tokens_per_second=100, output_tokens=6))
+    assert len(chunks) == 6
+    # 首 token 前等待 ttft，之后每个 chunk 间隔 1 / 100 秒
+    assert sleeps == [0.1] + [0.01] * 5
+
+
+def test_error_and_abort_injection():
+    with pytest.raises(FakeUpstreamError):
+        _collect("a b", LoadProfile(zero_delay=True, error_rate=1.0))
+
+    chunks = []
+
+    async def _run():
+        async for chunk in synthetic_stream("a b", LoadProfile(zero_delay=True, output_tokens=20, abort_rate=1.0, seed=1)):
+            chunks.append(chunk)
+
+    with pytest.raises(ConnectionResetError):
+        asyncio.run(_run())
+    assert len(chunks) < 20
+
+
+def test_request_metadata_selects_profile():
+    model = make_fake_model("m", LoadProfile(ttft=10))
+    req = ChatCompletionRequest(
+        model="m", messages=[{"role": "user", "content": "hi"}],
+        metadata={"fake_profile": {"zero_delay": True, "output_tokens": 3}},
+    )
+
+    async def _run():
+        return [delta async for delta in model.invoke_chat(req)]
+
+    assert len(asyncio.run(asyncio.wait_for(_run(), 1))) == 3
+
+
+def test_preset_is_merged_onto_model_profile():
+    base = PRESET_PROFILES["default"].merged({"repeat": 100})
+    profile = resolve_profile(base, {"fake_profile": "zero-delay"})
+    assert profile.zero_delay and profile.repeat == 100
+    assert resolve_profile(base, {"fake_profile": "realistic"}).output_tokens == 300
+    assert resolve_profile(base, {"fake_profile": "default"}) == base
+
+
+@pytest.mark.parametrize("path, body", [
+    ("/v1/chat/completions", {"messages": [{"role": "user", "content": "hi"}]}),
+    ("/v1/completions", {"prompt": "hi"}),
+])
+@pytest.mark.parametrize("stream", [True, False])
+@pytest.mark.parametrize("fake_profile", ["no-such-preset", {"no_such_field": 1}])
+def test_invalid_profile_is_rejected_before_response(path, body, stream, fake_profile):
+    # 不进入 lifespan，只注册 fake 模型
+    MODEL_REGISTRY.register_model("profile-model", make_fake_model("profile-model", PRESET_PROFILES["zero-delay"]))
+    response = TestClient(app).post(path, json={
+        "model": "profile-model", "stream": stream, "metadata": {"fake_profile": fake_profile}, **body,
+    })
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Unknown")
+
+
+def test_configured_profiles_from_env(monkeypatch):
+    monkeypatch.setenv("RDIFY_FAKE_MODELS", '{"fast": "zero-delay", "slow": {"ttft": 1.5, "chunk_tokens": 4}}')
+    profiles = configured_profiles()
+    assert profiles["fast"].zero_delay
+    assert profiles["slow"].ttft == 1.5 and profiles["slow"].chunk_tokens == (4, 4)
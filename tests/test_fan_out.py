@@ -0,0 +1,113 @@
+import json
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from rdify.app import app
+from rdify.apps.fake_llvm import register_fake_llvm
+from rdify.fan_out import merge_fan_out, split_request
+from rdify.llm_models import MODEL_REGISTRY
+from rdify.openai_schemas import CompletionRequest
+from rdify.sse import StreamDelta
+
+
+def test_split_request_indexes():
+    req = CompletionRequest(model="m", prompt=["a", "b"], n=2)
+    parts = split_request(req, "completion")
+    assert [(index, sub_req.prompt, sub_req.n) for index, sub_req in parts] == [
+        (0, "a", None), (1, "a", None), (2, "b", None), (3, "b", None),
+    ]
+    assert split_request(CompletionRequest(model="m", prompt="a"), "completion") is None
+
+
+def test_merge_respects_concurrency_cap():
+    running = 0
+    peak = 0
+
+    def branch(text):
+        async def gen():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            yield StreamDelta(text)
+            running -= 1
+        return gen
+
+    async def _run():
+        branches = [(i, branch(str(i))) for i in range(10)]
+        return [chunk async for chunk in merge_fan_out(branches, concurrency=3)]
+
+    chunks = asyncio.run(_run())
+    assert peak == 3
+    texts = {chunk.index: chunk.content for chunk in chunks if chunk.finish_reason is None}
+    assert texts == {i: str(i) for i in range(10)}
+    # 每个 choice 都补上了结束标记
+    assert sorted(chunk.index for chunk in chunks if chunk.finish_reason == "stop") == list(range(10))
+
+
+def test_merge_cancels_siblings_on_error():
+    cancelled = asyncio.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+            yield StreamDelta("never")
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def failing():
+        yield StreamDelta("x")
+        raise RuntimeError("boom")
+
+    async def _run():
+        with pytest.raises(RuntimeError, match="boom"):
+            async for _ in merge_fan_out([(0, slow), (1, failing)]):
+                pass
+        assert cancelled.is_set()
+
+    asyncio.run(_run())
+
+
+def test_merge_applies_backpressure_to_branches():
+    produced = 0
+
+    async def chatty():
+        nonlocal produced
+        for i in range(1000):
+            produced += 1
+            yield StreamDelta(str(i))
+
+    async def _run():
+        merged = merge_fan_out([(i, chatty) for i in range(3)])
+        await merged.__anext__()
+        # 消费方停住时，各分支最多只能填满有界队列
+        for _ in range(10):
+            await asyncio.sleep(0)
+        buffered = produced
+        await merged.aclose()
+        return buffered
+
+    assert asyncio.run(_run()) <= 3 * 4 + 3 + 1
+
+
+def test_completion_list_prompt_and_chat_n_through_app():
+    register_fake_llvm(MODEL_REGISTRY)
+    client = TestClient(app)
+    body = client.post("/v1/completions", json={"model": "test-model", "prompt": ["p0", "p1", "p2"]}).json()
+    assert [choice["index"] for choice in body["choices"]] == [0, 1, 2]
+    assert all(f"p{i}" in choice["text"] for i, choice in enumerate(body["choices"]))
+
+    with client.stream("POST", "/v1/chat/completions", json={
+        "model": "test-model",
+        "messages": [{"role": "user", "content": "hi"}],
+        "n": 2,
+        "stream": True,
+    }) as response:
+        raw = b"".join(response.iter_bytes())
+    frames = [json.loads(line[6:]) for line in raw.decode().split("\n\n") if line.startswith("data: {")]
+    finishes = sorted(choice["index"] for frame in frames for choice in frame["choices"] if choice["finish_reason"])
+    assert finishes == [0, 1]
+    assert raw.endswith(b"data: [DONE]\n\n")
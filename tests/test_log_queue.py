@@ -0,0 +1,78 @@
+import json
+import queue
+import logging
+import threading
+
+from fastapi.testclient import TestClient
+
+import rdify.config  # noqa: F401  安装队列日志
+from rdify.app import app
+from rdify.apps.fake_llvm import register_fake_llvm
+from rdify.chat_log import ChatLogEntry
+from rdify.llm_models import MODEL_REGISTRY
+from rdify.metrics import StreamRecorder
+from rdify.utils.log_queue import _RoutedQueueHandler, _RoutedQueueListener
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((threading.current_thread().name, self.format(record)))
+
+
+def test_records_are_written_by_background_thread():
+    target = _ListHandler()
+    log_queue = queue.SimpleQueue()
+    listener = _RoutedQueueListener(log_queue)
+    listener.start()
+    logger = logging.getLogger("tests.log_queue")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.handlers = [_RoutedQueueHandler(log_queue, [target])]
+    try:
+        logger.debug("chunk %s", {"content": "hi"})
+    finally:
+        listener.stop()
+    assert len(target.records) == 1
+    thread_name, message = target.records[0]
+    assert thread_name != threading.current_thread().name
+    assert message == "chunk {'content': 'hi'}"
+
+
+def test_chat_logger_is_queued():
+    assert any(isinstance(handler, _RoutedQueueHandler) for handler in logging.getLogger("rdify.chat").handlers)
+
+
+def test_passthrough_entry_extracts_content():
+    recorder = StreamRecorder("log-model", "redirect")
+    frames = [
+        b'data: {"choices":[{"index":0,"delta":{"role":"assistant","content":"he"}}]}\n\n',
+        b'data: {"choices":[{"index":0,"delta":{"content":"llo"},"finish_reason":"stop"}]}\n\ndata: [DONE]\n\n',
+    ]
+    recorder.chunk(len(frames[0]))
+    recorder.chunk(len(frames[1]))
+    recorder.finish()
+    entry = json.loads(str(ChatLogEntry("chat", None, recorder, "ok", frames)))
+    assert entry["contents"] == ["hello"]
+    assert entry["model"] == "log-model"
+    assert entry["chunks"] == 2
+
+
+def test_one_chat_record_per_stream(monkeypatch):
+    register_fake_llvm(MODEL_REGISTRY)
+    entries = []
+    monkeypatch.setattr("rdify.llm_models.log_response", lambda *args: entries.append(ChatLogEntry(*args)))
+    client = TestClient(app)
+    with client.stream("POST", "/v1/chat/completions", json={
+        "model": "test-model",
+        "messages": [{"role": "user", "content": "hi"}],
+        "stream": True,
+    }) as response:
+        b"".join(response.iter_bytes())
+    assert len(entries) == 1
+    entry = json.loads(str(entries[0]))
+    assert entry["status"] == "ok"
+    assert "user:hi" in entry["contents"][0]
@@ -0,0 +1,79 @@
+import time
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from rdify.app import app
+from rdify.apps.fake_llvm import register_fake_llvm
+from rdify.llm_models import MODEL_REGISTRY, chat_aggregate
+from rdify.metrics import MetricsRegistry, StreamRecorder, REGISTRY
+from rdify.models import ModelInterface
+from rdify.openai_schemas import ChatCompletionRequest, ChatCompletionResponse, ChatMessage, ModelInfo
+from rdify.sse import StreamDelta
+
+
+def test_histogram_render():
+    registry = MetricsRegistry()
+    hist = registry.histogram("latency_seconds", "Latency", (0.1, 1), ("model",))
+    hist.labels("m").observe(0.05)
+    hist.labels("m").observe(0.5)
+    hist.labels("m").observe(5)
+    text = registry.render()
+    assert 'latency_seconds_bucket{model="m",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{model="m",le="1"} 2' in text
+    assert 'latency_seconds_bucket{model="m",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{model="m"} 3' in text
+
+
+def test_stream_recorder_updates_in_flight():
+    recorder = StreamRecorder("recorder-model", "fake")
+    assert 'rdify_in_flight_responses{model="recorder-model",adapter="fake"} 1' in REGISTRY.render()
+    recorder.chunk(10)
+    recorder.chunk(20)
+    recorder.finish()
+    recorder.finish()
+    text = REGISTRY.render()
+    assert 'rdify_in_flight_responses{model="recorder-model",adapter="fake"} 0' in text
+    assert 'rdify_response_bytes_sum{model="recorder-model",adapter="fake"} 30' in text
+    assert 'rdify_responses_total{model="recorder-model",adapter="fake",status="ok"} 1' in text
+
+
+def test_metrics_endpoint_records_stream():
+    # 不进入 lifespan，避免注册需要外部服务的模型
+    register_fake_llvm(MODEL_REGISTRY)
+    client = TestClient(app)
+    with client.stream("POST", "/v1/chat/completions", json={
+        "model": "test-model",
+        "messages": [{"role": "user", "content": "hi"}],
+        "stream": True,
+    }) as response:
+        body = b"".join(response.iter_bytes())
+    assert body.endswith(b"data: [DONE]\n\n")
+    text = client.get("/metrics").text
+    assert 'rdify_time_to_first_token_seconds_count{model="test-model",adapter="fake"}' in text
+    assert 'rdify_responses_total{model="test-model",adapter="fake",status="ok"}' in text
+
+
+def test_aggregate_records_response_body_bytes():
+    async def two_chunks(req, **kwargs):
+        yield StreamDelta("hello ", role="assistant")
+        yield StreamDelta("world", role="assistant", finish_reason="stop")
+
+    MODEL_REGISTRY.register_model("bytes-test-model", ModelInterface(
+        info=ModelInfo(id="bytes-test-model"), invoke_chat=two_chunks, invoke_completion=None, adapter="fake",
+    ))
+    req = ChatCompletionRequest(model="bytes-test-model", messages=[ChatMessage(role="user", content="hi")])
+    resp = asyncio.run(chat_aggregate(req, ChatCompletionResponse(model=req.model)))
+    size = len(resp.model_dump_json().encode())
+    assert f'rdify_response_bytes_sum{{model="bytes-test-model",adapter="fake"}} {size}' in REGISTRY.render()
+
+
+def test_benchmark_recorder_chunk():
+    recorder = StreamRecorder("bench-model", "fake")
+    n = 100000
+    start = time.perf_counter()
+    for _ in range(n):
+        recorder.chunk(64)
+    elapsed = time.perf_counter() - start
+    recorder.finish()
+    print(f"\nStreamRecorder.chunk: {elapsed / n * 1e9:.0f}ns/chunk")
@@ -0,0 +1,74 @@
+import asyncio
+
+from rdify.apps.dify.core import diff_apps
+from rdify.apps.dify.schemas import DifyAppModel
+from rdify.apps.fake_llvm import register_fake_llvm
+from rdify.llm_models import MODEL_REGISTRY, chat_event
+from rdify.model_reload import ModelReloader
+from rdify.openai_schemas import ChatCompletionRequest, ChatCompletionResponse
+
+
+def test_diff_apps():
+    old = [DifyAppModel(id="1", name="a"), DifyAppModel(id="2", name="b"), DifyAppModel(id="3", name="c")]
+    new = [DifyAppModel(id="2", name="b"), DifyAppModel(id="9", name="c"), DifyAppModel(id="4", name="d")]
+    assert diff_apps(old, new) == {"added": ["d"], "removed": ["a"], "changed": ["c"]}
+
+
+def test_reload_runs_once_in_background():
+    calls = []
+
+    async def run_reload():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 3, {"added": ["a"], "removed": [], "changed": []}
+
+    async def run():
+        reloader = ModelReloader(run_reload)
+        job = reloader.start()
+        assert reloader.start() is job
+        assert reloader.status()["state"] == "running"
+        await asyncio.sleep(0.05)
+        return reloader.status()
+
+    status = asyncio.run(run())
+    assert calls == [1]
+    assert status["state"] == "succeeded"
+    assert status["version"] == 3
+    assert status["diff"]["added"] == ["a"]
+
+
+def test_reload_failure_is_reported():
+    async def run_reload():
+        raise RuntimeError("dify unavailable")
+
+    async def run():
+        reloader = ModelReloader(run_reload)
+        reloader.start()
+        await asyncio.sleep(0.01)
+        return reloader.status()
+
+    status = asyncio.run(run())
+    assert status["state"] == "failed"
+    assert status["error"] == "dify unavailable"
+
+
+def test_in_flight_request_keeps_its_model():
+    register_fake_llvm(MODEL_REGISTRY)
+    req = ChatCompletionRequest(model="test-model", messages=[{"role": "user", "content": "hi"}], stream=True)
+    context = {"model": MODEL_REGISTRY.get_model("test-model")}
+
+    async def run():
+        saved = MODEL_REGISTRY.models
+        frames = []
+        try:
+            async for frame in chat_event(req, ChatCompletionResponse(model=req.model), context=context)():
+                # 第一帧之后模型从注册表中移除
+                MODEL_REGISTRY.replace_models({})
+                frames.append(frame)
+        finally:
+            MODEL_REGISTRY.replace_models(saved)
+        return frames
+
+    frames = asyncio.run(run())
+    assert frames[-1] == b"data: [DONE]\n\n"
+    assert len(frames) > 3
@@ -0,0 +1,81 @@
+import json
+import asyncio
+
+import httpx
+import pytest
+from openai import AsyncOpenAI
+
+from rdify.apps import redirect_llm
+from rdify.openai_schemas import ChatCompletionRequest, ChatMessage
+
+
+def sse_body(words: list[str]) -> bytes:
+    frames = []
+    for i, word in enumerate(words):
+        chunk = {
+            "id": "chatcmpl-1",
+            "object": "chat.completion.chunk",
+            "created": 1,
+            "model": "upstream-model",
+            "choices": [{
+                "index": 0,
+                "delta": {"role": "assistant", "content": word} if i == 0 else {"content": word},
+                "finish_reason": "stop" if i == len(words) - 1 else None,
+            }],
+        }
+        frames.append(f"data: {json.dumps(chunk)}\n\n")
+    frames.append("data: [DONE]\n\n")
+    return "".join(frames).encode()
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return httpx.Response(
+            200,
+            headers={"content-type": "text/event-stream"},
+            content=sse_body(["Hello", " world"]),
+        )
+
+    client = AsyncOpenAI(
+        api_key="test_key",
+        base_url="http://upstream.test/v1",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+    monkeypatch.setattr(redirect_llm, "_client", client)
+    monkeypatch.setenv("MOONSHOT_MODEL", "upstream-model")
+    return calls
+
+
+def test_redirect_llm_stream_chat(upstream):
+    req = ChatCompletionRequest(model="redirect-model", messages=[ChatMessage(role="user", content="hi")])
+
+    async def collect():
+        return [chunk async for chunk in redirect_llm.redirect_llm_stream_chat(req)]
+
+    chunks = asyncio.run(collect())
+    assert "".join(chunk.choices[0].delta.content for chunk in chunks) == "Hello world"
+    assert chunks[-1].choices[0].finish_reason == "stop"
+    assert len(upstream) == 1
+
+
+def test_redirect_client_is_shared(upstream):
+    assert redirect_llm.get_client() is redirect_llm.get_client()
+
+
+def test_redirect_llm_passthrough_chat(upstream):
+    req = ChatCompletionRequest(model="redirect-model", messages=[ChatMessage(role="user", content="hi")], stream=True)
+
+    async def collect():
+        return b"".join([frames async for frames in redirect_llm.redirect_llm_passthrough_chat(req)])
+
+    body = asyncio.run(collect())
+    frames = [frame for frame in body.split(b"\n\n") if frame]
+    assert frames[-1] == b"data: [DONE]"
+    chunks = [json.loads(frame[len(b"data: "):]) for frame in frames[:-1]]
+    assert {chunk["model"] for chunk in chunks} == {"redirect-model"}
+    assert "".join(chunk["choices"][0]["delta"]["content"] for chunk in chunks) == "Hello world"
+    assert json.loads(upstream[0].content)["model"] == "upstream-model"
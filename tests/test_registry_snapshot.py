@@ -0,0 +1,69 @@
+import asyncio
+import multiprocessing
+
+from rdify.registry_snapshot import RegistrySnapshot
+from rdify.models import ModelRegistry
+from rdify.apps.dify import load_apps
+from rdify.apps.dify.schemas import DifyAppModel
+from rdify.apps.fake_llvm import register_fake_llvm
+
+
+def _discover_in_process(path, counter):
+    def discover():
+        with counter.get_lock():
+            counter.value += 1
+        return {"dify_apps": [{"id": "1", "name": "app-a", "api_keys": []}]}
+    snapshot = RegistrySnapshot(path).load_or_discover(discover)
+    assert snapshot["payload"]["dify_apps"][0]["name"] == "app-a"
+
+
+def test_workers_share_one_discovery(tmp_path):
+    ctx = multiprocessing.get_context("fork")
+    counter = ctx.Value("i", 0)
+    workers = [ctx.Process(target=_discover_in_process, args=(tmp_path / "snapshot.json", counter)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=10)
+        assert worker.exitcode == 0
+    assert counter.value == 1
+
+
+def test_force_and_failed_discovery_bump_versions(tmp_path):
+    store = RegistrySnapshot(tmp_path / "snapshot.json")
+    first = store.load_or_discover(lambda: {"dify_apps": []})
+    assert first["version"] == 1
+    assert store.load_or_discover(lambda: {"dify_apps": []})["version"] == 1
+    assert store.load_or_discover(lambda: {"dify_apps": []}, force=True)["version"] == 2
+    # 发现失败时沿用已有快照
+    assert store.load_or_discover(lambda: None, force=True)["version"] == 2
+
+
+def test_watch_applies_new_version(tmp_path):
+    path = tmp_path / "snapshot.json"
+    writer = RegistrySnapshot(path)
+    reader = RegistrySnapshot(path)
+    applied = []
+
+    async def run():
+        reader.mark_applied(writer.load_or_discover(lambda: {"n": 1}))
+        task = asyncio.create_task(reader.watch(applied.append, interval=0.01))
+        await asyncio.sleep(0.03)
+        writer.load_or_discover(lambda: {"n": 2}, force=True)
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+    asyncio.run(run())
+    assert [snapshot["payload"]["n"] for snapshot in applied] == [2]
+    assert reader.version == 2
+
+
+def test_load_apps_replaces_only_dify_models():
+    registry = ModelRegistry()
+    register_fake_llvm(registry)
+    load_apps(registry, [DifyAppModel(id="1", name="app-a"), DifyAppModel(id="2", name="app-b")])
+    old_models = registry.models
+    load_apps(registry, [DifyAppModel(id="2", name="app-b")])
+    assert set(registry.models) == {"test-model", "test-model-long-repeat", "app-b"}
+    # 旧引用保持不变，读取方不会看到中间状态
+    assert "app-a" in old_models
@@ -0,0 +1,99 @@
+import os
+import asyncio
+import time
+
+from fastapi.testclient import TestClient
+
+from rdify.app import app
+from rdify.apps.fake_llvm import register_fake_llvm
+from rdify.llm_models import MODEL_REGISTRY
+from rdify.openai_schemas import ChatCompletionRequest
+from rdify.response_cache import RESPONSE_CACHE, ResponseCache, cache_key
+
+
+def _request(**kwargs):
+    return ChatCompletionRequest(model="test-model", messages=[{"role": "user", "content": "hi"}], **kwargs)
+
+
+def test_cache_key_ignores_stream_and_user():
+    assert cache_key(_request(temperature=0), "chat") == cache_key(_request(temperature=0, stream=True, user="u"), "chat")
+    assert cache_key(_request(temperature=0), "chat") != cache_key(_request(temperature=0, top_p=0.5), "chat")
+    assert cache_key(_request(temperature=0), "chat") != cache_key(_request(temperature=0), "completion")
+
+
+def test_only_deterministic_requests_are_cached(tmp_path):
+    cache = ResponseCache(enabled=True, directory=tmp_path)
+    assert cache.key_for(_request(), "chat") is None
+    assert cache.key_for(_request(temperature=0.7), "chat") is None
+    assert cache.key_for(_request(temperature=0), "chat") is not None
+
+
+def test_memory_and_disk_tiers(tmp_path):
+    data = {"choices": [{"index": 0, "text": "x" * 100, "finish_reason": "stop"}]}
+
+    async def run():
+        cache = ResponseCache(enabled=True, directory=tmp_path, memory_entries=1, disk_max_bytes=1000)
+        for i in range(20):
+            await cache.put(f"{i:02d}" + "0" * 62, data)
+        assert len(cache._memory) == 1
+        # 第一个键已从内存淘汰，也已因磁盘大小上限被删除
+        assert await cache.get("00" + "0" * 62, "m", "completion") is None
+        assert await cache.get("19" + "0" * 62, "m", "completion") == data
+        assert cache._disk_bytes <= 1000
+
+        fresh = ResponseCache(enabled=True, directory=tmp_path)
+        assert await fresh.get("19" + "0" * 62, "m", "completion") == data
+
+        expired = ResponseCache(enabled=True, directory=tmp_path, ttl=0.01)
+        await expired.put("ff" + "0" * 62, data)
+        expired._memory.clear()
+        time.sleep(0.02)
+        assert await expired.get("ff" + "0" * 62, "m", "completion") is None
+        assert not (tmp_path / "ff" / ("ff" + "0" * 62 + ".json")).exists()
+
+    asyncio.run(run())
+
+
+def test_eviction_keeps_recently_read_entries(tmp_path):
+    data = {"choices": [{"index": 0, "text": "x" * 100, "finish_reason": "stop"}]}
+    keys = [f"{i:02d}" + "0" * 62 for i in range(3)]
+
+    async def run():
+        cache = ResponseCache(enabled=True, directory=tmp_path, memory_entries=0, disk_max_bytes=10000)
+        assert ResponseCache(ttl=0).ttl == 0
+        for key in keys:
+            await cache.put(key, data)
+        for age, key in enumerate(reversed(keys), start=1):
+            os.utime(cache._path(key), (time.time() - age, time.time() - age))
+        # 读取会刷新 mtime，最早写入的条目变为最近使用
+        assert await cache.get(keys[0], "m", "completion") == data
+        cache.disk_max_bytes = cache._disk_bytes - 1
+        cache._evict()
+        assert cache._path(keys[0]).exists()
+        assert not cache._path(keys[1]).exists()
+
+    asyncio.run(run())
+
+
+def test_cache_hit_replays_stream(tmp_path, monkeypatch):
+    register_fake_llvm(MODEL_REGISTRY)
+    monkeypatch.setattr(RESPONSE_CACHE, "enabled", True)
+    monkeypatch.setattr(RESPONSE_CACHE, "directory", tmp_path)
+    monkeypatch.setattr(RESPONSE_CACHE, "_memory", type(RESPONSE_CACHE._memory)())
+    monkeypatch.setattr(RESPONSE_CACHE, "_disk_bytes", None)
+    client = TestClient(app)
+    body = {"model": "test-model", "messages": [{"role": "user", "content": "hi"}], "temperature": 0}
+
+    first = client.post("/v1/chat/completions", json=body)
+    assert first.headers["X-Rdify-Cache"] == "MISS"
+    content = first.json()["choices"][0]["message"]["content"]
+
+    with client.stream("POST", "/v1/chat/completions", json={**body, "stream": True}) as second:
+        assert second.headers["X-Rdify-Cache"] == "HIT"
+        frames = b"".join(second.iter_bytes())
+    assert frames.endswith(b"data: [DONE]\n\n")
+    assert "user:hi" in frames.decode() and "user:hi" in content
+
+    uncached = client.post("/v1/chat/completions", json={**body, "temperature": 1})
+    assert "X-Rdify-Cache" not in uncached.headers
+    assert 'rdify_cache_requests_total{model="test-model",kind="chat",result="memory"}' in client.get("/metrics").text
@@ -1,7 +1,7 @@
 import pickle
 from pathlib import Path
 from unittest.mock import patch
-from rdify.openai_schemas import ChatCompletionRequest
+from rdify.openai_schemas import ChatCompletionRequest, ChatMessage
 from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
 from rdify.config import logs_dir
 from rdify.apps.run_task_llm import check_run_task_is_finished
@@ -94,7 +94,7 @@ def test_convert_conversation_to_chat_completion_request():
     conversation = pickle.loads(file_path.read_bytes())
     req = run_task_llm.convert_conversation_to_chat_completion_request(conversation)
     assert isinstance(req, ChatCompletionRequest)
-    print(run_task_llm.map_message_to_string(req))
+    print(run_task_llm.ConversationAccumulator(req).task_log())
 
 
 @patch(
@@ -112,3 +112,47 @@ def test_check_conversation_is_finished(mock_check_run_task_is_finished):
     conversation = pickle.loads(file_path.read_bytes())
     resp = run_task_llm.check_conversation_is_finished(conversation)
     mock_check_run_task_is_finished.assert_called_once()
+
+
+def _chunk(content, role=None, finish_reason=None):
+    return ChatCompletionChunk(
+        id="c", object="chat.completion.chunk", created=0, model="m",
+        choices=[{"index": 0, "delta": {"role": role, "content": content}, "finish_reason": finish_reason}],
+    )
+
+
+def test_conversation_accumulator_matches_full_conversion():
+    req = ChatCompletionRequest(model="run-task-model", messages=[{"role": "user", "content": "deploy"}])
+    conversation = [req, _chunk("", role="assistant"), _chunk("step 1"), _chunk(" done")]
+    accumulator = run_task_llm.ConversationAccumulator(req)
+    for chunk in conversation[1:]:
+        accumulator.add(chunk)
+    assert accumulator.task_log() == "\nuser: deploy\nassistant: step 1 done"
+    messages = accumulator.to_request().messages
+    assert [(m.role, m.content) for m in messages] == [("user", "deploy"), ("assistant", "step 1 done")]
+    assert run_task_llm.convert_conversation_to_task_log(conversation) == accumulator.task_log()
+
+    # 续写轮次的输出并入同一条助手消息
+    accumulator.add(_chunk("", role="assistant"))
+    accumulator.add(_chunk(", step 2 done"))
+    assert accumulator.task_log().endswith("assistant: step 1 done, step 2 done")
+
+
+def test_conversation_accumulator_appends_without_rebuilding(monkeypatch):
+    req = ChatCompletionRequest(model="run-task-model", messages=[{"role": "user", "content": "go"}])
+    accumulator = run_task_llm.ConversationAccumulator(req)
+    accumulator.add(_chunk("", role="assistant"))
+    built = []
+    monkeypatch.setattr(run_task_llm, "ChatMessage", lambda **kwargs: built.append(kwargs) or ChatMessage(**kwargs))
+
+    chunk = _chunk("token ")
+    for _ in range(1000):
+        accumulator.add(chunk)
+    # 追加 chunk 只记录片段，不构建消息对象
+    assert built == []
+    log = accumulator.task_log()
+    assert log == "\nuser: go\nassistant: " + "token " * 1000
+    # 没有新内容时复用已拼接的日志
+    assert accumulator.task_log() is log
+    assert accumulator.to_request().messages[-1].content == "token " * 1000
+    assert len(built) == 1
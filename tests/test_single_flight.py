@@ -0,0 +1,83 @@
+import asyncio
+
+from rdify.single_flight import SingleFlight
+from rdify.sse import StreamDelta
+
+
+def test_concurrent_subscribers_share_one_upstream():
+    calls = []
+
+    def factory(**overrides):
+        calls.append(overrides)
+
+        async def upstream():
+            for word in ("a", "b", "c"):
+                await asyncio.sleep(0.01)
+                yield StreamDelta(word)
+        return upstream()
+
+    async def consume(flight: SingleFlight, delay: float):
+        await asyncio.sleep(delay)
+        return [chunk.content async for chunk in flight.subscribe("k", "m", factory)]
+
+    async def run():
+        flight = SingleFlight(enabled=True)
+        results = await asyncio.gather(*(consume(flight, i * 0.001) for i in range(20)))
+        return results, flight
+
+    results, flight = asyncio.run(run())
+    assert len(calls) == 1
+    assert "cancel_scope" in calls[0]
+    assert all(result == ["a", "b", "c"] for result in results)
+    assert flight.flights == {}
+
+
+def test_upstream_cancelled_when_all_subscribers_leave():
+    state = {}
+
+    def factory(**overrides):
+        async def upstream():
+            try:
+                while True:
+                    await asyncio.sleep(0.01)
+                    yield StreamDelta("x")
+            finally:
+                state["closed"] = True
+        return upstream()
+
+    async def run():
+        flight = SingleFlight(enabled=True)
+        gens = [flight.subscribe("k", "m", factory) for _ in range(2)]
+        for gen in gens:
+            await gen.__anext__()
+        await gens[0].aclose()
+        await asyncio.sleep(0.03)
+        assert "closed" not in state
+        await gens[1].aclose()
+        await asyncio.sleep(0.01)
+        return flight
+
+    assert asyncio.run(run()).flights == {}
+    assert state["closed"]
+
+
+def test_error_is_delivered_to_every_subscriber():
+    def factory(**overrides):
+        async def upstream():
+            yield StreamDelta("a")
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upstream failed")
+        return upstream()
+
+    async def consume(flight):
+        try:
+            async for _ in flight.subscribe("k", "m", factory):
+                pass
+        except RuntimeError as e:
+            return str(e)
+
+    async def run():
+        flight = SingleFlight(enabled=True)
+        return await asyncio.gather(consume(flight), consume(flight))
+
+    assert asyncio.run(run()) == ["upstream failed", "upstream failed"]
@@ -0,0 +1,94 @@
+import asyncio
+
+from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
+
+from rdify.apps import run_task_llm
+from rdify.apps.task_judge import TaskIsFinishedResponse
+from rdify.metrics import REGISTRY
+from rdify.openai_schemas import ChatCompletionRequest
+
+
+def _chunk(content, role=None, finish_reason=None):
+    return ChatCompletionChunk(
+        id="c", object="chat.completion.chunk", created=0, model="m",
+        choices=[{"index": 0, "delta": {"role": role, "content": content}, "finish_reason": finish_reason}],
+    )
+
+
+def _run_rounds(monkeypatch, model, verdicts, judge_delay=0.05, ttft=0.05, finishes=1):
+    """
+    每轮上游先等待 ttft 再输出，最后给出 finishes 个结束 chunk；判断耗时 judge_delay，依次返回 verdicts。
+    events 按发生顺序记录 upstream / judge / judged，closed 是生成结束时已关闭的轮次
+    """
+    events = []
+    closed = []
+    verdicts = list(verdicts)
+
+    async def judge(accumulator, session):
+        events.append("judge")
+        await asyncio.sleep(judge_delay)
+        events.append("judged")
+        return TaskIsFinishedResponse(is_finished=verdicts.pop(0), message="")
+
+    monkeypatch.setattr(run_task_llm, "check_conversation_is_finished_async", judge)
+
+    @run_task_llm.continue_stream(loop_count=3)
+    async def upstream(req, **kwargs):
+        events.append("upstream")
+        try:
+            await asyncio.sleep(ttft)
+            yield _chunk("", role="assistant")
+            yield _chunk(f"round{len(req.messages)}")
+            for _ in range(finishes):
+                yield _chunk("", finish_reason="stop")
+        finally:
+            closed.append(len(req.messages))
+
+    req = ChatCompletionRequest(model=model, messages=[{"role": "user", "content": "go"}])
+
+    async def _run():
+        chunks = [chunk async for chunk in upstream(req)]
+        # 在事件循环关闭（回收残留的异步生成器）之前取快照
+        return chunks, sorted(closed)
+
+    chunks, closed = asyncio.run(_run())
+    return chunks, events, closed
+
+
+def test_speculative_round_overlaps_judge(monkeypatch):
+    monkeypatch.setenv("RDIFY_SPECULATIVE_CONTINUATION", "spec-model")
+    chunks, events, closed = _run_rounds(monkeypatch, "spec-model", [False, True])
+    text = "".join(chunk.choices[0].delta.content or "" for chunk in chunks)
+    assert text == "round1round2"
+    assert chunks[-1].choices[0].finish_reason == "stop"
+    # 每次判断期间下一轮上游都已发起：第二轮被采用，第三轮被丢弃
+    assert events == ["upstream", "judge", "upstream", "judged", "judge", "upstream", "judged"]
+    # 被采用的第二轮在任务完成时已关闭，而不是等到垃圾回收
+    assert closed == [1, 2, 2]
+
+
+def test_speculation_is_cancelled_and_counted_when_finished(monkeypatch):
+    monkeypatch.setenv("RDIFY_SPECULATIVE_CONTINUATION", "*")
+    chunks, events, closed = _run_rounds(monkeypatch, "wasted-model", [True])
+    assert events == ["upstream", "judge", "upstream", "judged"]
+    assert closed == [1, 2]
+    assert 'rdify_speculative_continuations_total{model="wasted-model",outcome="wasted"} 1' in REGISTRY.render()
+
+
+def test_repeated_finish_chunk_discards_previous_speculation(monkeypatch):
+    monkeypatch.setenv("RDIFY_SPECULATIVE_CONTINUATION", "double-finish-model")
+    chunks, events, closed = _run_rounds(monkeypatch, "double-finish-model", [False, False, True], finishes=2)
+    assert "".join(chunk.choices[0].delta.content or "" for chunk in chunks) == "round1round2"
+    # 第一轮的两个结束 chunk 各发起一次推测，前一次被丢弃而不是留在后台继续运行
+    assert events == ["upstream", "judge", "upstream", "judged", "judge", "upstream", "judged", "judge", "upstream", "judged"]
+    assert closed == [1, 2, 2, 2]
+    text = REGISTRY.render()
+    assert 'rdify_speculative_continuations_total{model="double-finish-model",outcome="wasted"} 2' in text
+    assert 'rdify_speculative_continuations_total{model="double-finish-model",outcome="used"} 1' in text
+
+
+def test_speculation_disabled_by_default(monkeypatch):
+    monkeypatch.delenv("RDIFY_SPECULATIVE_CONTINUATION", raising=False)
+    _, events, closed = _run_rounds(monkeypatch, "plain-model", [False, True])
+    assert events == ["upstream", "judge", "judged", "upstream", "judge", "judged"]
+    assert closed == [1, 2]
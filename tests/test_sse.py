@@ -0,0 +1,147 @@
+import json
+import time
+import asyncio
+
+import httpx
+
+from rdify.app import app
+from rdify.llm_models import MODEL_REGISTRY
+from rdify.apps.fake_llvm import register_fake_llvm
+
+from rdify.openai_schemas import (
+    ChatCompletionChoice,
+    ChatCompletionResponse,
+    ChatMessage,
+    ChoiceDeltaContent,
+    CompletionChoice,
+    CompletionResponse,
+)
+from rdify.sse import StreamDelta, ChatSSEEncoder, CompletionSSEEncoder, SSEFrameParser
+
+CHUNKS = 2000
+WORDS = ["你好", "hello", " world", "\"quoted\"", "\n"]
+
+
+def parse_frame(frame: bytes) -> dict:
+    assert frame.startswith(b"data: ") and frame.endswith(b"\n\n")
+    return json.loads(frame[len(b"data: "):])
+
+
+def test_chat_encoder_matches_pydantic_envelope():
+    resp = ChatCompletionResponse(model="test-model", choices=[])
+    encoder = ChatSSEEncoder(resp)
+    for word in WORDS:
+        resp.choices = [ChatCompletionChoice(
+            index=0,
+            message=ChatMessage(role="assistant", content=word),
+            finish_reason=None,
+            delta=ChoiceDeltaContent(content=word, role="assistant"),
+        )]
+        expected = json.loads(resp.model_dump_json())
+        assert parse_frame(encoder.encode(StreamDelta(word, role="assistant"))) == expected
+
+
+def test_chat_encoder_defaults_missing_role_in_message():
+    encoder = ChatSSEEncoder(ChatCompletionResponse(model="test-model", choices=[]))
+    frame = parse_frame(encoder.encode(StreamDelta("hi")))
+    choice = ChatCompletionResponse.model_validate(frame).choices[0]
+    assert choice.message == ChatMessage(role="assistant", content="hi")
+    assert choice.delta.role is None
+
+
+def test_completion_encoder_matches_pydantic_envelope():
+    resp = CompletionResponse(model="test-model", choices=[])
+    encoder = CompletionSSEEncoder(resp)
+    resp.choices = [CompletionChoice(index=0, text="", finish_reason="stop")]
+    expected = json.loads(resp.model_dump_json())
+    assert parse_frame(encoder.encode(StreamDelta("", finish_reason="stop"))) == expected
+
+
+def _bench_pydantic() -> float:
+    resp = ChatCompletionResponse(model="test-model", choices=[])
+    start = time.perf_counter()
+    for i in range(CHUNKS):
+        word = WORDS[i % len(WORDS)]
+        resp.choices = [ChatCompletionChoice(
+            index=0,
+            message=ChatMessage(role="assistant", content=word),
+            finish_reason=None,
+            delta=ChoiceDeltaContent(content=word, role="assistant"),
+        )]
+        ("data: " + resp.model_dump_json() + "\n\n").encode()
+    return (time.perf_counter() - start) / CHUNKS
+
+
+def _bench_encoder() -> float:
+    resp = ChatCompletionResponse(model="test-model", choices=[])
+    start = time.perf_counter()
+    encoder = ChatSSEEncoder(resp)
+    for i in range(CHUNKS):
+        encoder.encode(StreamDelta(WORDS[i % len(WORDS)], role="assistant"))
+    return (time.perf_counter() - start) / CHUNKS
+
+
+def test_benchmark_chat_chunk_encoding():
+    before = min(_bench_pydantic() for _ in range(3))
+    after = min(_bench_encoder() for _ in range(3))
+    print(f"\nper-chunk encode: pydantic {before * 1e6:.2f}us, StreamDelta encoder {after * 1e6:.2f}us ({before / after:.1f}x)")
+    assert after < before
+
+
+def test_chat_completions_stream_frames():
+    register_fake_llvm(MODEL_REGISTRY)
+
+    async def call():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://rdify") as client:
+            resp = await client.post("/v1/chat/completions", json={
+                "model": "test-model",
+                "messages": [{"role": "user", "content": "hi"}],
+                "stream": True,
+            })
+            return resp.content
+
+    frames = [frame + b"\n\n" for frame in asyncio.run(call()).split(b"\n\n") if frame]
+    assert frames[-1] == b"data: [DONE]\n\n"
+    chunks = [parse_frame(frame) for frame in frames[:-1]]
+    assert len({chunk["id"] for chunk in chunks}) == 1
+    assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
+    assert "".join(chunk["choices"][0]["delta"]["content"] for chunk in chunks).endswith("user:hi\n")
+
+
+def test_frame_parser_rewrites_model_and_observes_finish():
+    upstream = (
+        b'data: {"id":"1","model":"moonshot-v1-8k","choices":[{"index":0,"delta":{"content":"\\"model\\":\\"x\\""},"finish_reason":null}]}\n\n'
+        b'data: {"id":"1","model":"moonshot-v1-8k","choices":[{"index":0,"delta":{},"finish_reason":"stop"}]}\n\n'
+        b"data: [DONE]\n\n"
+    )
+    parser = SSEFrameParser(model="redirect-model")
+    # 按任意边界切分输入
+    output = b"".join(parser.feed(upstream[i:i + 7]) for i in range(0, len(upstream), 7)) + parser.flush()
+
+    frames = [frame for frame in output.split(b"\n\n") if frame]
+    assert frames[-1] == b"data: [DONE]"
+    chunks = [json.loads(frame[len(b"data: "):]) for frame in frames[:-1]]
+    assert [chunk["model"] for chunk in chunks] == ["redirect-model", "redirect-model"]
+    assert chunks[0]["choices"][0]["delta"]["content"] == '"model":"x"'
+    assert parser.finish_reason == "stop"
+    assert parser.done
+
+
+def test_frame_parser_normalizes_crlf_split_across_chunks():
+    parser = SSEFrameParser()
+    first = parser.feed(b'data: {"choices":[]}\r\n\r')
+    second = parser.feed(b'\ndata: [DONE]\r')
+    third = parser.feed(b'\n\r\n')
+    assert first == b""
+    assert second == b'data: {"choices":[]}\n\n'
+    assert third == b"data: [DONE]\n\n"
+    assert parser.done
+    assert parser.flush() == b""
+
+
+def test_frame_parser_appends_done_when_missing():
+    parser = SSEFrameParser()
+    frame = b'data: {"choices":[]}\n\n'
+    assert parser.feed(frame) == frame
+    assert parser.flush() == b"data: [DONE]\n\n"
@@ -0,0 +1,67 @@
+import asyncio
+
+from rdify.apps.task_judge import TaskJudge, TaskIsFinishedResponse, heuristic_verdict
+
+
+class _CountingJudge(TaskJudge):
+    """
+    记录发给 LLM 的 prompt，不访问网络
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.prompts = []
+
+    async def _ask(self, prompt: str) -> TaskIsFinishedResponse:
+        await asyncio.sleep(0)
+        self.prompts.append(prompt)
+        return TaskIsFinishedResponse(is_finished=False, message=f"verdict {len(self.prompts)}")
+
+
+def test_heuristic_verdict():
+    assert heuristic_verdict("\nassistant: calling <tool_use>x</tool_use>\n").is_finished
+    # 问句交给 LLM 判断
+    assert heuristic_verdict("\nassistant: 需要确认目标环境吗？") is None
+    assert heuristic_verdict("\nassistant: what is left? let me check") is None
+    assert heuristic_verdict("\nuser: do it\nassistant: ").is_finished is False
+    assert heuristic_verdict("\nuser: do it\nassistant: working on step 1") is None
+
+
+def test_judge_caches_by_log_and_strips_thinking():
+    judge = _CountingJudge()
+
+    async def _run():
+        first = await judge.judge("\nassistant: <think>hmm</think>step 1 done")
+        second = await judge.judge("\nassistant: <think>other</think>step 1 done")
+        return first, second
+
+    first, second = asyncio.run(_run())
+    assert first == second
+    assert len(judge.prompts) == 1
+    assert "hmm" not in judge.prompts[0]
+
+
+def test_judge_cache_is_bounded():
+    judge = _CountingJudge(max_entries=2)
+
+    async def _run():
+        for log in ("\nassistant: a", "\nassistant: b", "\nassistant: c", "\nassistant: a"):
+            await judge.judge(log)
+
+    asyncio.run(_run())
+    assert len(judge.prompts) == 4
+
+
+def test_tail_only_session_sends_new_log_with_previous_verdict():
+    judge = _CountingJudge()
+    session = judge.session(tail_only=True)
+    head = "\nuser: deploy\nassistant: step 1 done"
+
+    async def _run():
+        await session.check(head)
+        await session.check(head + "\nassistant: step 2 done")
+
+    asyncio.run(_run())
+    assert "step 1 done" in judge.prompts[0]
+    assert "step 1 done" not in judge.prompts[1]
+    assert "step 2 done" in judge.prompts[1] and "verdict 1" in judge.prompts[1]